@@ -0,0 +1,71 @@
+'''
+Benchmark of the CPU-bound part of a bulk extract: decoding, tagging and serialising raw pages of building-like features, against the number of worker processes.
+"In-process" decodes every page in the parent process, as the wrappers do by default. Otherwise, pages are decoded by a PageDecoder on a process pool of the given size,
+and the parent only collects the finished chunks. Throughput is reported in features per second; it scales with the number of workers up to the number of cores.
+
+Usage:
+    python benchmarks/bulk_decode.py [number_of_pages] [output_format]
+where output_format is one of 'geojson', 'compact' or 'ndjson' (the default).
+'''
+
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from catalyst_ngd_wrappers.bulk import PAGE_SIZE, PageDecoder, decode_page
+
+NUMBER_OF_ATTRIBUTES: int = 40
+
+
+def make_page(page_number: int) -> bytes:
+    '''Creates the encoded JSON of a page of features, as returned by the OS NGD API.'''
+    random.seed(page_number)
+    features = []
+    for i in range(PAGE_SIZE):
+        osid = f'osid-{page_number}-{i}'
+        properties = {f'attribute{j}': f'Value {j}' if j % 3 else j * 1.5 for j in range(NUMBER_OF_ATTRIBUTES)}
+        properties |= {'osid': osid, 'description': 'Building'}
+        ring = [[random.uniform(0, 1000), random.uniform(0, 1000)] for _ in range(30)]
+        ring.append(ring[0])
+        features.append({
+            'type': 'Feature',
+            'id': osid,
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': properties
+        })
+    links = [{'rel': 'self', 'href': 'https://api.os.uk/'}, {'rel': 'next', 'href': 'https://api.os.uk/'}]
+    return json.dumps({'type': 'FeatureCollection', 'numberReturned': PAGE_SIZE, 'features': features, 'links': links}).encode()
+
+
+def main(number_of_pages: int = 200, output_format: str = 'ndjson') -> None:
+    '''Reports the decoding throughput in-process, and with an increasing number of worker processes.'''
+    pages = [make_page(i) for i in range(number_of_pages)]
+    options = {'compact': output_format == 'compact', 'serialise': output_format == 'ndjson'}
+    number_of_features = number_of_pages * PAGE_SIZE
+
+    start = time.perf_counter()
+    for page in pages:
+        decode_page(page, 'bld-fts-building-4', **options)
+    elapsed = time.perf_counter() - start
+    print(f'in-process: {number_of_features / elapsed:,.0f} features/s')
+
+    cores = os.cpu_count() or 1
+    worker_counts = sorted({n for n in (1, 2, 4, 8, 16) if n <= cores} | {cores})
+    for max_workers in worker_counts:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            decoder = PageDecoder(executor, **options)
+            # Warm up the workers, so that process start-up is not timed
+            decoder.submit(pages[0], 'bld-fts-building-4').result()
+            start = time.perf_counter()
+            futures = [decoder.submit(page, 'bld-fts-building-4') for page in pages]
+            for future in futures:
+                future.result()
+            elapsed = time.perf_counter() - start
+        print(f'{max_workers} worker(s): {number_of_features / elapsed:,.0f} features/s')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) if i == 0 else arg for i, arg in enumerate(sys.argv[1:3])))
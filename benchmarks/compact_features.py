@@ -0,0 +1,60 @@
+'''
+Benchmark of the memory used by compact feature records, compared to the standard GeoJSON feature dictionaries.
+Synthetic building features are generated to mimic OS NGD responses, and the memory held by each representation is measured with tracemalloc.
+
+Usage:
+    python benchmarks/compact_features.py [number_of_features]
+'''
+
+import sys
+import tracemalloc
+import uuid
+
+from catalyst_ngd_wrappers.features import compact_features
+
+COLLECTION = 'bld-fts-building-4'
+NUMBER_OF_ATTRIBUTES = 40
+
+
+def make_feature(i: int) -> dict:
+    '''Creates a synthetic OS NGD building feature, tagged as by the wrappers.'''
+    x, y = 400000 + i % 1000 * 20, 400000 + i // 1000 * 20
+    properties = {f'attribute{a}': f'value {a}' for a in range(NUMBER_OF_ATTRIBUTES)}
+    properties['osid'] = str(uuid.UUID(int=i))
+    properties['collection'] = COLLECTION
+    properties['searchAreaNumber'] = 0
+    return {
+        'type': 'Feature',
+        'id': properties['osid'],
+        'geometry': {
+            'type': 'Polygon',
+            'coordinates': [[[x, y], [x + 10, y], [x + 10, y + 10], [x, y + 10], [x, y]]]
+        },
+        'properties': properties,
+        'collection': COLLECTION,
+        'searchAreaNumber': 0
+    }
+
+
+def measure(build: callable) -> int:
+    '''Returns the number of bytes allocated and still held by the object returned by build().'''
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current
+
+
+def main(number_of_features: int = 100_000) -> None:
+    '''Prints the memory held by both representations.'''
+    dict_bytes = measure(lambda: [make_feature(i) for i in range(number_of_features)])
+    compact_bytes = measure(lambda: compact_features(make_feature(i) for i in range(number_of_features)))
+    print(f'features:         {number_of_features}')
+    print(f'GeoJSON dicts:    {dict_bytes / 2**20:8.1f} MiB ({dict_bytes / number_of_features:6.0f} B/feature)')
+    print(f'FeatureRecord:    {compact_bytes / 2**20:8.1f} MiB ({compact_bytes / number_of_features:6.0f} B/feature)')
+    print(f'reduction:        {1 - compact_bytes / dict_bytes:8.1%}')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
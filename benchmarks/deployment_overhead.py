@@ -0,0 +1,55 @@
+'''
+Micro-benchmark of the per-request overhead of the deployment layer, before and after precompiled routes.
+The wrapper function is replaced by a stub, so that only the overhead of schema handling and dispatch is measured.
+"Uncached" clears the compiled routes before every request, which reproduces building the schema and field sets per request.
+
+Usage:
+    python benchmarks/deployment_overhead.py [number_of_requests]
+'''
+
+import sys
+import timeit
+
+from catalyst_ngd_wrappers import deployment_utils
+from catalyst_ngd_wrappers.deployment_utils import BaseSerialisedRequest, construct_features_response
+from catalyst_ngd_wrappers.deployment_schemas import LimitGeomColSchema
+
+
+def stub_ngd_api_func(**kwargs) -> dict:
+    '''Stands in for a wrapper function, returning a minimal response.'''
+    return {'type': 'FeatureCollection', 'numberReturned': 0, 'features': []}
+
+
+def make_request() -> BaseSerialisedRequest:
+    '''Creates a typical request to the items-limit-geom-col endpoint.'''
+    return BaseSerialisedRequest(
+        method='GET',
+        url='/features/ngd/ofa/v1/items-limit-geom-col',
+        params={
+            'collection': 'bld-fts-building-4,trn-ntwk-road-1',
+            'wkt': 'POINT (400000 400000)',
+            'limit': '500',
+            'filter-crs': '27700',
+            'use-latest-collection': 'true'
+        },
+        route_params={},
+        headers={}
+    )
+
+
+def run(cached: bool) -> None:
+    '''Handles a single request.'''
+    if not cached:
+        deployment_utils._compiled_routes.clear()
+    construct_features_response(make_request(), LimitGeomColSchema, stub_ngd_api_func)
+
+
+def main(number_of_requests: int = 20_000) -> None:
+    '''Prints the mean per-request overhead with and without precompiled routes.'''
+    for label, cached in (('uncached', False), ('precompiled', True)):
+        seconds = timeit.timeit(lambda: run(cached), number=number_of_requests)
+        print(f'{label:12} {seconds / number_of_requests * 1e6:8.1f} us/request')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
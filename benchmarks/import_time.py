@@ -0,0 +1,56 @@
+'''
+Benchmark of the cold-start import time of the package, as measured by python -X importtime.
+Each module is imported in a fresh interpreter several times, and the median cumulative import time is reported,
+alongside whether the heavy dependencies (requests, shapely, marshmallow) were imported.
+These are only imported once a request is made, a geometry is parsed, or a deployment schema is used.
+
+Usage:
+    python benchmarks/import_time.py [number_of_runs]
+'''
+
+import statistics
+import subprocess
+import sys
+
+MODULES: tuple[str, ...] = (
+    'catalyst_ngd_wrappers',
+    'catalyst_ngd_wrappers.deployment_utils'
+)
+HEAVY_DEPENDENCIES: tuple[str, ...] = ('requests', 'shapely', 'marshmallow')
+
+
+def measure(module: str) -> tuple[float, list[str]]:
+    '''Imports a module in a fresh interpreter, returning the cumulative import time in ms, and the heavy dependencies imported.'''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    cumulative_us = None
+    imported = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = line.split('|')
+        name = name.strip()
+        if name == module:
+            cumulative_us = int(cumulative)
+        if name in HEAVY_DEPENDENCIES:
+            imported.append(name)
+    return cumulative_us / 1000, imported
+
+
+def main(number_of_runs: int = 5) -> None:
+    '''Reports the median import time of each module.'''
+    for module in MODULES:
+        timings, imported = [], []
+        for _ in range(number_of_runs):
+            elapsed_ms, imported = measure(module)
+            timings.append(elapsed_ms)
+        print(f'{module}: {statistics.median(timings):.1f} ms (median of {number_of_runs})')
+        print(f'    heavy dependencies imported: {", ".join(imported) or "none"}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,66 @@
+'''
+Benchmark of merging the pages of a large composite call (several collections, each with several search areas, each with several pages) into a flat output.
+"Copied" concatenates the features into a new list at each level of nesting, as the wrappers do by default; "lazy" chains the page lists together with a FeatureChain, as with lazy_output.
+The merge time and the peak memory allocated by the merge are reported.
+
+Usage:
+    python benchmarks/lazy_output.py [number_of_collections] [search_areas_per_collection] [pages_per_search_area]
+'''
+
+import sys
+import time
+import tracemalloc
+
+from catalyst_ngd_wrappers.features import FeatureChain
+
+PAGE_SIZE: int = 100
+
+
+def make_pages(number_of_collections: int, number_of_areas: int, number_of_pages: int) -> list[list[list[list[dict]]]]:
+    '''Creates the nested pages of features of a composite call, by collection and search area.'''
+    return [
+        [
+            [[{'id': f'{c}-{a}-{p}-{i}'} for i in range(PAGE_SIZE)] for p in range(number_of_pages)]
+            for a in range(number_of_areas)
+        ]
+        for c in range(number_of_collections)
+    ]
+
+
+def merge(pages: list, container: type) -> int:
+    '''Merges the pages level by level (pages, then search areas, then collections), returning the number of features.'''
+    collections = []
+    for collection in pages:
+        areas = []
+        for area in collection:
+            features = container()
+            for page in area:
+                features += page
+            areas.append(features)
+        features = container()
+        for area in areas:
+            features += area
+        collections.append(features)
+    features = container()
+    for collection in collections:
+        features += collection
+    return len(features)
+
+
+def main(number_of_collections: int = 4, number_of_areas: int = 50, number_of_pages: int = 20) -> None:
+    '''Reports the time and peak memory of merging the pages with each approach.'''
+    pages = make_pages(number_of_collections, number_of_areas, number_of_pages)
+    for name, container in (('copied', list), ('lazy', FeatureChain)):
+        start = time.perf_counter()
+        number_of_features = merge(pages, container)
+        elapsed = time.perf_counter() - start
+        # Memory is traced in a separate run, as tracing slows the merge down
+        tracemalloc.start()
+        merge(pages, container)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{name}: {elapsed * 1000:.1f} ms, {peak / 1024 ** 2:.1f} MiB peak for {number_of_features} features')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:4]))
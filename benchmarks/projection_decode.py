@@ -0,0 +1,69 @@
+'''
+Benchmark of decoding a page of building-like features (60 attributes and a polygon geometry each), keeping only two properties and no geometry.
+"Full" decodes every field, as the wrappers do without a projection. "Projected" decodes the page with the json module and projects it immediately (the default decoder),
+and "incremental" skips the unrequested fields while parsing, with ijson (if installed).
+The decode time, the memory retained by the decoded page, and the peak memory allocated while decoding are reported.
+
+Usage:
+    python benchmarks/projection_decode.py [number_of_attributes]
+'''
+
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+from catalyst_ngd_wrappers.projection import Projection
+
+PAGE_SIZE: int = 100
+REPEATS: int = 50
+PROPERTIES: list[str] = ['osid', 'description']
+
+
+def make_page(number_of_attributes: int) -> bytes:
+    '''Creates the encoded JSON of a page of features.'''
+    random.seed(0)
+    features = []
+    for i in range(PAGE_SIZE):
+        properties = {f'attribute{j}': f'Value {j}' if j % 3 else j * 1.5 for j in range(number_of_attributes)}
+        properties |= {'osid': f'osid-{i}', 'description': 'Building'}
+        ring = [[random.uniform(0, 1000), random.uniform(0, 1000)] for _ in range(30)]
+        ring.append(ring[0])
+        features.append({
+            'type': 'Feature',
+            'id': f'osid-{i}',
+            'geometry': {'type': 'Polygon', 'coordinates': [ring]},
+            'properties': properties
+        })
+    return json.dumps({'type': 'FeatureCollection', 'numberReturned': PAGE_SIZE, 'features': features}).encode()
+
+
+def main(number_of_attributes: int = 60) -> None:
+    '''Reports the decode time and memory of each decoder.'''
+    page = make_page(number_of_attributes)
+    decoders = {
+        'full': json.loads,
+        'projected': Projection(PROPERTIES, include_geometry=False, incremental=False).decode,
+    }
+    try:
+        import ijson  # noqa: F401
+        decoders['incremental'] = Projection(PROPERTIES, include_geometry=False, incremental=True).decode
+    except ImportError:
+        print('ijson is not installed, so the incremental decoder is not benchmarked.')
+
+    for name, decode in decoders.items():
+        start = time.perf_counter()
+        for _ in range(REPEATS):
+            decode(page)
+        elapsed = (time.perf_counter() - start) / REPEATS
+        tracemalloc.start()
+        decoded = decode(page)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del decoded
+        print(f'{name}: {elapsed * 1000:.2f} ms per page, {retained / 1024:.0f} KiB retained, {peak / 1024:.0f} KiB peak ({len(page) / 1024:.0f} KiB page)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:2]))
@@ -0,0 +1,73 @@
+'''
+Micro-benchmark of the per-request Python overhead of preparing queries, with and without a compiled query plan.
+A dry run of items_limit_geom_col is planned for a multi-polygon search area, so that no requests are made and only the overhead of the wrappers is measured.
+"Uncompiled" repeats the preparation the wrappers previously did for every request: normalising the query parameters and serialising the search area to WKT.
+
+Usage:
+    python benchmarks/query_plan_overhead.py [number_of_search_areas] [vertices_per_search_area]
+'''
+
+import sys
+import time
+
+from shapely import MultiPolygon, Point
+
+from catalyst_ngd_wrappers import items_limit_geom_col
+from catalyst_ngd_wrappers.query_plan import QueryPlan
+from catalyst_ngd_wrappers.utils import multilevel_explode, prepare_parameters
+
+COLLECTIONS: list[str] = ['bld-fts-building-4', 'trn-ntwk-road-1']
+PARAMS: dict = {'filter-crs': 27700, 'crs': 27700}
+FILTER_PARAMS: dict = {'description': 'Building'}
+REQUEST_LIMIT: int = 50
+
+
+def make_search_area(number_of_areas: int, vertices: int) -> MultiPolygon:
+    '''Creates a multi-polygon of circular search areas, each with roughly the given number of vertices.'''
+    quad_segs = max(1, vertices // 4)
+    return MultiPolygon([
+        Point(400000 + 1000 * i, 400000).buffer(250, quad_segs=quad_segs)
+        for i in range(number_of_areas)
+    ])
+
+
+def run_uncompiled(search_area: MultiPolygon) -> int:
+    '''Prepares the parameters of every request from scratch, returning the number of requests prepared.'''
+    number_of_requests = 0
+    for _ in COLLECTIONS:
+        for geom in multilevel_explode(search_area):
+            for page in range(REQUEST_LIMIT):
+                params = dict(PARAMS) | {'offset': page * 100}
+                prepare_parameters(query_params=params, filter_params=dict(FILTER_PARAMS), wkt=geom)
+                number_of_requests += 1
+    return number_of_requests
+
+
+def run_compiled(search_area: MultiPolygon) -> int:
+    '''Plans every request through the wrappers with a compiled query plan, returning the number of requests planned.'''
+    plan = QueryPlan(dry_run=True)
+    items_limit_geom_col(
+        collection=COLLECTIONS,
+        wkt=search_area,
+        request_limit=REQUEST_LIMIT,
+        params=PARAMS,
+        filter_params=FILTER_PARAMS,
+        authenticate=False,
+        log_request_details=False,
+        query_plan=plan
+    )
+    return len(plan.explain())
+
+
+def main(number_of_areas: int = 10, vertices: int = 500) -> None:
+    '''Reports the mean preparation time per request, with and without a compiled query plan.'''
+    search_area = make_search_area(number_of_areas, vertices)
+    for name, run in (('uncompiled', run_uncompiled), ('compiled plan', run_compiled)):
+        start = time.perf_counter()
+        number_of_requests = run(search_area)
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {elapsed / number_of_requests * 1e6:.1f} µs per request ({number_of_requests} requests)')
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -0,0 +1,66 @@
+'''
+Benchmark of client-side spatial post-processing of a page of features: a per-feature Python loop, against the vectorised Shapely 2 operations of SpatialPostProcessor.
+Each feature is tested with an exact 'within' predicate, clipped to the search area, and the area of the intersection measured.
+
+Usage:
+    python benchmarks/spatial_post_processing.py [number_of_features]
+'''
+
+import sys
+import time
+
+from shapely import box
+from shapely.geometry import mapping, shape
+
+from catalyst_ngd_wrappers.spatial import SpatialPostProcessor
+
+SEARCH_AREA = box(0, 0, 1000, 1000).buffer(50, quad_segs=16)
+
+
+def make_features(number_of_features: int) -> list[dict]:
+    '''Creates a page of building-sized polygon features on a grid overlapping the search area.'''
+    side = int(number_of_features ** 0.5) + 1
+    spacing = 1200 / side
+    return [
+        {
+            'type': 'Feature',
+            'id': str(i),
+            'geometry': mapping(box(x * spacing - 100, y * spacing - 100, x * spacing - 100 + 15, y * spacing - 100 + 10)),
+            'properties': {}
+        }
+        for i, (x, y) in enumerate((i % side, i // side) for i in range(number_of_features))
+    ]
+
+
+def run_loop(features: list[dict]) -> int:
+    '''Post-processes each feature in turn, as in a per-feature Python loop.'''
+    kept = []
+    for feature in features:
+        geom = shape(feature['geometry'])
+        if not geom.within(SEARCH_AREA):
+            continue
+        intersection = geom.intersection(SEARCH_AREA)
+        feature['geometry'] = mapping(intersection)
+        feature['properties']['intersectionArea'] = intersection.area
+        kept.append(feature)
+    return len(kept)
+
+
+def run_vectorised(features: list[dict]) -> int:
+    '''Post-processes the page with the vectorised operations of SpatialPostProcessor.'''
+    processor = SpatialPostProcessor(predicate='within', clip=True, measure=True).bind(SEARCH_AREA)
+    return len(processor.process(features))
+
+
+def main(number_of_features: int = 10000) -> None:
+    '''Reports the time to post-process a page of features with each approach.'''
+    for name, run in (('per-feature loop', run_loop), ('vectorised', run_vectorised)):
+        features = make_features(number_of_features)
+        start = time.perf_counter()
+        kept = run(features)
+        elapsed = time.perf_counter() - start
+        print(f'{name}: {elapsed * 1000:.1f} ms for {number_of_features} features ({kept} kept)')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
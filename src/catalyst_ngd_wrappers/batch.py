@@ -0,0 +1,174 @@
+'''
+Batch queries for the OS NGD API - Features wrappers.
+Runs many small, independent queries (eg. one point or buffer per address) concurrently on a shared thread pool.
+Identical queries are only requested once, connections are pooled and reused, and requests can be rate limited across all threads.
+Each query returns its own result or error response, so one failed query does not stop the batch.
+'''
+
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterator
+
+import requests as r
+from requests.adapters import HTTPAdapter
+
+from .retries import RateLimiter
+from .utils import construct_error_response
+
+DEFAULT_MAX_WORKERS: int = 8
+
+
+def create_session(pool_size: int = DEFAULT_MAX_WORKERS) -> r.Session:
+    '''Creates a requests session with a connection pool large enough to be shared by pool_size threads.'''
+    session = r.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def query_spec_key(spec: dict) -> str:
+    '''Returns a canonical key for a query spec, such that identical queries share the same key.'''
+    spec = dict(spec)
+    wkt = spec.get('wkt')
+    if wkt is not None:
+        spec['wkt'] = ' '.join(wkt.split()) if isinstance(wkt, str) else wkt.wkt
+    return json.dumps(spec, sort_keys=True, default=str)
+
+
+def resolve_latest_collections(specs: list[dict], use_latest_collection: bool = False) -> tuple[list[dict], dict[int, dict]]:
+    '''
+    Resolves the latest collection versions for every query spec in a single request, rather than one request per query.
+    Specs which use the latest collection have use_latest_collection removed and their collection (or each of their collections) replaced by its latest version.
+    Returns the resolved specs, aligned to specs, and an error response for the index of each spec whose collection could not be resolved,
+    eg. because the collections could not be requested. Other specs are unaffected.
+    '''
+    from .ngd_api_wrappers import get_latest_collection_versions
+
+    latest = latest_error = None
+    resolved, errors = [], {}
+    for index, spec in enumerate(specs):
+        needed = spec.get('use_latest_collection', use_latest_collection)
+        spec = {k: v for k, v in spec.items() if k != 'use_latest_collection'}
+        resolved.append(spec)
+        collection = spec.get('collection')
+        if not needed or collection is None:
+            continue
+        try:
+            collections = [collection] if isinstance(collection, str) else list(collection)
+            if all(col[-1].isdigit() for col in collections):
+                continue
+            if latest is None and latest_error is None:
+                try:
+                    latest = get_latest_collection_versions()
+                except Exception as e:
+                    latest_error = construct_error_response(
+                        status_code = 500,
+                        message = f'The latest collection versions could not be found. {type(e).__name__}: {e}'
+                    )
+            if latest_error is not None:
+                errors[index] = latest_error
+                continue
+            collections = [col if col[-1].isdigit() else latest.get(col, col) for col in collections]
+            spec['collection'] = collections[0] if isinstance(collection, str) else collections
+        except Exception as e:
+            errors[index] = construct_error_response(
+                status_code = 500,
+                message = f'{type(e).__name__}: {e}'
+            )
+    return resolved, errors
+
+
+def iter_batch_items(
+    specs: list[dict],
+    func: callable = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    requests_per_second: float = None,
+    session: r.Session = None,
+    **kwargs
+) -> Iterator[tuple[int, dict]]:
+    '''
+    Runs a batch of independent queries concurrently, yielding (index, result) tuples in the order the queries complete.
+    Parameters:
+        specs (list of dict) - The queries to run. Each spec is a dictionary of parameters for func, typically collection, wkt, filter_params and params.
+        func (callable, default items) - The wrapper function to run each query with. Any of the items family may be used.
+        max_workers (int, default 8) - The number of queries to run at once.
+        requests_per_second (float, optional) - If supplied, requests across the whole batch are rate limited to this rate.
+        session (requests.Session, optional) - A session to share between all queries. By default, a session with a connection pool of max_workers connections is created.
+        **kwargs - Other parameters passed to func for every query, eg. headers, authenticate. Parameters in a spec take precedence.
+    Identical specs are only queried once; each of their indexes is yielded with the same result object.
+    If a query raises an exception, or its latest collection version cannot be resolved, its result is an error response rather than the exception being raised.
+    If the iterator is closed early, queries which have not started are cancelled.
+    '''
+    if func is None:
+        from .ngd_api_wrappers import items
+        func = items
+
+    specs, errors = resolve_latest_collections(specs, kwargs.pop('use_latest_collection', False))
+    for index, error in errors.items():
+        yield index, error
+
+    indexes_by_key = {}
+    unique_specs = {}
+    for index, spec in enumerate(specs):
+        if index in errors:
+            continue
+        key = query_spec_key(spec)
+        indexes_by_key.setdefault(key, []).append(index)
+        unique_specs.setdefault(key, spec)
+
+    own_session = session is None
+    if own_session:
+        session = create_session(max_workers)
+    kwargs['session'] = session
+    if requests_per_second:
+        kwargs['rate_limiter'] = RateLimiter(requests_per_second)
+
+    def run_query(spec: dict) -> dict:
+        '''Runs a single query, converting any exception into an error response.'''
+        try:
+            return func(**(kwargs | spec))
+        except Exception as e:
+            return construct_error_response(
+                status_code = 500,
+                message = f'{type(e).__name__}: {e}'
+            )
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ngd-batch')
+    try:
+        futures = {
+            executor.submit(run_query, spec): key
+            for key, spec in unique_specs.items()
+        }
+        for future in as_completed(futures):
+            result = future.result()
+            for index in indexes_by_key[futures[future]]:
+                yield index, result
+    finally:
+        # Queued queries are cancelled, so that closing the iterator early only waits for the queries already running
+        executor.shutdown(cancel_futures=True)
+        if own_session:
+            session.close()
+
+
+def batch_items(
+    specs: list[dict],
+    func: callable = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    requests_per_second: float = None,
+    **kwargs
+) -> list[dict]:
+    '''
+    Runs a batch of independent queries concurrently, returning a list of results aligned to the order of specs.
+    Takes the same parameters as iter_batch_items, which can be used instead to process results as they complete.
+    '''
+    results = [None] * len(specs)
+    for index, result in iter_batch_items(
+        specs,
+        func=func,
+        max_workers=max_workers,
+        requests_per_second=requests_per_second,
+        **kwargs
+    ):
+        results[index] = result
+    return results
@@ -0,0 +1,270 @@
+'''
+Multi-core bulk extracts from the OS NGD API - Features.
+Once requests are made concurrently, a large extract becomes CPU-bound on decoding each page, tagging each feature, and merging the results, all in a single process under the GIL.
+In a bulk extract, each collection and search area is paged through on a thread pool, with pages requested undecoded.
+The raw page bytes are decoded, projected, tagged and compacted or serialised in a pool of worker processes, and the parent process only stitches the finished chunks together.
+Each collection and search area keeps requesting pages while its earlier pages are decoded, finding the next page from the raw bytes, with the number of pages awaiting decoding capped in proportion to the number of workers.
+Throughput therefore scales with the number of cores, up to the rate at which pages can be requested.
+'''
+
+import json
+import os
+import re
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+from typing import BinaryIO
+
+from .batch import DEFAULT_MAX_WORKERS, create_session
+from .features import compact_features
+from .ngd_api_wrappers import ngd_items_request
+from .projection import Projection
+from .query_plan import QueryPlan
+from .utils import construct_error_response, multilevel_explode
+
+PAGE_SIZE: int = 100
+PENDING_DECODES_PER_WORKER: int = 2
+# Quotes within JSON strings are escaped, so this only matches a 'rel' member with the value 'next', ie. a next page link
+NEXT_LINK_PATTERN: re.Pattern = re.compile(rb'"rel"\s*:\s*"next"')
+
+
+def has_next_page(content: bytes | dict) -> bool:
+    '''Returns whether a page, raw or decoded, links to a next page, without decoding a raw page.'''
+    if isinstance(content, dict):
+        return any(link['rel'] == 'next' for link in content.get('links', []))
+    return NEXT_LINK_PATTERN.search(content) is not None
+
+
+def decode_page(
+    content: bytes | dict,
+    collection: str,
+    search_area_number: int = None,
+    projection: Projection = None,
+    compact: bool = False,
+    serialise: bool = False
+) -> tuple[list[str], list, bool]:
+    '''
+    Decodes and post-processes a raw page of features. This runs in a worker process, so takes and returns picklable objects.
+    Features are projected, tagged with their collection (and search area number, if supplied), and then either compacted, serialised as NDJSON lines, or left as GeoJSON dictionaries.
+    Returns a tuple of the feature ids, the processed features, and whether the API reported a next page.
+    '''
+    if isinstance(content, dict):
+        page = content
+    elif projection is not None:
+        page = projection.decode(content)
+    else:
+        page = json.loads(content)
+
+    features = page['features']
+    for feature in features:
+        properties = feature['properties']
+        feature['collection'] = properties['collection'] = collection
+        if search_area_number is not None:
+            feature['searchAreaNumber'] = properties['searchAreaNumber'] = search_area_number
+
+    ids = [feature['id'] for feature in features]
+    if compact:
+        features = compact_features(features, collection)
+    elif serialise:
+        features = [json.dumps(feature, separators=(',', ':')).encode() + b'\n' for feature in features]
+    has_next = any(link['rel'] == 'next' for link in page.get('links', []))
+    return ids, features, has_next
+
+
+class PageDecoder:
+    '''
+    Decodes raw pages of features on an executor, with a common projection and output format.
+    Parameters:
+        executor (concurrent.futures.Executor) - The executor to decode pages on, typically a ProcessPoolExecutor.
+        projection (Projection, optional) - The properties and geometry to keep for each feature.
+        compact (bool, default False) - If True, features are returned as compact FeatureRecord objects.
+        serialise (bool, default False) - If True, features are returned as encoded NDJSON lines.
+    '''
+
+    def __init__(
+            self,
+            executor: Executor,
+            projection: Projection = None,
+            compact: bool = False,
+            serialise: bool = False
+        ) -> None:
+        self.executor = executor
+        self.projection = projection
+        self.compact = compact
+        self.serialise = serialise
+
+    def submit(self, content: bytes | dict, collection: str, search_area_number: int = None) -> Future:
+        '''Submits a page to be decoded, returning a future of the result of decode_page.'''
+        return self.executor.submit(
+            decode_page,
+            content,
+            collection,
+            search_area_number,
+            self.projection,
+            self.compact,
+            self.serialise
+        )
+
+
+def bulk_extract(
+    collection: str | list[str],
+    wkt = None,
+    params: dict = None,
+    limit: int = None,
+    request_limit: int = 50,
+    properties: list[str] = None,
+    include_geometry: bool = True,
+    compact: bool = False,
+    output: BinaryIO = None,
+    max_workers: int = None,
+    fetch_workers: int = DEFAULT_MAX_WORKERS,
+    executor: Executor = None,
+    **kwargs
+) -> dict:
+    '''
+    Extracts the features of one or more collections, in one or more search areas, decoding pages on multiple cores.
+    Parameters:
+        collection (str or list of str) - The feature collection(s) to extract.
+        wkt (string or shapely geometry object, optional) - The search area(s), as for the geom extension. Each component of a multi-geometry is extracted separately.
+        params (dict, optional) - Query parameters, as for catalyst_ngd_wrappers.items. 'limit' and 'offset' cannot be supplied.
+        limit, request_limit (int) - The maximum number of features and requests for each collection and search area, as for the limit extension.
+        properties, include_geometry - The properties and geometry to keep for each feature, as for catalyst_ngd_wrappers.items.
+        compact (bool, default False) - If True, features are returned as compact FeatureRecord objects.
+        output (binary file object, optional) - If supplied, features are written to it as NDJSON rather than returned.
+        max_workers (int, optional) - The number of worker processes to decode pages in. Defaults to the number of cores. Up to twice this many pages are held awaiting decoding.
+        fetch_workers (int, default 8) - The number of collections and search areas to request at once. Requests share a session with a connection pool of this size.
+        executor (concurrent.futures.Executor, optional) - An executor to decode pages in, instead of creating a process pool for the call.
+        **kwargs - Other parameters passed to catalyst_ngd_wrappers.items, eg. filter_params, use_latest_collection, authenticate, headers, tenant.
+    Returns a FeatureCollection in the same format as the flat output of items_limit_geom_col, or a summary without features if output is supplied.
+    Features found in more than one search area are only included once, tagged with the first search area they were found in.
+    If any request fails, its error response is returned.
+    '''
+    params = dict(params or {})
+    if 'limit' in params or 'offset' in params:
+        return construct_error_response(
+            message = "With this Catalyst wrapper, 'limit' must be supplied as a function parameter, and 'offset' cannot be supplied."
+        )
+    if not limit and not request_limit:
+        return construct_error_response(
+            message = 'At least one of limit or request_limit must be provided to prevent indefinitely numerous requests and high costs.'
+        )
+
+    if wkt is not None:
+        from shapely import from_wkt
+        from shapely.errors import GEOSException
+        try:
+            full_geom = from_wkt(wkt) if isinstance(wkt, str) else wkt
+        except GEOSException:
+            return construct_error_response(
+                message = 'The input geometry is not valid. Please ensure you have the correct formatting for your input geometry type.',
+                help_text = 'http://libgeos.org/specifications/wkt/',
+            )
+        search_areas = list(enumerate(multilevel_explode(full_geom)))
+    else:
+        search_areas = [(None, None)]
+
+    kwargs.setdefault('log_request_details', False)
+    if kwargs.get('query_plan') is None:
+        kwargs['query_plan'] = QueryPlan()
+
+    # Collections are resolved once, before paging, so that features are tagged and counted by the collection version requested
+    use_latest_collection = kwargs.pop('use_latest_collection', False)
+    collections = [collection] if isinstance(collection, str) else collection
+    collections = [kwargs['query_plan'].resolve_collection(col, use_latest_collection) for col in collections]
+    cells = [(col, search_area_number, geom) for col in collections for search_area_number, geom in search_areas]
+    own_session = kwargs.get('session') is None and kwargs.get('tenant') is None
+    if own_session:
+        kwargs['session'] = create_session(fetch_workers)
+    own_executor = executor is None
+    max_workers = max_workers or os.cpu_count()
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
+    decoder = PageDecoder(
+        executor,
+        projection=Projection.from_options(properties, include_geometry),
+        compact=compact,
+        serialise=output is not None
+    )
+    failed = threading.Event()
+    pending_decodes = threading.BoundedSemaphore(PENDING_DECODES_PER_WORKER * max_workers)
+
+    def extract_cell(col: str, search_area_number: int | None, geom) -> dict:
+        '''
+        Pages through a single collection and search area, decoding each page on the executor.
+        Pages are submitted for decoding without waiting for the result, and the decoded chunks are collected once the last page has been requested.
+        '''
+        decodes = []
+        request_count = 0
+        offset = 0
+        while (request_count != request_limit) and (limit is None or offset < limit) and not failed.is_set():
+            page_params = params | {'offset': offset}
+            if limit is not None and limit - offset < PAGE_SIZE:
+                page_params['limit'] = limit - offset
+            json_response = ngd_items_request(
+                collection=col,
+                wkt=geom,
+                params=page_params,
+                raw=True,
+                **kwargs
+            )
+            if json_response.get('code') and json_response['code'] >= 400:
+                failed.set()
+                return json_response
+            request_count += 1
+            content = json_response.get('content', json_response)
+            pending_decodes.acquire()
+            try:
+                future = decoder.submit(content, col, search_area_number)
+            except BaseException:
+                pending_decodes.release()
+                raise
+            future.add_done_callback(lambda _: pending_decodes.release())
+            decodes.append(future)
+            if not has_next_page(content):
+                break
+            offset += PAGE_SIZE
+        chunks = [future.result()[:2] for future in decodes]
+        return {'numberOfRequests': request_count, 'chunks': chunks}
+
+    try:
+        with ThreadPoolExecutor(max_workers=fetch_workers, thread_name_prefix='ngd-bulk') as fetch_executor:
+            futures = [fetch_executor.submit(extract_cell, *cell) for cell in cells]
+            results = [future.result() for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+        if own_session:
+            kwargs['session'].close()
+
+    for result in results:
+        if result.get('code', 200) >= 400:
+            return result
+
+    geojson = {
+        'type': 'FeatureCollection',
+        'numberOfRequests': 0,
+        'numberOfRequestsByCollection': dict.fromkeys(collections, 0),
+        'numberReturned': 0,
+        'numberReturnedByCollection': dict.fromkeys(collections, 0),
+    }
+    features = []
+    seen_ids = set()
+    deduplicate = len(search_areas) > 1
+    for (col, _, _), result in zip(cells, results):
+        geojson['numberOfRequests'] += result['numberOfRequests']
+        geojson['numberOfRequestsByCollection'][col] += result['numberOfRequests']
+        for ids, chunk in result['chunks']:
+            if deduplicate:
+                new = [feature for feature_id, feature in zip(ids, chunk) if (col, feature_id) not in seen_ids]
+                seen_ids.update((col, feature_id) for feature_id in ids)
+                chunk = new
+            geojson['numberReturnedByCollection'][col] += len(chunk)
+            if output is not None:
+                output.write(b''.join(chunk))
+            else:
+                features += chunk
+    geojson['numberReturned'] = sum(geojson['numberReturnedByCollection'].values())
+    if output is None:
+        geojson['features'] = features
+    geojson['timeStamp'] = datetime.now().isoformat()
+    return geojson
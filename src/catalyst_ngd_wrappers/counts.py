@@ -0,0 +1,133 @@
+'''
+Count-only and exists-only queries for the OS NGD API - Features wrappers.
+Many calls only need to know whether any features of a collection intersect a search area, or roughly how many do, rather than the features themselves.
+Instead of paging through every feature, these make the smallest possible request (limit=1, with no properties or geometry kept) for each collection and search area,
+using the API's match count (numberMatched) where it is reported.
+In exists mode, no further requests are made once a match is found.
+'''
+
+from datetime import datetime
+
+from .ngd_api_wrappers import ngd_items_request
+from .query_plan import QueryPlan
+from .utils import construct_error_response, multilevel_explode
+
+
+def cell_count(json_response: dict) -> int | None:
+    '''
+    Returns the number of features matching a limit=1 request, or None if only a lower bound is known.
+    The count is exact where the API reports numberMatched, or where fewer features match than the page could hold.
+    '''
+    number_matched = json_response.get('numberMatched')
+    if isinstance(number_matched, int):
+        return number_matched
+    if not json_response.get('features'):
+        return 0
+    if not any(link['rel'] == 'next' for link in json_response.get('links', [])):
+        return len(json_response['features'])
+    return None
+
+
+def items_count(
+    collection: str | list[str],
+    wkt = None,
+    params: dict = None,
+    exists: bool = False,
+    **kwargs
+) -> dict:
+    '''
+    Counts the features of one or more collections, in one or more search areas, with one request per collection and search area.
+    Parameters:
+        collection (str or list of str) - The feature collection(s) to count.
+        wkt (string or shapely geometry object, optional) - The search area(s), as for the geom extension. Multi-geometries and Geometry Collections are counted for each component search area.
+        params (dict, optional) - Query parameters, as for catalyst_ngd_wrappers.items. 'limit' and 'offset' cannot be supplied.
+        exists (boolean, default False) - If True, no further requests are made once a matching feature is found.
+        **kwargs - Other parameters passed to catalyst_ngd_wrappers.items, eg. filter_params, use_latest_collection, authenticate, headers, tenant.
+    Returns a summary with 'exists' and 'numberMatched' for the whole query, for each collection, and for each search area of each collection.
+    'numberMatched' is None where only the existence of a match is known, as the API does not always report its match count.
+    Features found in more than one search area are counted in each. In exists mode, collections and search areas after the first match are not included.
+    If any request fails, its error response is returned.
+    '''
+    params = dict(params or {})
+    if 'limit' in params or 'offset' in params:
+        return construct_error_response(
+            message = "'limit' and 'offset' cannot be supplied for count or exists queries, which request a single feature for each collection and search area."
+        )
+    params['limit'] = 1
+
+    if wkt is not None:
+        from shapely import from_wkt
+        from shapely.errors import GEOSException
+        try:
+            full_geom = from_wkt(wkt) if isinstance(wkt, str) else wkt
+        except GEOSException:
+            return construct_error_response(
+                message = 'The input geometry is not valid. Please ensure you have the correct formatting for your input geometry type.',
+                help_text = 'http://libgeos.org/specifications/wkt/',
+            )
+        search_areas = multilevel_explode(full_geom)
+    else:
+        search_areas = [None]
+
+    collections = [collection] if isinstance(collection, str) else collection
+    kwargs.setdefault('log_request_details', False)
+    if kwargs.get('query_plan') is None:
+        kwargs['query_plan'] = QueryPlan()
+    kwargs['properties'] = []
+    kwargs['include_geometry'] = False
+
+    summary = {
+        'type': 'FeatureCount',
+        'exists': False,
+        'numberMatched': 0,
+        'numberOfRequests': 0,
+        'collections': {}
+    }
+    for col in collections:
+        col_summary = summary['collections'][col] = {
+            'exists': False,
+            'numberMatched': 0,
+            'searchAreas': []
+        }
+        for search_area, geom in enumerate(search_areas):
+            json_response = ngd_items_request(
+                collection=col,
+                wkt=geom,
+                params=params,
+                **kwargs
+            )
+            if json_response.get('code') and json_response['code'] >= 400:
+                return json_response
+            summary['numberOfRequests'] += json_response.get('numberOfRequests', 1)
+
+            count = cell_count(json_response)
+            found = count != 0
+            col_summary['searchAreas'].append({
+                'searchAreaNumber': search_area,
+                'exists': found,
+                'numberMatched': count
+            })
+            if found:
+                col_summary['exists'] = summary['exists'] = True
+            if col_summary['numberMatched'] is not None:
+                col_summary['numberMatched'] = count if count is None else col_summary['numberMatched'] + count
+            if exists and found:
+                break
+        if summary['numberMatched'] is not None:
+            summary['numberMatched'] = None if col_summary['numberMatched'] is None else summary['numberMatched'] + col_summary['numberMatched']
+        if exists and summary['exists']:
+            break
+
+    if wkt is None:
+        for col_summary in summary['collections'].values():
+            del col_summary['searchAreas']
+    summary['timeStamp'] = datetime.now().isoformat()
+    return summary
+
+
+def items_exists(collection: str | list[str], wkt = None, params: dict = None, **kwargs) -> dict:
+    '''
+    Checks whether any features of one or more collections are found in one or more search areas, stopping as soon as a match is found.
+    Takes the same parameters as items_count, and returns the same summary. The top-level 'exists' answers the query.
+    '''
+    return items_count(collection, wkt=wkt, params=params, exists=True, **kwargs)
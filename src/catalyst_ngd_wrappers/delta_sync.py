@@ -0,0 +1,321 @@
+'''
+Incremental (delta) sync of OS NGD features for a search area into a local SQLite feature store.
+Rather than re-downloading whole collections, the time of the last sync is stored for each (collection, search area, filter) combination.
+Later syncs fetch only the feature versions created or retired since then, merging them into the store by OSID.
+The 'datetime' query parameter alone would match every feature version still valid since the last sync, including every unchanged live feature,
+so incremental syncs also filter on versionavailablefromdate and versionavailabletodate with a CQL condition.
+The versions of each feature are not de-duplicated before merging: the version with the latest versionavailablefromdate decides whether a feature is updated or deleted.
+When a new version of a collection is released, the features of the old version are removed and the new version is synced in full.
+Features are removed per sync: the store records which (search area, filter) syncs each feature was fetched by, and old-version features still needed by other syncs are kept until those syncs move to the new version themselves.
+A sync truncated by limit, request_limit or a call-level budget is merged, but its sync time is not recorded, so the next sync starts from the same point.
+'''
+
+import json
+import sqlite3
+from datetime import datetime, timezone
+from hashlib import sha1
+
+from .ngd_api_wrappers import get_latest_collection_versions, items_limit_geom_col
+from .features import FeatureRecord
+from .utils import budget_usage
+
+DEFAULT_DATABASE: str = 'ngd_sync.sqlite'
+RECENT_UPDATE_DAYS: int = 31
+
+
+def current_sync_time() -> str:
+    '''Returns the current UTC time in the RFC 3339 format used by the OS NGD API.'''
+    return datetime.now(timezone.utc).strftime(r'%Y-%m-%dT%H:%M:%SZ')
+
+
+def changed_since_filter(last_sync: str) -> str:
+    '''Returns a CQL condition matching the feature versions created or retired after the time of the last sync.'''
+    return (
+        f"(versionavailablefromdate > TIMESTAMP('{last_sync}') "
+        f"OR versionavailabletodate > TIMESTAMP('{last_sync}'))"
+    )
+
+
+def latest_versions(features: list) -> list[FeatureRecord]:
+    '''
+    Returns the latest version of each feature, by OSID, from features which may include several versions of the same feature.
+    Versions are ordered by versionavailablefromdate, with later versions in the input taking precedence where they are equal.
+    '''
+    latest = {}
+    for feature in features:
+        if not isinstance(feature, FeatureRecord):
+            feature = FeatureRecord.from_geojson(feature)
+        current = latest.get(feature.id)
+        available_from = feature.properties.get('versionavailablefromdate') or ''
+        if current is None or available_from >= current[0]:
+            latest[feature.id] = (available_from, feature)
+    return [feature for _, feature in latest.values()]
+
+
+def response_features(response: dict) -> list:
+    '''Returns every feature of a hierarchical response from items_limit_geom_col, without de-duplication between search areas.'''
+    return [
+        feature
+        for col_results in response.values()
+        for area in col_results['searchAreas']
+        for feature in area['features']
+    ]
+
+
+def is_truncated(response: dict) -> bool:
+    '''Returns whether any collection or search area of a hierarchical response from items_limit_geom_col stopped before its last page of features.'''
+    return any(
+        col_results.get('budgetExhausted') or area.get('budgetExhausted') or area.get('moreAvailable')
+        for col_results in response.values()
+        for area in col_results['searchAreas']
+    )
+
+
+def search_area_key(wkt) -> str:
+    '''Returns a stable key for a search area, from well-known-text or a Shapely geometry object.'''
+    if not isinstance(wkt, str):
+        wkt = wkt.wkt
+    return sha1(' '.join(wkt.split()).encode()).hexdigest()
+
+
+def filter_key(filter_params: dict = None, params: dict = None) -> str:
+    '''Returns a stable key for the attribute filters and query parameters of a sync.'''
+    params = {k: v for k, v in (params or {}).items() if k != 'datetime'}
+    canonical = json.dumps([filter_params or {}, params], sort_keys=True, default=str)
+    return sha1(canonical.encode()).hexdigest()
+
+
+class SyncStore:
+    '''
+    A local SQLite store of sync state and features.
+    Sync state is keyed by base collection name, search area and filter, so that new collection versions can be detected.
+    Features are keyed by OSID, and the syncs (search area and filter) which fetched each feature are recorded, so that a sync only removes the features it owns.
+    '''
+
+    def __init__(self, path: str = DEFAULT_DATABASE) -> None:
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS sync_state (
+                collection TEXT NOT NULL,
+                area TEXT NOT NULL,
+                filter TEXT NOT NULL,
+                collection_version TEXT NOT NULL,
+                last_sync TEXT NOT NULL,
+                PRIMARY KEY (collection, area, filter)
+            );
+            CREATE TABLE IF NOT EXISTS features (
+                osid TEXT PRIMARY KEY,
+                collection TEXT NOT NULL,
+                geometry TEXT,
+                properties TEXT NOT NULL,
+                last_sync TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS features_collection ON features (collection);
+            CREATE TABLE IF NOT EXISTS feature_syncs (
+                osid TEXT NOT NULL,
+                area TEXT NOT NULL,
+                filter TEXT NOT NULL,
+                PRIMARY KEY (osid, area, filter)
+            );
+            CREATE INDEX IF NOT EXISTS feature_syncs_sync ON feature_syncs (area, filter);
+        ''')
+
+    def __enter__(self) -> 'SyncStore':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        '''Closes the database connection.'''
+        self.connection.close()
+
+    def get_state(self, collection: str, area: str, filter_: str) -> tuple[str, str] | None:
+        '''Returns the collection version and last sync time for a sync, or None if it has not been synced before.'''
+        return self.connection.execute(
+            'SELECT collection_version, last_sync FROM sync_state WHERE collection = ? AND area = ? AND filter = ?',
+            (collection, area, filter_)
+        ).fetchone()
+
+    def set_state(self, collection: str, area: str, filter_: str, collection_version: str, last_sync: str) -> None:
+        '''Records the collection version and time of a completed sync.'''
+        self.connection.execute(
+            'INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?, ?)',
+            (collection, area, filter_, collection_version, last_sync)
+        )
+
+    def upsert_features(self, features: list, sync_time: str, area: str = None, filter_: str = None) -> tuple[int, int]:
+        '''
+        Merges features into the store by OSID, recording them as fetched by the sync of area and filter_, if supplied.
+        Features may include several versions of the same feature, and only the version with the latest versionavailablefromdate is merged.
+        Features whose latest version is no longer available (versionavailabletodate is in the past) are deleted, for every sync.
+        Returns the number of features upserted and deleted.
+        '''
+        upserts, deletions = [], []
+        for feature in latest_versions(features):
+            properties = feature.properties
+            properties.pop('searchAreaNumber', None)
+            available_to = properties.get('versionavailabletodate')
+            if available_to and available_to <= sync_time:
+                deletions.append((feature.id,))
+                continue
+            upserts.append((
+                feature.id,
+                feature.collection,
+                json.dumps(feature.geometry),
+                json.dumps(properties),
+                sync_time
+            ))
+        self.connection.executemany('DELETE FROM features WHERE osid = ?', deletions)
+        self.connection.executemany('DELETE FROM feature_syncs WHERE osid = ?', deletions)
+        self.connection.executemany('INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?)', upserts)
+        if area is not None:
+            self.connection.executemany(
+                'INSERT OR IGNORE INTO feature_syncs VALUES (?, ?, ?)',
+                [(upsert[0], area, filter_) for upsert in upserts]
+            )
+        return len(upserts), len(deletions)
+
+    def delete_collection(self, collection: str, area: str = None, filter_: str = None) -> int:
+        '''
+        Deletes the features of a (versioned) collection, returning the number deleted.
+        If area and filter_ are supplied, only the features owned by that sync are released, and features still owned by other syncs are kept.
+        '''
+        if area is None:
+            self.connection.execute(
+                'DELETE FROM feature_syncs WHERE osid IN (SELECT osid FROM features WHERE collection = ?)',
+                (collection,)
+            )
+            return self.connection.execute('DELETE FROM features WHERE collection = ?', (collection,)).rowcount
+        self.connection.execute(
+            'DELETE FROM feature_syncs WHERE area = ? AND filter = ? AND osid IN (SELECT osid FROM features WHERE collection = ?)',
+            (area, filter_, collection)
+        )
+        return self.connection.execute(
+            'DELETE FROM features WHERE collection = ? AND osid NOT IN (SELECT osid FROM feature_syncs)',
+            (collection,)
+        ).rowcount
+
+    def commit(self) -> None:
+        '''Commits the current transaction.'''
+        self.connection.commit()
+
+    def to_geojson(self, collection: str = None) -> dict:
+        '''Returns the features in the store as a GeoJSON FeatureCollection, optionally for a single (versioned) collection.'''
+        query = 'SELECT osid, collection, geometry, properties FROM features'
+        args = ()
+        if collection:
+            query += ' WHERE collection = ?'
+            args = (collection,)
+        features = []
+        for osid, col, geometry, properties in self.connection.execute(query, args):
+            properties = json.loads(properties)
+            properties['collection'] = col
+            features.append({
+                'type': 'Feature',
+                'id': osid,
+                'geometry': json.loads(geometry),
+                'properties': properties,
+                'collection': col
+            })
+        return {
+            'type': 'FeatureCollection',
+            'numberReturned': len(features),
+            'features': features
+        }
+
+
+def sync_area(
+    collection: list[str],
+    wkt,
+    filter_params: dict = None,
+    params: dict = None,
+    database: str | SyncStore = DEFAULT_DATABASE,
+    recent_update_days: int = RECENT_UPDATE_DAYS,
+    **kwargs
+) -> dict:
+    '''
+    Incrementally syncs OS NGD features for a search area into a local SQLite feature store.
+    Parameters:
+        collection (list of str) - The collections to sync. Base names (eg. bld-fts-building) are resolved to their latest version, and a new version triggers a full re-sync.
+            Versioned names (eg. bld-fts-building-4) are always synced at the version given.
+        wkt (string or shapely geometry object) - The search area, which may be a multi-geometry or Geometry Collection.
+        filter_params (dict, optional) - OS NGD attribute filters, as for catalyst_ngd_wrappers.items.
+        params (dict, optional) - Query parameters, as for catalyst_ngd_wrappers.items. The 'datetime' parameter is set by the sync, and any 'filter' is combined with the sync's own condition.
+        database (str or SyncStore, default 'ngd_sync.sqlite') - The path of the SQLite database, or an open SyncStore.
+        recent_update_days (int, default 31) - Collections released within this number of days are listed under 'recentCollectionUpdates' in the output.
+        **kwargs - Other parameters passed to catalyst_ngd_wrappers.items_limit_geom_col, eg. request_limit, headers.
+    Returns a summary of the sync for each collection, or an error response if a request fails.
+    Sync state is only updated for collections which synced successfully, so a failed sync is retried from the same point on the next run.
+    Collections whose pull was truncated by limit, request_limit or max_requests/max_features are flagged as 'truncated': their features are merged, but the sync state is not updated.
+    '''
+    versions = get_latest_collection_versions(recent_update_days=recent_update_days)
+    if recent_update_days:
+        collection_lookup = versions['collection-lookup']
+        recent_updates = versions['recent-collection-updates']
+    else:
+        collection_lookup, recent_updates = versions, []
+
+    area = search_area_key(wkt)
+    filter_ = filter_key(filter_params, params)
+    store = database if isinstance(database, SyncStore) else SyncStore(database)
+
+    summary = {
+        'syncTime': current_sync_time(),
+        'recentCollectionUpdates': recent_updates,
+        'collections': {}
+    }
+
+    try:
+        for col in collection:
+            versioned = col if col[-1].isdigit() else collection_lookup.get(col, col)
+            state = store.get_state(col, area, filter_)
+            # Taken before the request, so that changes made during the sync are picked up by the next one
+            sync_time = current_sync_time()
+
+            col_params = dict(params or {})
+            number_deleted = 0
+            if state and state[0] == versioned:
+                sync_type = 'incremental'
+                col_params['datetime'] = f'{state[1]}/..'
+                changed = changed_since_filter(state[1])
+                col_params['filter'] = f"({col_params['filter']}) AND {changed}" if col_params.get('filter') else changed
+            else:
+                sync_type = 'full'
+                if state:
+                    number_deleted += store.delete_collection(state[0], area, filter_)
+
+            response = items_limit_geom_col(
+                collection=[versioned],
+                wkt=wkt,
+                filter_params=filter_params,
+                params=col_params,
+                compact=True,
+                hierarchical_output=True,
+                **kwargs
+            )
+            if response.get('code', 200) >= 400:
+                store.connection.rollback()
+                return response
+
+            number_upserted, number_retired = store.upsert_features(response_features(response), sync_time, area, filter_)
+            truncated = is_truncated(response)
+            if not truncated:
+                store.set_state(col, area, filter_, versioned, sync_time)
+            store.commit()
+
+            summary['collections'][col] = {
+                'collection': versioned,
+                'syncType': sync_type,
+                'since': state[1] if sync_type == 'incremental' else None,
+                'numberOfRequests': sum(budget_usage(col_results)[0] for col_results in response.values()),
+                'numberUpserted': number_upserted,
+                'numberDeleted': number_deleted + number_retired,
+                'truncated': truncated
+            }
+    finally:
+        if not isinstance(database, SyncStore):
+            store.close()
+
+    return summary
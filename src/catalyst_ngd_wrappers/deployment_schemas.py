@@ -22,6 +22,12 @@ class FeaturesBaseSchema(BaseSchema):
     wkt = String(required=False)
     use_latest_collection = Boolean(data_key='use-latest-collection', required=False)
     authenticate = Boolean(required=False)
+    max_requests = Integer(data_key='max-requests', required=False)
+    max_features = Integer(data_key='max-features', required=False)
+    hedge_requests = Boolean(data_key='hedge-requests', required=False)
+    validate_query = Boolean(data_key='validate-query', required=False)
+    properties = List(String(), required=False)
+    include_geometry = Boolean(data_key='include-geometry', required=False)
 
 class AbstractHierarchicalSchema(FeaturesBaseSchema):
     '''Abstract schema for hierarchical queries'''
@@ -1,11 +1,52 @@
 '''Tools involved in deploying and managing the OS NGD API - Features wrappers.
 Can be applied to both Azure and AWS deployments.'''
 
+import json
+import threading
+
 from marshmallow.exceptions import ValidationError
 
-from .ngd_api_wrappers import get_latest_collection_versions, get_specific_latest_collections
+from .ngd_api_wrappers import (
+    get_latest_collection_versions,
+    get_specific_latest_collections,
+    items,
+    items_limit,
+    items_geom,
+    items_col,
+    items_limit_geom,
+    items_limit_col,
+    items_geom_col,
+    items_limit_geom_col
+)
+
+from .export import QueueFeatureSink
+from .tenants import Tenant, get_tenant_registry
+
+from .deployment_schemas import (
+    CollectionsSchema,
+    FeaturesBaseSchema,
+    LimitSchema,
+    GeomSchema,
+    ColSchema,
+    LimitGeomSchema,
+    LimitColSchema,
+    GeomColSchema,
+    LimitGeomColSchema
+)
 
-from .deployment_schemas import CollectionsSchema, ColSchema
+STREAM_CHUNK_SIZE: int = 64 * 1024
+
+# Maps each features schema to the wrapper function it validates requests for
+ROUTE_TABLE: dict[type, callable] = {
+    FeaturesBaseSchema: items,
+    LimitSchema: items_limit,
+    GeomSchema: items_geom,
+    ColSchema: items_col,
+    LimitGeomSchema: items_limit_geom,
+    LimitColSchema: items_limit_col,
+    GeomColSchema: items_geom_col,
+    LimitGeomColSchema: items_limit_geom_col
+}
 
 class BaseSerialisedRequest:
     '''
@@ -26,6 +67,47 @@ class BaseSerialisedRequest:
         self.route_params = route_params
         self.headers = headers
 
+class CompiledRoute:
+    '''
+    A precompiled route for a features endpoint, built once per schema and reused for every request.
+    Holds a reusable schema instance, the wrapper function, the names of the custom (non-NGD) fields, and the attribute string used in error descriptions.
+    '''
+
+    __slots__ = ('schema', 'ngd_api_func', 'multi_collection', 'custom_fields', 'attributes')
+
+    def __init__(self, schema_class: type, ngd_api_func: callable = None) -> None:
+        self.schema = schema_class()
+        self.ngd_api_func = ngd_api_func or ROUTE_TABLE[schema_class]
+        self.multi_collection = isinstance(self.schema, ColSchema)
+        self.custom_fields = tuple(self.schema.fields.keys())
+        self.attributes = ', '.join(
+            x.replace('_', '-')
+            for x in self.custom_fields
+            if x != 'limit'
+        )
+
+
+_compiled_routes: dict[tuple, CompiledRoute] = {}
+_collections_schema: CollectionsSchema = None
+
+
+def compile_route(schema_class: type, ngd_api_func: callable = None) -> CompiledRoute:
+    '''Returns the compiled route for a schema (and optionally a specific wrapper function), compiling it on first use.'''
+    key = (schema_class, ngd_api_func)
+    route = _compiled_routes.get(key)
+    if route is None:
+        route = _compiled_routes[key] = CompiledRoute(schema_class, ngd_api_func)
+    return route
+
+
+def get_collections_schema() -> CollectionsSchema:
+    '''Returns the reusable schema instance for the collections endpoint.'''
+    global _collections_schema
+    if _collections_schema is None:
+        _collections_schema = CollectionsSchema()
+    return _collections_schema
+
+
 def handle_error(
     error: Exception = None,
     description: str = None,
@@ -43,60 +125,86 @@ def handle_error(
     return error_body
 
 
-def construct_features_response(
-    data: BaseSerialisedRequest,
-    schema_class: type,
-    ngd_api_func: callable
-) -> dict:
+def resolve_request_tenant(headers: dict, params: dict) -> Tenant | None:
     '''
-    Translates the request headers and path and query parameters into a function call.
-    Translates the function response into an HTTP response, handling errors and telemetry.
+    Identifies the tenant of a request from the OS API key it was sent with, in the 'key' header or query parameter.
+    The key is removed from the headers and params, and is instead sent by the tenant, so that each project's requests get their own pooled connections and rate limit.
+    Returns None if no key was sent, in which case the deployment's own credentials are used.
+    '''
+    api_key = headers.pop('key', None) or params.pop('key', None)
+    params.pop('key', None)
+    if not api_key:
+        return None
+    return get_tenant_registry().get(api_key=api_key)
+
+
+def parse_features_request(data: BaseSerialisedRequest, route: CompiledRoute) -> tuple[dict | None, dict | None]:
+    '''
+    Translates the request headers and path and query parameters into keyword arguments for the route's wrapper function.
+    Returns a tuple of the keyword arguments and an error response, one of which is None.
     '''
     # Handle incorrect HTTP methods
     if data.method != 'GET':
-        return handle_error(
+        return None, handle_error(
             description = "The HTTP method requested is not supported. This endpoint only supports 'GET' requests.",
             code = 405
         )
 
-    # Load the schema and parse the request parameters
-    schema = schema_class()
-    multi_collection = isinstance(schema, ColSchema)
-
     params = data.params
-    if multi_collection:
+    if route.multi_collection:
         col = params.get('collection')
         if col:
             params['collection'] = col.split(',')
+    properties = params.get('properties')
+    if isinstance(properties, str):
+        params['properties'] = properties.split(',') if properties else []
 
     try:
-        parsed_params = schema.load(params)
+        parsed_params = route.schema.load(params)
     except ValidationError as e:
-        return handle_error(e)
+        return None, handle_error(e)
 
     custom_params = {
         k: parsed_params.pop(k)
-        for k in schema.fields.keys()
+        for k in route.custom_fields
         if k  in parsed_params
     }
-    if not multi_collection:
+    if not route.multi_collection:
         custom_params['collection'] = data.route_params.get('collection')
 
-    response_data = ngd_api_func(
-        params=parsed_params,
-        headers=data.headers,
-        **custom_params
-    )
+    headers = dict(data.headers or {})
+    tenant = resolve_request_tenant(headers, parsed_params)
+    if tenant is not None:
+        custom_params['tenant'] = tenant
+
+    return {'params': parsed_params, 'headers': headers} | custom_params, None
+
 
+def format_error_description(response_data: dict, route: CompiledRoute) -> dict:
+    '''Completes error descriptions which list the supported Catalyst parameters, for the route in question.'''
     descr = response_data.get('description')
     if response_data.get('errorSource') and isinstance(descr, str):
-        fields = [
-            x.replace('_', '-')
-            for x in schema.fields
-            if x != 'limit'
-        ]
-        attributes = ', '.join(fields)
-        response_data['description'] = descr.format(attr=attributes)
+        response_data['description'] = descr.format(attr=route.attributes)
+    return response_data
+
+
+def construct_features_response(
+    data: BaseSerialisedRequest,
+    schema_class: type,
+    ngd_api_func: callable = None
+) -> dict:
+    '''
+    Translates the request headers and path and query parameters into a function call.
+    Translates the function response into an HTTP response, handling errors and telemetry.
+    If ngd_api_func is not supplied, the wrapper function for schema_class is looked up in ROUTE_TABLE.
+    '''
+    route = compile_route(schema_class, ngd_api_func)
+    kwargs, error = parse_features_request(data, route)
+    if error:
+        return error
+
+    response_data = route.ngd_api_func(**kwargs)
+    response_data = format_error_description(response_data, route)
 
     #custom_dimensions = data.pop('telemetryData', None)
     #if custom_dimensions:
@@ -104,6 +212,174 @@ def construct_features_response(
 
     return response_data
 
+
+class StreamingFeaturesResponse:
+    '''
+    A streaming variant of construct_features_response, which sends features as encoded byte chunks while pages are still arriving.
+    The FeatureCollection envelope is sent first, then the features, then the trailing metadata (numberReturned, numberOfRequests, etc.).
+    Time to first byte is therefore the latency of the first page rather than of the whole call, and the full response is never held in memory.
+
+    Creating the response waits for the first page (or an error) so that status_code is known before the body is sent.
+    As this blocks, ASGI-style hosts should create the response with wait=False and then await start(), which waits for the first page off the event loop,
+    or use stream_features_response_async, which does both.
+    The response can be iterated for WSGI-style hosts, or asynchronously iterated for ASGI-style hosts.
+    If an error occurs after features have been sent, it is included in the trailing metadata under 'error'.
+    Hierarchical output is not supported, as it cannot be streamed.
+    '''
+
+    content_type = 'application/geo+json'
+    _end = object()
+
+    def __init__(
+            self,
+            data: BaseSerialisedRequest,
+            schema_class: type,
+            ngd_api_func: callable = None,
+            chunk_size: int = STREAM_CHUNK_SIZE,
+            wait: bool = True
+        ) -> None:
+        self.chunk_size = chunk_size
+        self.route = compile_route(schema_class, ngd_api_func)
+        self.status_code = 200
+        self.error = None
+        self.result = None
+        self.first_page = None
+
+        kwargs, self.error = parse_features_request(data, self.route)
+        if kwargs and kwargs.get('hierarchical_output'):
+            self.error = handle_error(description = "'hierarchical-output' is not supported for streaming responses.")
+        if self.error:
+            self.status_code = self.error['code']
+            return
+
+        self.sink = QueueFeatureSink()
+        thread = threading.Thread(target=self._run, args=(kwargs,), daemon=True)
+        thread.start()
+        if wait:
+            self._wait_for_first_page()
+
+    def _wait_for_first_page(self) -> None:
+        '''Blocks until the first page (or an error) is available, setting status_code.'''
+        if self.error or self.first_page is not None:
+            return
+        self.first_page = self.sink.queue.get()
+        if self.first_page is self._end and self.result.get('code', 200) >= 400:
+            self.error = self.result
+            self.status_code = self.error['code']
+
+    async def start(self) -> 'StreamingFeaturesResponse':
+        '''Waits for the first page (or an error) in a worker thread, without blocking the event loop, and returns the response once status_code is known.'''
+        import asyncio
+
+        await asyncio.to_thread(self._wait_for_first_page)
+        return self
+
+    def _run(self, kwargs: dict) -> None:
+        '''Runs the wrapper function, writing features to the sink, in a background thread.'''
+        try:
+            self.result = self.route.ngd_api_func(feature_sink=self.sink, **kwargs)
+        except Exception as e:
+            self.result = handle_error(error=e, code=500)
+        self.result = format_error_description(self.result, self.route)
+        self.sink.close()
+        self.sink.queue.put(self._end)
+
+    def trailing_metadata(self) -> dict:
+        '''Returns the metadata sent after the features, with feature counts taken from the stream.'''
+        result = self.result
+        if result.get('code', 200) >= 400:
+            return {'error': result}
+        metadata = {
+            k: v for k, v in result.items()
+            if k not in ('type', 'features', 'links', 'code')
+        }
+        counts = self.sink.number_returned_by_collection
+        metadata['numberReturned'] = sum(counts.values())
+        if 'numberReturnedByCollection' in metadata:
+            metadata['numberReturnedByCollection'] = {col: counts.get(col, 0) for col in metadata['numberReturnedByCollection']}
+        return metadata
+
+    def __iter__(self):
+        self._wait_for_first_page()
+        if self.error:
+            yield json.dumps(self.error).encode()
+            return
+        page = self.first_page
+        try:
+            yield b'{"type":"FeatureCollection","features":['
+            separator = b''
+            while page is not self._end:
+                buffer, size = [], 0
+                for encoded in page:
+                    buffer.append(separator + encoded)
+                    separator = b','
+                    size += len(encoded) + 1
+                    if size >= self.chunk_size:
+                        yield b''.join(buffer)
+                        buffer, size = [], 0
+                if buffer:
+                    yield b''.join(buffer)
+                page = self.sink.queue.get()
+            trailer = json.dumps(self.trailing_metadata()).encode()
+            yield b'],' + trailer[1:] if len(trailer) > 2 else b']}'
+        finally:
+            if page is not self._end:
+                self.close()
+
+    def close(self) -> None:
+        '''Stops the background request if the body will not be read to the end. Called by WSGI hosts when the response is finished.'''
+        if not self.error:
+            self.sink.cancel()
+
+    async def __aiter__(self):
+        import asyncio
+
+        await self.start()
+        iterator = iter(self)
+        while True:
+            chunk = await asyncio.to_thread(next, iterator, None)
+            if chunk is None:
+                return
+            yield chunk
+
+
+def stream_features_response(
+    data: BaseSerialisedRequest,
+    schema_class: type,
+    ngd_api_func: callable = None,
+    chunk_size: int = STREAM_CHUNK_SIZE
+) -> StreamingFeaturesResponse:
+    '''
+    Translates the request into a function call as construct_features_response does, but returns a StreamingFeaturesResponse.
+    Its status_code and content_type can be used for the response headers, and it is iterated (synchronously or asynchronously) for the body.
+    '''
+    return StreamingFeaturesResponse(
+        data=data,
+        schema_class=schema_class,
+        ngd_api_func=ngd_api_func,
+        chunk_size=chunk_size
+    )
+
+
+async def stream_features_response_async(
+    data: BaseSerialisedRequest,
+    schema_class: type,
+    ngd_api_func: callable = None,
+    chunk_size: int = STREAM_CHUNK_SIZE
+) -> StreamingFeaturesResponse:
+    '''
+    An awaitable variant of stream_features_response for ASGI-style hosts, which waits for the first page without blocking the event loop.
+    The request is still parsed on the event loop, but the wrapper function runs in a background thread.
+    '''
+    response = StreamingFeaturesResponse(
+        data=data,
+        schema_class=schema_class,
+        ngd_api_func=ngd_api_func,
+        chunk_size=chunk_size,
+        wait=False
+    )
+    return await response.start()
+
 def construct_collections_response(data: BaseSerialisedRequest) -> dict:
     ''' Handles the processing of API requests to retrieve OS NGD collections, either all or a specific one.
     Handles parameter validation and telemetry tracking.
@@ -120,7 +396,7 @@ def construct_collections_response(data: BaseSerialisedRequest) -> dict:
             code = 405
         )
 
-    schema = CollectionsSchema()
+    schema = get_collections_schema()
     params = data.params
 
     collection = data.route_params.get('collection')
@@ -0,0 +1,338 @@
+'''
+Streaming export of OS NGD features to disk, for bulk extracts.
+Features are written incrementally as each page arrives, rather than being merged into a single FeatureCollection in memory.
+Output is written as newline-delimited JSON (NDJSON), or as GeoJSON Text Sequences (RFC 8142), optionally gzipped and split into one file per collection.
+Files are written to temporary paths and only moved into place once the export has completed, alongside a summary sidecar file.
+Features found in more than one search area are de-duplicated by id, which needs the id of every feature written to be kept.
+These are held in memory up to a limit, then moved to a temporary SQLite database on disk, so memory use stays bounded for extracts of any size.
+'''
+
+import gzip as gz
+import json
+import os
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+from .features import FeatureRecord
+
+DEFAULT_BUFFER_SIZE: int = 1000
+DEDUPLICATION_MEMORY_LIMIT: int = 250_000
+RECORD_SEPARATOR: bytes = b'\x1e'
+TEMPORARY_SUFFIX: str = '.part'
+
+
+def encode_feature(feature: dict | FeatureRecord, collection: str = None, search_area_number: int = None) -> bytes:
+    '''Encodes a feature (or compact feature record) as compact JSON, tagged with its collection and search area.'''
+    if isinstance(feature, FeatureRecord):
+        feature = feature.to_geojson()
+    if collection and 'collection' not in feature:
+        feature['collection'] = collection
+    if search_area_number is not None:
+        feature['searchAreaNumber'] = search_area_number
+        feature['properties']['searchAreaNumber'] = search_area_number
+    return json.dumps(feature, separators=(',', ':')).encode()
+
+
+class SeenFeatureIds:
+    '''
+    The (collection, id) pairs of the features already written by a sink, for de-duplication between search areas.
+    Up to memory_limit pairs are held in a set. Beyond that, they are moved to a private temporary SQLite database, which SQLite keeps on disk and deletes when closed.
+    Not thread-safe; the sinks hold their own lock while using it.
+    '''
+
+    def __init__(self, memory_limit: int = DEDUPLICATION_MEMORY_LIMIT) -> None:
+        self.memory_limit = memory_limit
+        self.ids = set()
+        self.connection = None
+
+    def __len__(self) -> int:
+        if self.connection is None:
+            return len(self.ids)
+        return self.connection.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+
+    def _spill(self) -> None:
+        '''Moves the pairs held in memory to a temporary database.'''
+        self.connection = sqlite3.connect('', check_same_thread=False)
+        self.connection.execute('CREATE TABLE seen (collection TEXT, id TEXT, PRIMARY KEY (collection, id)) WITHOUT ROWID')
+        self.connection.executemany('INSERT INTO seen VALUES (?, ?)', self.ids)
+        self.ids = set()
+
+    def add(self, collection: str, feature_id: str) -> bool:
+        '''Records a feature as written, returning False if it had already been written.'''
+        key = (collection or '', feature_id)
+        if self.connection is not None:
+            return self.connection.execute('INSERT OR IGNORE INTO seen VALUES (?, ?)', key).rowcount == 1
+        if key in self.ids:
+            return False
+        self.ids.add(key)
+        if len(self.ids) > self.memory_limit:
+            self._spill()
+        return True
+
+    def close(self) -> None:
+        '''Discards the recorded pairs, deleting the temporary database if one was created.'''
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        self.ids = set()
+
+
+class BoundFeatureSink:
+    '''A view of a feature sink which adds context (eg. the search area number) to every page it writes.'''
+
+    def __init__(self, sink: 'FeatureSink', **context) -> None:
+        self.sink = sink
+        self.context = context
+
+    def bind(self, **context) -> 'BoundFeatureSink':
+        '''Returns a view of the sink with further context added.'''
+        return BoundFeatureSink(self.sink, **(self.context | context))
+
+    def write_features(self, features: list, **context) -> None:
+        '''Writes a page of features to the sink, with the bound context.'''
+        self.sink.write_features(features, **(self.context | context))
+
+
+class FeatureSink:
+    '''
+    Writes features to disk as they arrive, in bounded memory.
+    Parameters:
+        path (str) - The output file path. When split_by_collection is True, the collection name is inserted before the file extension.
+        text_sequence (bool, default False) - If True, features are written as GeoJSON Text Sequences (RFC 8142), with each feature preceded by a record separator. Otherwise, NDJSON is written.
+        gzip (bool, default False) - If True, output files are gzipped.
+        split_by_collection (bool, default False) - If True, features from each collection are written to a separate file.
+        buffer_size (int, default 1000) - The maximum number of encoded features held in memory for each file before they are written.
+        deduplication_memory_limit (int, default 250,000) - The number of feature ids held in memory for de-duplication between search areas, before they are moved to a temporary database on disk.
+    Features found in more than one search area of a collection are written once, tagged with the first search area they were found in.
+    Feature ids are only kept for de-duplication where the geom extension searches more than one search area.
+    Use as a context manager, or call close() once the export has completed, or abort() to discard it.
+    '''
+
+    def __init__(
+            self,
+            path: str,
+            text_sequence: bool = False,
+            gzip: bool = False,
+            split_by_collection: bool = False,
+            buffer_size: int = DEFAULT_BUFFER_SIZE,
+            deduplication_memory_limit: int = DEDUPLICATION_MEMORY_LIMIT
+        ) -> None:
+        self.path = path
+        self.text_sequence = text_sequence
+        self.gzip = gzip
+        self.split_by_collection = split_by_collection
+        self.buffer_size = buffer_size
+        self.files = {}
+        self.buffers = {}
+        self.number_of_pages = 0
+        self.number_returned_by_collection = {}
+        self.search_area_ids = SeenFeatureIds(deduplication_memory_limit)
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> 'FeatureSink':
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def bind(self, **context) -> BoundFeatureSink:
+        '''Returns a view of the sink which adds context (eg. search_area_number) to every page written.'''
+        return BoundFeatureSink(self, **context)
+
+    def output_path(self, collection: str = None) -> str:
+        '''Returns the final path of the output file for a collection.'''
+        path = self.path
+        if self.split_by_collection and collection:
+            stem, ext = os.path.splitext(path[:-3] if path.endswith('.gz') else path)
+            path = f'{stem}.{collection}{ext}'
+        if self.gzip and not path.endswith('.gz'):
+            path += '.gz'
+        return path
+
+    def _open(self, key: str):
+        '''Returns the temporary file for an output file key, opening it if necessary.'''
+        file = self.files.get(key)
+        if file is None:
+            temporary_path = self.output_path(key) + TEMPORARY_SUFFIX
+            file = gz.open(temporary_path, 'wb') if self.gzip else open(temporary_path, 'wb')
+            self.files[key] = file
+            self.buffers[key] = []
+        return file
+
+    def _flush(self, key: str) -> None:
+        '''Writes the buffered features for an output file.'''
+        buffer = self.buffers[key]
+        if buffer:
+            self.files[key].write(b''.join(buffer))
+            buffer.clear()
+
+    def encode(self, feature: dict | FeatureRecord, collection: str = None, search_area_number: int = None) -> bytes:
+        '''Encodes a feature as a line of NDJSON or a GeoJSON Text Sequence record.'''
+        line = encode_feature(feature, collection, search_area_number) + b'\n'
+        return RECORD_SEPARATOR + line if self.text_sequence else line
+
+    def write_features(self, features: list, collection: str = None, search_area_number: int = None, deduplicate: bool = True) -> None:
+        '''
+        Writes a page of features. Each call is counted as one request in the summary.
+        Features are de-duplicated between search areas where a search area number is supplied, unless deduplicate is False (eg. where there is only one search area).
+        '''
+        with self._lock:
+            self.number_of_pages += 1
+            key = collection if self.split_by_collection else None
+            self._open(key)
+            buffer = self.buffers[key]
+            written = 0
+            for feature in features:
+                if search_area_number is not None and deduplicate:
+                    feature_id = feature.id if isinstance(feature, FeatureRecord) else feature['id']
+                    # As in the geom extension, features are only de-duplicated between search areas of the same collection
+                    if not self.search_area_ids.add(collection, feature_id):
+                        continue
+                buffer.append(self.encode(feature, collection, search_area_number))
+                written += 1
+                if len(buffer) >= self.buffer_size:
+                    self._flush(key)
+            self.number_returned_by_collection[collection] = self.number_returned_by_collection.get(collection, 0) + written
+
+    def summary(self) -> dict:
+        '''Returns a summary of the export: the files written, and the number of requests and features.'''
+        return {
+            'type': 'ExportSummary',
+            'format': 'application/geo+json-seq' if self.text_sequence else 'application/x-ndjson',
+            'files': [self.output_path(key) for key in self.files],
+            'numberOfRequests': self.number_of_pages,
+            'numberReturned': sum(self.number_returned_by_collection.values()),
+            'numberReturnedByCollection': {
+                col: n for col, n in self.number_returned_by_collection.items() if col is not None
+            },
+            'timeStamp': datetime.now().isoformat()
+        }
+
+    def close(self, **metadata) -> dict:
+        '''
+        Completes the export: flushes and closes all files, atomically moves them into place, and writes the summary sidecar file.
+        Any metadata supplied is added to the summary. Returns the summary.
+        '''
+        with self._lock:
+            if not self.files:
+                self._open(None)
+            for key, file in self.files.items():
+                self._flush(key)
+                file.close()
+                final_path = self.output_path(key)
+                os.replace(final_path + TEMPORARY_SUFFIX, final_path)
+            summary = self.summary() | metadata
+            summary_path = self.output_path().removesuffix('.gz') + '.summary.json'
+            with open(summary_path + TEMPORARY_SUFFIX, 'w', encoding='utf-8') as file:
+                json.dump(summary, file, indent=2)
+            os.replace(summary_path + TEMPORARY_SUFFIX, summary_path)
+            self.files.clear()
+            self.search_area_ids.close()
+            return summary
+
+    def abort(self) -> None:
+        '''Discards the export, closing and deleting any temporary files.'''
+        with self._lock:
+            for key, file in self.files.items():
+                file.close()
+                temporary_path = self.output_path(key) + TEMPORARY_SUFFIX
+                if os.path.exists(temporary_path):
+                    os.remove(temporary_path)
+            self.files.clear()
+            self.search_area_ids.close()
+
+
+class QueueFeatureSink:
+    '''
+    Passes each page of features, encoded as JSON, to a bounded queue as it arrives, for streaming to a consumer in another thread.
+    Each page is put on the queue as a list of encoded features. When the queue is full, the producer waits, so memory use is bounded.
+    As with FeatureSink, features found in more than one search area of a collection are only passed on once.
+    If the consumer stops early, cancel() causes the next write to raise, stopping the producer.
+    '''
+
+    def __init__(self, maxsize: int = 16, deduplication_memory_limit: int = DEDUPLICATION_MEMORY_LIMIT) -> None:
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.number_returned_by_collection = {}
+        self.search_area_ids = SeenFeatureIds(deduplication_memory_limit)
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    def cancel(self) -> None:
+        '''Cancels the stream, discarding any queued pages.'''
+        self.cancelled.set()
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    def bind(self, **context) -> BoundFeatureSink:
+        '''Returns a view of the sink which adds context (eg. search_area_number) to every page written.'''
+        return BoundFeatureSink(self, **context)
+
+    def close(self) -> None:
+        '''Discards the de-duplication state, once the producer has finished.'''
+        with self._lock:
+            self.search_area_ids.close()
+
+    def write_features(self, features: list, collection: str = None, search_area_number: int = None, deduplicate: bool = True) -> None:
+        '''Encodes a page of features and puts it on the queue.'''
+        with self._lock:
+            if search_area_number is not None and deduplicate:
+                features = [
+                    feature for feature in features
+                    if self.search_area_ids.add(collection, feature.id if isinstance(feature, FeatureRecord) else feature['id'])
+                ]
+            self.number_returned_by_collection[collection] = self.number_returned_by_collection.get(collection, 0) + len(features)
+        page = [encode_feature(f, collection, search_area_number) for f in features]
+        while True:
+            if self.cancelled.is_set():
+                raise RuntimeError('The feature stream was cancelled by the consumer.')
+            try:
+                self.queue.put(page, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+
+def export_features(
+    path: str,
+    func: callable = None,
+    text_sequence: bool = False,
+    gzip: bool = False,
+    split_by_collection: bool = False,
+    buffer_size: int = DEFAULT_BUFFER_SIZE,
+    **kwargs
+) -> dict:
+    '''
+    Exports OS NGD features to disk, writing each page as it arrives so that extracts of any size run in bounded memory.
+    Parameters:
+        path (str) - The output file path. A summary is written alongside it, with the suffix '.summary.json'.
+        func (callable, default items_limit_geom_col) - The wrapper function to export features from.
+        text_sequence, gzip, split_by_collection, buffer_size - Output options, as for FeatureSink.
+        **kwargs - Other parameters passed to func, eg. collection, wkt, limit.
+    Returns the export summary, or the error response if a request fails, in which case no output files are left behind.
+    '''
+    if func is None:
+        from .ngd_api_wrappers import items_limit_geom_col
+        func = items_limit_geom_col
+
+    sink = FeatureSink(
+        path=path,
+        text_sequence=text_sequence,
+        gzip=gzip,
+        split_by_collection=split_by_collection,
+        buffer_size=buffer_size
+    )
+    try:
+        response = func(feature_sink=sink, **kwargs)
+    except BaseException:
+        sink.abort()
+        raise
+    if response.get('code', 200) >= 400:
+        sink.abort()
+        return response
+    metadata = {k: response[k] for k in ('numberFetched', 'budgetExhausted', 'numberOfHedgedRequests') if k in response}
+    return sink.close(**metadata)
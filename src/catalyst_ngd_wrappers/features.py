@@ -0,0 +1,239 @@
+'''
+Compact feature records for the OS NGD API - Features wrappers.
+For large pulls, the overhead of each feature's nested GeoJSON dictionaries dominates memory use.
+A FeatureRecord holds the id, collection, search area membership and properties of a feature, with the geometry kept as its raw coordinates.
+Property names are shared between all records with the same attribution, and short text values (such as codelist values) are interned, so repeated values are only stored once.
+Geometry is only converted to GeoJSON or a Shapely object when accessed, and records convert back to the standard GeoJSON output of the wrappers.
+For large composite calls, a FeatureChain presents the pages of features from each request, search area and collection as one sequence, without copying them into a single list at each level of nesting.
+'''
+
+import sys
+from bisect import bisect_right
+from collections.abc import Sequence
+from itertools import chain, islice
+
+INTERN_MAX_LENGTH: int = 64
+
+_shared_property_names: dict[tuple, tuple] = {}
+
+
+def _share_property_names(names: tuple) -> tuple:
+    '''Returns a single shared instance of a tuple of property names.'''
+    return _shared_property_names.setdefault(names, names)
+
+
+def _compact_value(value):
+    '''Interns short text values, which are frequently repeated between features.'''
+    if isinstance(value, str) and len(value) <= INTERN_MAX_LENGTH:
+        return sys.intern(value)
+    return value
+
+
+class FeatureRecord:
+    '''
+    A compact, slotted representation of an OS NGD feature.
+    Attributes:
+        id (str) - The OSID of the feature.
+        collection (str) - The collection the feature belongs to.
+        search_areas (int | list[int] | None) - The number(s) of the search area(s) where the feature is found, when the geom extension is applied.
+        properties (dict) - The OS NGD attribution of the feature, excluding the attributes added by catalyst. A new dictionary is returned on each access; assign to the attribute to update it.
+        geometry_type (str) - The GeoJSON geometry type, eg. 'Polygon'.
+        coordinates (list) - The raw GeoJSON coordinates of the geometry.
+    '''
+
+    __slots__ = ('id', 'collection', 'search_areas', '_property_names', '_property_values', 'geometry_type', 'coordinates', '_shape')
+
+    def __init__(
+            self,
+            id: str,
+            collection: str,
+            properties: dict,
+            geometry_type: str,
+            coordinates: list,
+            search_areas: int | list[int] = None
+        ) -> None:
+        self.id = id
+        self.collection = collection
+        self.properties = properties
+        self.geometry_type = geometry_type
+        self.coordinates = coordinates
+        self.search_areas = search_areas
+        self._shape = None
+
+    @property
+    def properties(self) -> dict:
+        '''The OS NGD attribution of the feature, as a new dictionary.'''
+        return dict(zip(self._property_names, self._property_values))
+
+    @properties.setter
+    def properties(self, properties: dict) -> None:
+        self._property_names = _share_property_names(tuple(properties))
+        self._property_values = tuple(_compact_value(v) for v in properties.values())
+
+    @classmethod
+    def from_geojson(cls, feature: dict, collection: str = None) -> 'FeatureRecord':
+        '''Creates a record from a GeoJSON feature, as returned by the OS NGD API.'''
+        properties = feature.get('properties') or {}
+        properties.pop('collection', None)
+        search_areas = properties.pop('searchAreaNumber', None)
+        geometry = feature.get('geometry') or {}
+        return cls(
+            id=feature.get('id'),
+            collection=collection or feature.get('collection'),
+            properties=properties,
+            geometry_type=geometry.get('type'),
+            coordinates=geometry.get('coordinates'),
+            search_areas=feature.get('searchAreaNumber', search_areas)
+        )
+
+    @property
+    def geometry(self) -> dict | None:
+        '''The geometry of the feature as a GeoJSON geometry object.'''
+        if self.geometry_type is None:
+            return None
+        return {'type': self.geometry_type, 'coordinates': self.coordinates}
+
+    @property
+    def shape(self):
+        '''The geometry of the feature as a Shapely geometry object. This is created on first access, and then reused.'''
+        if self._shape is None and self.geometry_type is not None:
+            from shapely.geometry import shape
+            self._shape = shape(self.geometry)
+        return self._shape
+
+    def add_search_area(self, search_area_number: int) -> None:
+        '''Records that the feature is found in a further search area.'''
+        if self.search_areas is None:
+            self.search_areas = search_area_number
+        elif isinstance(self.search_areas, list):
+            self.search_areas.append(search_area_number)
+        else:
+            self.search_areas = [self.search_areas, search_area_number]
+
+    def to_geojson(self) -> dict:
+        '''Converts the record to a GeoJSON feature, in the standard output format of the wrappers.'''
+        properties = self.properties
+        properties['collection'] = self.collection
+        feature = {
+            'type': 'Feature',
+            'id': self.id,
+            'geometry': self.geometry,
+            'properties': properties,
+            'collection': self.collection
+        }
+        if self.search_areas is not None:
+            first_search_area = self.search_areas[0] if isinstance(self.search_areas, list) else self.search_areas
+            properties['searchAreaNumber'] = first_search_area
+            feature['searchAreaNumber'] = self.search_areas
+        return feature
+
+    def __repr__(self) -> str:
+        return f'FeatureRecord(id={self.id!r}, collection={self.collection!r}, geometry_type={self.geometry_type!r})'
+
+
+class FeatureChain(Sequence):
+    '''
+    A lazy, read-only view of several lists of features as a single sequence, used for the flat output of the wrappers with lazy_output.
+    Rather than copying every feature reference into a new list at each level of nesting (pages, search areas, collections), the chain holds references to the source lists.
+    It supports iteration, len, indexing and slicing (which returns a list), and is converted to a list with to_list().
+    Chains added to a chain are flattened, so indexing cost does not grow with the depth of nesting.
+    The source lists must not be changed once added to the chain.
+    '''
+
+    __slots__ = ('_sources', '_ends')
+
+    def __init__(self, sources: list[list] = ()) -> None:
+        self._sources = []
+        # The cumulative number of features at the end of each source list, for indexing by bisection
+        self._ends = []
+        for features in sources:
+            self.extend(features)
+
+    def _add_source(self, features: list) -> None:
+        self._sources.append(features)
+        self._ends.append(len(self) + len(features))
+
+    def extend(self, features: list) -> None:
+        '''Appends a list of features (or another chain) to the view, without copying it.'''
+        if isinstance(features, FeatureChain):
+            for source in features._sources:
+                self._add_source(source)
+        elif features:
+            self._add_source(features)
+
+    def __iadd__(self, features: list) -> 'FeatureChain':
+        self.extend(features)
+        return self
+
+    def __len__(self) -> int:
+        return self._ends[-1] if self._ends else 0
+
+    def __iter__(self):
+        return chain.from_iterable(self._sources)
+
+    def __getitem__(self, index: int | slice):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step == 1:
+                return list(islice(self, start, max(start, stop)))
+            return [self[i] for i in range(start, stop, step)]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('FeatureChain index out of range')
+        source = bisect_right(self._ends, index)
+        start = self._ends[source - 1] if source else 0
+        return self._sources[source][index - start]
+
+    def to_list(self) -> list:
+        '''Materialises the chain as a single list of features.'''
+        return list(self)
+
+    def __repr__(self) -> str:
+        return f'FeatureChain(numberOfFeatures={len(self)}, numberOfSources={len(self._sources)})'
+
+
+def compact_features(features: list[dict], collection: str = None) -> list[FeatureRecord]:
+    '''Converts a list of GeoJSON features to compact feature records.'''
+    return [FeatureRecord.from_geojson(feature, collection) for feature in features]
+
+
+def to_geojson_output(response: dict) -> dict:
+    '''
+    Converts any compact feature records in a wrapper response to GeoJSON features, in place.
+    Handles flat GeoJSON responses, and hierarchical responses by search area and/or collection.
+    Lazy FeatureChain outputs are materialised as lists.
+    Returns the response.
+    '''
+    if 'features' in response:
+        response['features'] = [
+            feature.to_geojson() if isinstance(feature, FeatureRecord) else feature
+            for feature in response['features']
+        ]
+    elif 'searchAreas' in response:
+        for area in response['searchAreas']:
+            to_geojson_output(area)
+    else:
+        for value in response.values():
+            if isinstance(value, dict):
+                to_geojson_output(value)
+    return response
+
+
+def materialise_features(response: dict) -> dict:
+    '''
+    Converts any lazy FeatureChain outputs in a wrapper response to lists, in place, so that the response is a plain GeoJSON dictionary (eg. for JSON serialisation).
+    Handles flat GeoJSON responses, and hierarchical responses by search area and/or collection.
+    Returns the response.
+    '''
+    if isinstance(response.get('features'), FeatureChain):
+        response['features'] = response['features'].to_list()
+    elif 'searchAreas' in response:
+        for area in response['searchAreas']:
+            materialise_features(area)
+    else:
+        for value in response.values():
+            if isinstance(value, dict):
+                materialise_features(value)
+    return response
@@ -0,0 +1,142 @@
+'''
+Hedged requests for the OS NGD API - Features wrappers.
+When a request has not responded within an adaptive threshold (by default, the 95th percentile of observed latencies), a duplicate request is issued.
+The first response received is used, and the other is discarded. This cuts the tail latency of paginated pulls, where a single slow page can delay the whole call.
+The number of duplicate requests is capped as a fraction of the total number of requests, to limit the extra cost.
+'''
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+HEDGE_MAX_EXTRA_FRACTION: float = 0.1
+HEDGE_QUANTILE: float = 0.95
+HEDGE_MIN_SAMPLES: int = 10
+HEDGE_INITIAL_THRESHOLD_SECONDS: float = 2.0
+HEDGE_LATENCY_WINDOW: int = 200
+HEDGE_MAX_WORKERS: int = 16
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_hedging_executor() -> ThreadPoolExecutor:
+    '''Returns the shared thread pool used to run hedged requests, creating it on first use.'''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=HEDGE_MAX_WORKERS,
+                thread_name_prefix='ngd-hedge'
+            )
+    return _executor
+
+
+class HedgingPolicy:
+    '''
+    Tracks request latencies and hedging costs for a single call, which may span many pages, search areas and collections.
+    Parameters:
+        max_extra_fraction (float, default 0.1) - The maximum number of hedged requests, as a fraction of the total number of requests.
+        quantile (float, default 0.95) - The quantile of observed latencies after which a request is hedged.
+        min_samples (int, default 10) - The number of latencies to observe before the adaptive threshold is used.
+        initial_threshold (float, default 2.0) - The threshold in seconds used until enough latencies have been observed.
+    '''
+
+    def __init__(
+            self,
+            max_extra_fraction: float = HEDGE_MAX_EXTRA_FRACTION,
+            quantile: float = HEDGE_QUANTILE,
+            min_samples: int = HEDGE_MIN_SAMPLES,
+            initial_threshold: float = HEDGE_INITIAL_THRESHOLD_SECONDS
+        ) -> None:
+        self.max_extra_fraction = max_extra_fraction
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.initial_threshold = initial_threshold
+        self.latencies = deque(maxlen=HEDGE_LATENCY_WINDOW)
+        self.number_of_requests = 0
+        self.number_of_hedged_requests = 0
+        self._lock = threading.Lock()
+
+    def threshold(self) -> float:
+        '''Returns the number of seconds to wait for a response before hedging.'''
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_threshold
+            ordered = sorted(self.latencies)
+        index = min(int(len(ordered) * self.quantile), len(ordered) - 1)
+        return ordered[index]
+
+    def record_latency(self, seconds: float) -> None:
+        '''Records the latency of a successful request.'''
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def register_request(self) -> None:
+        '''Registers a (non-hedged) request against the call.'''
+        with self._lock:
+            self.number_of_requests += 1
+
+    def acquire_hedge(self) -> bool:
+        '''Returns True and registers a hedged request if this would remain within the cap on extra requests.'''
+        with self._lock:
+            allowed = self.number_of_hedged_requests + 1 <= self.max_extra_fraction * self.number_of_requests
+            if allowed:
+                self.number_of_hedged_requests += 1
+            return allowed
+
+
+def resolve_hedging_policy(hedge_requests: bool | HedgingPolicy) -> HedgingPolicy | None:
+    '''
+    Converts the hedge_requests parameter into a HedgingPolicy, so that one policy can be shared by all requests in a call.
+    True creates a policy with default settings, and an existing policy is returned as it is.
+    '''
+    if isinstance(hedge_requests, HedgingPolicy):
+        return hedge_requests
+    if hedge_requests:
+        return HedgingPolicy()
+    return None
+
+
+def _close_response(future) -> None:
+    '''Closes the response of a discarded request, releasing its connection.'''
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+def hedged_request(policy: HedgingPolicy, send: callable) -> tuple:
+    '''
+    Runs send(), issuing a duplicate if no response arrives within the policy's threshold and the cap on extra requests allows.
+    The first successful response is returned. The other request cannot be interrupted once in flight, so it is cancelled if it has not started, and otherwise its response is closed on arrival.
+    Returns a tuple of the response and whether the request was hedged.
+    '''
+    executor = get_hedging_executor()
+    policy.register_request()
+    threshold = policy.threshold()
+
+    def timed_send():
+        start = time.monotonic()
+        response = send()
+        policy.record_latency(time.monotonic() - start)
+        return response
+
+    primary = executor.submit(timed_send)
+    done, _ = wait([primary], timeout=threshold)
+    if done or not policy.acquire_hedge():
+        return primary.result(), False
+
+    pending = {primary, executor.submit(timed_send)}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    if not other.cancel():
+                        other.add_done_callback(_close_response)
+                for other in done - {future}:
+                    _close_response(other)
+                return future.result(), True
+            error = future.exception()
+    raise error
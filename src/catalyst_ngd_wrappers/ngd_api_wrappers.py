@@ -14,20 +14,30 @@ It includes:
 
 import re
 import os
+from concurrent.futures import Executor
 from json import JSONDecodeError
 from datetime import datetime, timedelta
-import time
 
-import requests as r
-
-from shapely import from_wkt
-from shapely.errors import GEOSException
-
-from .utils import prepare_parameters, handle_decode_error, multilevel_explode, construct_error_response
+from .utils import (
+    handle_decode_error,
+    multilevel_explode,
+    construct_error_response,
+    allocate_budget,
+    budget_usage,
+    construct_budget_exhausted_response,
+    construct_dry_run_response
+)
 from .telemetry import prepare_telemetry_custom_dimensions
+from .retries import request_with_retries, CircuitOpenError
+from .hedging import HedgingPolicy, hedged_request, resolve_hedging_policy
+from .features import FeatureRecord, FeatureChain, compact_features
+from .query_plan import QueryPlan
+from .queryables import validate_queryables
+from .spatial import POST_PROCESS_EXECUTOR_MIN_FEATURES, SpatialPostProcessor, BoundSpatialPostProcessor
+from .tenants import Tenant
+from .projection import Projection
 
 UNIVERSAL_TIMEOUT: int = 20
-RETRIES: int = 3
 
 
 def flag_recent_versions(
@@ -71,20 +81,14 @@ def get_latest_collection_versions(recent_update_days: int = None, **kwargs) ->
     More details on feature collection naming can be found at https://docs.os.uk/osngd/accessing-os-ngd/access-the-os-ngd-api/os-ngd-api-features/what-data-is-available
     '''
 
-    for attempt in range(RETRIES):
-        try:
-            response = r.get(
-                'https://api.os.uk/features/ngd/ofa/v1/collections/',
-                timeout=UNIVERSAL_TIMEOUT,
-                **kwargs
-            )
-            response.raise_for_status()
-            collections_data = response.json().get('collections')
-            break
-        except (r.RequestException, ValueError) as e:
-            if attempt < RETRIES - 1:
-                raise e
-            time.sleep(2 ** attempt)  # Exponential backoff
+    kwargs.setdefault('timeout', UNIVERSAL_TIMEOUT)
+    response = request_with_retries(
+        'GET',
+        'https://api.os.uk/features/ngd/ofa/v1/collections/',
+        **kwargs
+    )
+    response.raise_for_status()
+    collections_data = response.json().get('collections')
 
     collections_list = [collection['id'] for collection in collections_data]
     collections_dict = {}
@@ -133,11 +137,12 @@ def get_specific_latest_collections(collection: list[str], **kwargs) -> str:
     return specific_latest_collections
 
 
-def get_access_token(client_id: str, client_secret: str) -> str:
+def get_access_token(client_id: str, client_secret: str, **kwargs) -> str:
     '''
     Supplies a temporary access token for of the OS NGD API
     Times out after 5 minutes
     Takes the project client_id and client_secret as input
+    Other keyword arguments (eg. session) are passed to request_with_retries
     '''
 
     url = 'https://api.os.uk/oauth2/token/v1'
@@ -146,11 +151,15 @@ def get_access_token(client_id: str, client_secret: str) -> str:
         'grant_type': 'client_credentials'
     }
 
-    response = r.post(
+    # Token requests are safe to repeat, so are retried despite being POST requests
+    response = request_with_retries(
+        'POST',
         url,
+        idempotent=True,
         auth=(client_id, client_secret),
         data=data,
-        timeout=UNIVERSAL_TIMEOUT
+        timeout=UNIVERSAL_TIMEOUT,
+        **kwargs
     )
 
     json_response = response.json()
@@ -161,14 +170,58 @@ def get_access_token(client_id: str, client_secret: str) -> str:
     return token
 
 
-def base_request(**kwargs):
-    '''A basic wrapper around requests.get() to return a JSON response, with the response code added.'''
-    response = r.get(
-        timeout=UNIVERSAL_TIMEOUT,
-        **kwargs
-    )
-    json_response = response.json()
+def base_request(hedging: HedgingPolicy = None, projection: Projection = None, raw: bool = False, **kwargs):
+    '''
+    A basic wrapper around requests.get() to return a JSON response, with the response code added.
+    If a projection is supplied, the features are projected as the response is decoded.
+    If raw is True, a successful response is not decoded, and its body is returned under 'content', so that it can be decoded elsewhere (eg. in another process).
+    Transient failures are retried individually, so a single failed page does not restart the whole call.
+    If the request still fails, or the circuit breaker for the API is open, an error response is returned.
+    If a hedging policy is supplied, a duplicate request is issued when the response is slow, and the number of hedged requests is added to the response.
+    '''
+    import requests as r
+
+    kwargs.setdefault('timeout', UNIVERSAL_TIMEOUT)
+    hedged = False
+    try:
+        if hedging is not None:
+            response, hedged = hedged_request(
+                policy=hedging,
+                send=lambda: request_with_retries('GET', **kwargs)
+            )
+        else:
+            response = request_with_retries('GET', **kwargs)
+    except CircuitOpenError as e:
+        return construct_error_response(
+            status_code = 503,
+            message = str(e),
+            error_source = 'OS NGD API'
+        )
+    except r.Timeout:
+        return construct_error_response(
+            status_code = 504,
+            message = 'The request to OS NGD API - Features timed out after repeated attempts.',
+            error_source = 'OS NGD API'
+        )
+    except r.ConnectionError:
+        return construct_error_response(
+            status_code = 503,
+            message = 'OS NGD API - Features could not be reached after repeated attempts.',
+            error_source = 'OS NGD API'
+        )
+    except r.RequestException as e:
+        return construct_error_response(
+            status_code = 502,
+            message = f'The request to OS NGD API - Features failed. {type(e).__name__}: {e}',
+            error_source = 'OS NGD API'
+        )
+    if raw and response.status_code < 400:
+        json_response = {'content': response.content}
+    else:
+        json_response = projection.decode(response.content) if projection is not None else response.json()
     json_response['code'] = response.status_code
+    if hedging is not None:
+        json_response['numberOfHedgedRequests'] = int(hedged)
     return json_response
 
 
@@ -180,22 +233,26 @@ def oauth2_authentication(func: callable) -> callable:
     def wrapper(
         headers: dict = None,
         params: dict = None,
+        tenant: Tenant = None,
         **kwargs
     ) -> dict:
         '''Runs OS NGD API - Features request, handling authentication via environment variables.
         5-minute access tokens are stored as environment variables, and reused if available.
         If no token is available, or if the token has expired, a new token is requested using the CLIENT_ID and CLIENT_SECRET environment variables.
         If these are not set, it will return a 401 error.
+        If a tenant is supplied, its own cached token and credentials are used instead, and the environment variables are neither read nor written.
         The url itself is not explicitly supplied, but expected as kwargs.
         Parameters:
             headers (dict, optional) - Headers to pass to the query. These can include bearer-token authentication.
             params (dict, optional) - Parameters to pass to the query as query parameters, supplied in a dictionary.
+            tenant (Tenant, optional) - The tenant whose credentials authenticate the request. See catalyst_ngd_wrappers.tenants.
             **kwargs: other generic parameters to be passed to the requests.get()
         Returns the response from the request, or a 401 error if authentication fails.
         '''
 
+        # Headers are copied as the Authorization header is added; params are only read, so are passed through as they are
         headers = headers.copy() if headers else {}
-        params = params.copy() if params else {}
+        params = params or {}
 
         def run_request(headers_: dict) -> dict:
             '''Runs the request with the given headers and returns the response.'''
@@ -212,26 +269,45 @@ def oauth2_authentication(func: callable) -> callable:
         if headers.get('key') or params.get('key'):
             return run_request(headers)
 
-        access_token = os.environ.get('ACCESS_TOKEN')
+        token_manager = tenant.token_manager if tenant is not None else None
+        if token_manager is not None:
+            access_token = token_manager.cached_token()
+        else:
+            access_token = os.environ.get('ACCESS_TOKEN')
         if access_token:
             headers['Authorization'] = f'Bearer {access_token}'
             response = run_request(headers)
             if response.get('code', 0) != 401:
                 return response
 
-        client_id = os.environ.get('CLIENT_ID')
-        client_secret = os.environ.get('CLIENT_SECRET')
+        from requests import RequestException
+
         try:
-            access_token = get_access_token(
-                client_id=client_id,
-                client_secret=client_secret
-            )
+            if token_manager is not None:
+                access_token = token_manager.refresh_token(stale_token=access_token)
+            else:
+                access_token = get_access_token(
+                    client_id=os.environ.get('CLIENT_ID'),
+                    client_secret=os.environ.get('CLIENT_SECRET')
+                )
         except PermissionError:
+            if token_manager is not None:
+                return construct_error_response(
+                    status_code = 401,
+                    message = 'Invalid client_id and/or client_secret for this tenant.'
+                )
             return construct_error_response(
                 status_code = 401,
                 message = 'Missing or invalid CLIENT_ID and/or CLIENT_SECRET. Make sure these are configured correctely in your environment variables.'
             )
-        os.environ['ACCESS_TOKEN'] = access_token
+        except (CircuitOpenError, RequestException):
+            return construct_error_response(
+                status_code = 503,
+                message = 'An access token could not be obtained from the OS OAuth2 API after repeated attempts.',
+                error_source = 'OS NGD API'
+            )
+        if token_manager is None:
+            os.environ['ACCESS_TOKEN'] = access_token
         headers['Authorization'] = f'Bearer {access_token}'
         return run_request(headers)
 
@@ -266,6 +342,18 @@ def ngd_items_request(
     log_request_details: bool = True,
     wkt: str = None,
     filter_params: dict = None,
+    max_requests: int = None,
+    max_features: int = None,
+    hedge_requests: bool | HedgingPolicy = False,
+    compact: bool = False,
+    feature_sink = None,
+    query_plan: QueryPlan = None,
+    validate_query: bool = False,
+    post_processor: BoundSpatialPostProcessor = None,
+    tenant: Tenant = None,
+    properties: list[str] = None,
+    include_geometry: bool = True,
+    raw: bool = False,
     **kwargs
 ) -> dict:
     '''
@@ -287,37 +375,92 @@ def ngd_items_request(
         use_latest_collection (boolean, default False) - If True, it ensures that if a specific version of a collection is not supplied (eg. bld-fts-building[-2]), the latest version is used.
             Note that if use_latest_collection but 'collection' does specify a version, the specified version is always used regardless of use_latest_collection.
         headers (dict, optional) - Headers to pass to the query. These can include bearer-token authentication.
+        max_requests (int, optional) - A call-level budget for the number of requests. If 0, no request is made and an empty response is returned, flagged with 'budgetExhausted'.
+        max_features (int, optional) - A call-level budget for the number of features. The 'limit' query parameter is capped to this value.
+        hedge_requests (boolean or HedgingPolicy, default False) - If True, a duplicate request is issued when the response is slower than the adaptive threshold of the hedging policy, and the first response is used.
+            The number of hedged requests is added to the response under 'numberOfHedgedRequests'. Hedged requests are charged to max_requests, so a request is not hedged unless the budget has room for the duplicate.
+        compact (boolean, default False) - If True, features are returned as compact FeatureRecord objects rather than GeoJSON dictionaries, reducing memory use for large pulls.
+            Records can be converted to the standard GeoJSON output with catalyst_ngd_wrappers.features.to_geojson_output.
+        feature_sink (FeatureSink, optional) - If supplied, features are written to the sink as each page arrives, and are not included in the response. See catalyst_ngd_wrappers.export.
+        query_plan (QueryPlan, optional) - The compiled query plan of the call, shared by the wrappers so that the query is only prepared once. A plan is created if not supplied.
+            Pass a QueryPlan to list the requests made with its explain() method, or a QueryPlan(dry_run=True) to plan the requests without making them. See catalyst_ngd_wrappers.query_plan.
+        validate_query (boolean, default False) - If True, filter_params, the attributes used in the 'filter' query parameter, and the CRS parameters are validated against the queryables of the collection before any request is made.
+            Queryables are fetched from the OS NGD API and cached locally. See catalyst_ngd_wrappers.queryables.
+        post_processor (BoundSpatialPostProcessor, optional) - Refines each page of features against a search area before it is returned. This is supplied by the geom extension; see catalyst_ngd_wrappers.spatial.
+        tenant (Tenant, optional) - The tenant making the request, for deployments serving several projects' credentials. Requests are made through the tenant's pooled session and rate limiter, and authenticated with its API key or its own cached access token, rather than the environment variables.
+            Tenants are created and reused with a TenantRegistry; see catalyst_ngd_wrappers.tenants.
+        properties (list of str, optional) - If supplied, only these properties are kept for each feature. They are selected as each page is decoded, so other attributes are not held for the rest of the call.
+        include_geometry (boolean, default True) - If False, the geometry of each feature is dropped (set to null) as each page is decoded.
+            See catalyst_ngd_wrappers.projection.
+        raw (boolean, default False) - If True, a successful page is returned undecoded, as {'code': 200, 'content': bytes, 'numberOfRequests': 1}, for decoding elsewhere. Error responses are decoded as normal.
+            Projection, post-processing, compaction, sinks and telemetry are then left to the caller. This is used for bulk extracts; see catalyst_ngd_wrappers.bulk.
         **kwargs - other parameters to be passed to the request.Session.request get method eg. headers, timeout.
 
     Returns the features as a geojson, as per the OS NGD API.
     '''
 
-    params = params.copy() if params else {}
-    headers = headers.copy() if headers else {}
-
     kwargs.pop('hierarchical_output', None)
-    # Remove host header as this is automatically added by the requests library and can cause issues
-    headers.pop('host', None)
+    kwargs.pop('lazy_output', None)
+
+    budget_active = max_requests is not None or max_features is not None
+    if (max_requests is not None and max_requests < 1) or (max_features is not None and max_features < 1):
+        return construct_budget_exhausted_response(collection)
+
+    budget_capped = False
+    capped_limit = None
+    if max_features is not None:
+        requested_limit = int((params or {}).get('limit', 100))
+        budget_capped = max_features < requested_limit
+        capped_limit = min(requested_limit, max_features)
+
+    if tenant is not None:
+        kwargs.update(tenant.request_kwargs())
+        if tenant.api_key:
+            headers = (headers or {}) | {'key': tenant.api_key}
+
+    if query_plan is None:
+        query_plan = QueryPlan()
+    query_plan.compile(params=params, filter_params=filter_params, headers=headers)
+
+    collection = query_plan.resolve_collection(collection, use_latest_collection)
+
+    if validate_query and collection not in query_plan.validated_collections:
+        error = validate_queryables([collection], params=params, filter_params=filter_params)
+        if error:
+            return error
+        query_plan.validated_collections.add(collection)
+
+    url = query_plan.url(collection)
+    params = query_plan.request_params(params, wkt=wkt, limit=capped_limit)
+    query_plan.record(collection, url, params)
+
+    if query_plan.dry_run:
+        json_response = construct_dry_run_response(url)
+        if budget_active:
+            json_response['budgetExhausted'] = budget_capped
+        return json_response
 
-    if use_latest_collection:
-        collection = get_specific_latest_collections(
-            [collection]).get(collection, collection)
+    request_func = oauth2_authentication(
+        base_request) if authenticate else base_request
 
-    params = prepare_parameters(
-        query_params=params,
-        wkt=wkt,
-        filter_params=filter_params,
-    )
+    if authenticate and tenant is not None:
+        kwargs['tenant'] = tenant
 
-    url = f'https://api.os.uk/features/ngd/ofa/v1/collections/{collection}/items/'
+    projection = Projection.from_options(properties, include_geometry)
+    if raw:
+        kwargs['raw'] = True
+    elif projection is not None:
+        kwargs['projection'] = projection
 
-    request_func = oauth2_authentication(
-        base_request) if authenticate else base_request
+    hedging = resolve_hedging_policy(hedge_requests)
+    # A hedged request costs two requests, so is not hedged when the request budget only has room for one
+    if hedging is not None and (max_requests is None or max_requests >= 2):
+        kwargs['hedging'] = hedging
 
     json_response = request_func(
         url=url,
         params=params,
-        headers=headers,
+        headers=query_plan.headers,
         **kwargs
     )
 
@@ -339,11 +482,22 @@ def ngd_items_request(
         json_response['errorSource'] = 'OS NGD API'
         return json_response
 
-    for feature in json_response['features']:
-        feature['collection'] = collection
-        feature['properties']['collection'] = collection
+    if raw:
+        json_response['numberOfRequests'] = 1
+        return json_response
+
+    if not compact:
+        for feature in json_response['features']:
+            feature['collection'] = collection
+            feature['properties']['collection'] = collection
 
     json_response['numberOfRequests'] = 1
+    # Features are charged to the call-level budget as fetched, before any are dropped by post-processing or de-duplication
+    json_response['numberFetched'] = len(json_response['features'])
+
+    if budget_active:
+        has_next = any(link['rel'] == 'next' for link in json_response.get('links', []))
+        json_response['budgetExhausted'] = budget_capped and has_next
 
     if log_request_details:
         json_response['telemetryData'] = prepare_telemetry_custom_dimensions(
@@ -353,6 +507,17 @@ def ngd_items_request(
             query_params=params
         )
 
+    if post_processor is not None:
+        json_response['features'] = post_processor.process(json_response['features'])
+        json_response['numberReturned'] = len(json_response['features'])
+
+    if compact:
+        json_response['features'] = compact_features(json_response['features'], collection)
+
+    if feature_sink is not None:
+        feature_sink.write_features(json_response['features'], collection=collection)
+        json_response['features'] = []
+
     return json_response
 
 
@@ -365,10 +530,16 @@ def limit_extension(func: callable) -> callable:
         request_limit: int = 50,
         limit: int = None,
         params: dict = None,
+        max_requests: int = None,
+        max_features: int = None,
+        hedge_requests: bool | HedgingPolicy = False,
+        lazy_output: bool = False,
         **kwargs
     ) -> dict:
 
         params = params.copy() if params else {}
+        hedging = resolve_hedging_policy(hedge_requests)
+        number_of_hedged_requests = 0
 
         if 'limit' in params:
             return construct_error_response(
@@ -380,35 +551,61 @@ def limit_extension(func: callable) -> callable:
                 message = "'offset' is not a valid attribute for functions using this Catalyst wrapper.",
             )
 
-        features = []
+        if kwargs.get('query_plan') is None:
+            kwargs['query_plan'] = QueryPlan()
 
-        batch_count, final_batchsize = divmod(
-            limit, 100) if limit else (None, None)
-        request_count = 0
-        offset = 0
+        # With lazy_output, the pages are chained together rather than copied into a single list
+        features = FeatureChain() if lazy_output else []
 
         if not limit and not request_limit:
             return construct_error_response(
                 message = 'At least one of limit or request_limit must be provided to prevent indefinitely numerous requests and high costs.'
             )
 
-        while (request_count != request_limit) and (not (limit) or offset < limit):
+        limit = limit or None
+
+        # The call-level budget applies on top of limit and request_limit, with the lower constraint applied
+        budget_active = max_requests is not None or max_features is not None
+        budget_bound_requests = max_requests is not None and (not request_limit or max_requests < request_limit)
+        budget_bound_features = max_features is not None and (not limit or max_features < limit)
+        if budget_bound_requests:
+            request_limit = max(max_requests, 0)
+        if budget_bound_features:
+            limit = max(max_features, 0)
+
+        batch_count, final_batchsize = divmod(
+            limit, 100) if limit is not None else (None, None)
+        request_count = 0
+        number_fetched = 0
+        offset = 0
+        more_available = True
+
+        # Hedged requests are paid for, so are charged to max_requests alongside the pages requested
+        while (request_count != request_limit) and (limit is None or offset < limit) and (
+            max_requests is None or request_count + number_of_hedged_requests < max_requests
+        ):
 
             if request_count == batch_count:
                 params['limit'] = final_batchsize
             params['offset'] = offset
 
+            # A hedged page costs two requests, so pages are only hedged while the request budget has room for both
+            page_hedging = hedging if max_requests is None or max_requests - request_count - number_of_hedged_requests >= 2 else None
             json_response = func(
                 params=params,
+                hedge_requests=page_hedging,
                 **kwargs
             )
             json_response.pop('numberOfRequests', None)
             if json_response.get('code') and json_response['code'] >= 400:
                 return json_response
             request_count += 1
+            number_of_hedged_requests += json_response.pop('numberOfHedgedRequests', 0)
+            number_fetched += json_response.pop('numberFetched', len(json_response['features']))
             features += json_response['features']
 
             if not [link for link in json_response['links'] if link['rel'] == 'next']:
+                more_available = False
                 break
 
             offset += 100
@@ -416,11 +613,21 @@ def limit_extension(func: callable) -> callable:
         geojson = {
             'type': 'FeatureCollection',
             'numberOfRequests': request_count,
+            'numberFetched': number_fetched,
             'numberReturned': len(features),
+            'moreAvailable': more_available,
             'timeStamp': datetime.now().isoformat(),
             'collection': kwargs.get('collection'),
             'features': features
         }
+        if hedging is not None:
+            geojson['numberOfHedgedRequests'] = number_of_hedged_requests
+        if budget_active:
+            requests_exhausted = max_requests is not None and request_count + number_of_hedged_requests >= max_requests
+            geojson['budgetExhausted'] = more_available and (
+                (requests_exhausted and (budget_bound_requests or request_count != request_limit))
+                or (budget_bound_features and offset >= limit)
+            )
         return geojson
 
     wrapper.__name__ = func.__name__ + '+limit_extension'
@@ -433,6 +640,13 @@ def limit_extension(func: callable) -> callable:
     - request_limit: The maximum number of calls to be made to {funcname}. Default is 50.
     - limit: The maximum number of features to be returned. Default is None.
     - params: A dictionary of query parameters to be passed to the function. Default is an empty dictionary.
+    - max_requests: A call-level budget for the number of requests, applied alongside request_limit. Default is None.
+    - max_features: A call-level budget for the number of features, applied alongside limit. Default is None.
+    - hedge_requests: If True, slow page requests are hedged with a duplicate request, and the number of hedged requests is reported under 'numberOfHedgedRequests'. Default is False.
+      Hedged requests are charged to max_requests, and pages are not hedged once the budget has no room for a duplicate request.
+    - lazy_output: If True, 'features' is returned as a FeatureChain view over the pages, rather than a list they are copied into. Default is False.
+    When a budget stops the pagination before all features are returned, the response is flagged with 'budgetExhausted'.
+    'moreAvailable' records whether the pagination stopped (at limit, request_limit or a budget) before the last page of features.
     To prevent indefinite requests and high costs, at least one of limit or request_limit must be provided, although there is no limit to the upper value these can be.
     It will make multiple requests to the function to compile all features from the specified collection, returning a dictionary with the features and metadata.
 
@@ -448,19 +662,21 @@ def multigeometry_search_extension(func: callable) -> callable:
     A wrapper function, extending the input function handle multigeometry search areas, searching each one in turn.
     '''
 
-    def flatten_search_areas(search_areas: list) -> dict:
+    def flatten_search_areas(search_areas: list, lazy_output: bool = False) -> dict:
         '''
         Flattens hierarchical search area results into a single geojson object, merging appropriate metadata.
+        With lazy_output, the features of each search area are chained together rather than copied into a single list.
         '''
 
         geojson = {
             'type': 'FeatureCollection',
             'numberOfRequests': 0,
+            'numberFetched': 0,
             'numberReturned': 0,
-            'features': []
+            'features': FeatureChain() if lazy_output else []
         }
 
-        ids = []
+        features_by_id = {}
         geojson_fts = geojson['features']
 
         for area in search_areas:
@@ -468,27 +684,44 @@ def multigeometry_search_extension(func: callable) -> callable:
             search_area_number = area.pop('searchAreaNumber')
 
             features = area['features']
-            for feat in features:
-                feat['searchAreaNumber'] = search_area_number
-                feat['properties']['searchAreaNumber'] = search_area_number
-
-            new_features = []
-            for feat in features:
-                if feat['id'] in ids:
-                    index = [v for v, gf in enumerate(
-                        geojson_fts) if gf['id'] == feat['id']][0]
-                    n = geojson_fts[index]['searchAreaNumber']
+            # The features of a search area are only copied once one is found to be a duplicate of a feature in a previous search area
+            new_features = None
+            for i, feat in enumerate(features):
+                compact = isinstance(feat, FeatureRecord)
+                feat_id = feat.id if compact else feat['id']
+                existing = features_by_id.get(feat_id)
+                if existing is not None:
+                    if new_features is None:
+                        new_features = features[:i]
+                    if isinstance(existing, FeatureRecord):
+                        existing.add_search_area(search_area_number)
+                        continue
+                    n = existing['searchAreaNumber']
                     n = [n] if not (isinstance(n, list)) else n
                     n.append(search_area_number)
-                    geojson_fts[index]['searchAreaNumber'] = n
+                    existing['searchAreaNumber'] = n
+                elif compact:
+                    feat.search_areas = search_area_number
+                    if new_features is not None:
+                        new_features.append(feat)
+                    features_by_id[feat_id] = feat
                 else:
                     feat['searchAreaNumber'] = search_area_number
-                    new_features.append(feat)
-                    ids.append(feat['id'])
+                    feat['properties']['searchAreaNumber'] = search_area_number
+                    if new_features is not None:
+                        new_features.append(feat)
+                    features_by_id[feat_id] = feat
 
+            if new_features is None:
+                new_features = features
             geojson_fts += new_features
             geojson['numberOfRequests'] += area['numberOfRequests']
+            geojson['numberFetched'] += area.get('numberFetched', len(features))
             geojson['numberReturned'] += len(new_features)
+            if 'moreAvailable' in area:
+                geojson['moreAvailable'] = geojson.get('moreAvailable', False) or area['moreAvailable']
+            if 'numberOfHedgedRequests' in area:
+                geojson['numberOfHedgedRequests'] = geojson.get('numberOfHedgedRequests', 0) + area['numberOfHedgedRequests']
 
         geojson['timeStamp'] = datetime.now().isoformat()
 
@@ -497,9 +730,40 @@ def multigeometry_search_extension(func: callable) -> callable:
     def wrapper(
         wkt: str,
         hierarchical_output: bool = False,
+        lazy_output: bool = False,
+        max_requests: int = None,
+        max_features: int = None,
+        hedge_requests: bool | HedgingPolicy = False,
+        spatial_predicate: str = None,
+        clip: bool = False,
+        measure: bool = False,
+        post_process_executor: Executor = None,
+        post_process_min_features: int = POST_PROCESS_EXECUTOR_MIN_FEATURES,
         **kwargs
     ) -> dict:
 
+        from shapely import from_wkt
+        from shapely.errors import GEOSException
+
+        kwargs['hedge_requests'] = resolve_hedging_policy(hedge_requests)
+
+        post_processor = None
+        if spatial_predicate or clip or measure:
+            if not kwargs.get('include_geometry', True):
+                return construct_error_response(
+                    message = 'Feature geometries are required for spatial_predicate, clip and measure, so include_geometry cannot be False.'
+                )
+            try:
+                post_processor = SpatialPostProcessor(
+                    predicate=spatial_predicate,
+                    clip=clip,
+                    measure=measure,
+                    executor=post_process_executor,
+                    executor_min_features=post_process_min_features
+                )
+            except ValueError as e:
+                return construct_error_response(message=str(e))
+
         try:
             full_geom = from_wkt(wkt) if isinstance(wkt, str) else wkt
         except GEOSException:
@@ -511,23 +775,52 @@ def multigeometry_search_extension(func: callable) -> callable:
         search_areas = []
         partial_geoms = multilevel_explode(full_geom)
 
+        if kwargs.get('query_plan') is None:
+            kwargs['query_plan'] = QueryPlan()
+
+        budget_active = max_requests is not None or max_features is not None
+        remaining_requests, remaining_features = max_requests, max_features
+
+        feature_sink = kwargs.pop('feature_sink', None)
+
         for search_area, geom in enumerate(partial_geoms):
+            areas_remaining = len(partial_geoms) - search_area
+            if feature_sink is not None:
+                kwargs['feature_sink'] = feature_sink.bind(search_area_number=search_area, deduplicate=len(partial_geoms) > 1)
+            if post_processor is not None:
+                kwargs['post_processor'] = post_processor.bind(geom)
+            if budget_active:
+                kwargs['max_requests'] = allocate_budget(remaining_requests, areas_remaining)
+                kwargs['max_features'] = allocate_budget(remaining_features, areas_remaining)
             json_response = func(
                 wkt=geom,
+                lazy_output=lazy_output,
                 **kwargs
             )
             if json_response.get('code') and json_response['code'] >= 400:
                 return json_response
+            if budget_active:
+                used_requests, used_features = budget_usage(json_response)
+                if remaining_requests is not None:
+                    remaining_requests -= used_requests
+                if remaining_features is not None:
+                    remaining_features -= used_features
             json_response['searchAreaNumber'] = search_area
             search_areas.append(json_response)
 
+        budget_exhausted = any(area.get('budgetExhausted') for area in search_areas)
+
         if hierarchical_output:
             response = {
                 'searchAreas': search_areas
             }
+            if budget_active:
+                response['budgetExhausted'] = budget_exhausted
             return response
 
-        response = flatten_search_areas(search_areas)
+        response = flatten_search_areas(search_areas, lazy_output=lazy_output)
+        if budget_active:
+            response['budgetExhausted'] = budget_exhausted
 
         return response
 
@@ -540,6 +833,15 @@ def multigeometry_search_extension(func: callable) -> callable:
     The results are returned in a quasi-GeoJSON format, with features returned under 'searchAreas' in a list, where each item is a json object of results from one search area.
     The search areas are labelled numerically, with the number stored under 'searchAreaNumber'.
     NOTE: If a limit is supplied for the maximum number of features to be returned or requests to be made, this will apply to each search area individually, not to the overall number of results.
+    To constrain the overall number of requests or features, use max_requests and/or max_features. These call-level budgets are shared fairly between the search areas, with any budget unused by one search area passed on to the next.
+    As the OS NGD API only supports the INTERSECTS predicate, features can be refined against each search area client-side, with vectorised Shapely 2 operations on each page:
+        - spatial_predicate: An exact predicate features must satisfy, eg. 'within' or 'contains'. Features which fail it are dropped before results are merged.
+        - clip: If True, feature geometries are clipped to the search area.
+        - measure: If True, the area and length of each feature's intersection with the search area are added as 'intersectionArea' and 'intersectionLength' properties.
+        - post_process_executor: An executor, eg. a ProcessPoolExecutor, to process large pages in.
+        - post_process_min_features: The smallest page which is passed to post_process_executor (default {POST_PROCESS_EXECUTOR_MIN_FEATURES}); smaller pages are processed in-process.
+    'crs' should match 'filter-crs' for these to be correct. Any limit applies to the features returned by the API, before they are refined.
+    With lazy_output, the flat output's 'features' is a FeatureChain view over the features of each search area, rather than a list they are copied into.
 
     ____________________________________________________
     Docs for {funcname}:
@@ -573,18 +875,47 @@ def multiple_collections_extension(func: callable) -> dict:
     def wrapper(
         collection: list[str],
         hierarchical_output: bool = False,
+        lazy_output: bool = False,
         use_latest_collection: bool = False,
+        max_requests: int = None,
+        max_features: int = None,
+        hedge_requests: bool | HedgingPolicy = False,
+        validate_query: bool = False,
         **kwargs
     ) -> dict:
 
+        hedging = resolve_hedging_policy(hedge_requests)
+        kwargs['hedge_requests'] = hedging
+
         if use_latest_collection:
             collection = apply_latest_collection(collection)
 
+        # Every collection is validated before any are requested, so that an invalid query fails before any features are fetched
+        if validate_query:
+            error = validate_queryables(
+                collection,
+                params=kwargs.get('params'),
+                filter_params=kwargs.get('filter_params')
+            )
+            if error:
+                return error
+
+        if kwargs.get('query_plan') is None:
+            kwargs['query_plan'] = QueryPlan()
+
+        budget_active = max_requests is not None or max_features is not None
+        remaining_requests, remaining_features = max_requests, max_features
+
         results = {}
-        for col in collection:
+        for i, col in enumerate(collection):
+            collections_remaining = len(collection) - i
+            if budget_active:
+                kwargs['max_requests'] = allocate_budget(remaining_requests, collections_remaining)
+                kwargs['max_features'] = allocate_budget(remaining_features, collections_remaining)
             json_response = func(
                 collection=col,
                 hierarchical_output=hierarchical_output,
+                lazy_output=lazy_output,
                 **kwargs
             )
             code = json_response.get('code', 200)
@@ -592,6 +923,12 @@ def multiple_collections_extension(func: callable) -> dict:
                 return json_response
             if code >= 400:
                 return json_response
+            if budget_active:
+                used_requests, used_features = budget_usage(json_response)
+                if remaining_requests is not None:
+                    remaining_requests -= used_requests
+                if remaining_features is not None:
+                    remaining_features -= used_features
             results[col] = json_response
 
         if hierarchical_output:
@@ -601,9 +938,10 @@ def multiple_collections_extension(func: callable) -> dict:
             'type': 'FeatureCollection',
             'numberOfRequests': 0,
             'numberOfRequestsByCollection': {},
+            'numberFetched': 0,
             'numberReturned': 0,
             'numberReturnedByCollection': {},
-            'features': []
+            'features': FeatureChain() if lazy_output else []
         }
 
         for col, col_results in results.items():
@@ -613,9 +951,19 @@ def multiple_collections_extension(func: callable) -> dict:
             number_of_requests = col_results.pop('numberOfRequests')
             geojson['numberOfRequests'] += number_of_requests
             geojson['numberOfRequestsByCollection'][col] = number_of_requests
+            geojson['numberFetched'] += col_results.pop('numberFetched', len(features))
             number_returned = col_results.pop('numberReturned')
             geojson['numberReturned'] += number_returned
             geojson['numberReturnedByCollection'][col] = number_returned
+            if hedging is not None:
+                geojson['numberOfHedgedRequests'] = geojson.get('numberOfHedgedRequests', 0) + col_results.pop('numberOfHedgedRequests', 0)
+            if 'moreAvailable' in col_results:
+                geojson['moreAvailable'] = geojson.get('moreAvailable', False) or col_results.pop('moreAvailable')
+
+        if budget_active:
+            geojson['budgetExhausted'] = any(
+                col_results.get('budgetExhausted', False) for col_results in results.values()
+            )
 
         geojson['timeStamp'] = datetime.now().isoformat()
 
@@ -628,6 +976,11 @@ def multiple_collections_extension(func: callable) -> dict:
     Takes a list of collection names as input, alongside any other parameters which are passed to {funcname}.
     The function {funcname} will be run for each collection in turn, with the results returned in a dictionary mapping the collection names to the results.
     NOTE: If a limit is supplied for the maximum number of features to be returned or requests to be made, this will apply to each collection individually, not to the overall number of results.
+    To constrain the overall number of requests or features, use max_requests and/or max_features. These call-level budgets are shared fairly between the collections (and search areas, if applicable).
+    With validate_query, the query is validated against the queryables of every collection before any collection is requested.
+    With hierarchical_output, the 'budgetExhausted' flag is given separately for each collection.
+    With lazy_output, the flat output's 'features' is a FeatureChain view over the features of each collection (and page and search area, where applicable), rather than a list they are copied into at each level.
+    Use catalyst_ngd_wrappers.features.materialise_features to convert the response to a plain GeoJSON dictionary.
 
     ____________________________________________________
     Docs for {funcname}:
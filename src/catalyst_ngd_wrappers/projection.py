@@ -0,0 +1,165 @@
+'''
+Property projection for the OS NGD API - Features wrappers.
+Most callers only need the id, geometry and a few properties of each feature, while OS NGD features carry dozens of attributes.
+A Projection selects the properties (and optionally drops the geometry) of each feature as each page is decoded, before the page reaches the rest of the wrappers,
+so unrequested attributes are not tagged, compacted, merged or held in memory for the rest of the call.
+
+Two decoders are provided:
+    - The standard decoder parses each page with the json module, then projects its features immediately. This is the fastest, and is used by default.
+    - The incremental decoder parses each page with ijson (an optional dependency), skipping unrequested attributes and geometries as they are read, so they are never turned into Python objects.
+      This lowers the peak memory of decoding each page, but the event-by-event parsing costs more CPU than the json module's C decoder.
+      It is used when the INCREMENTAL_DECODE environment variable is set to 'true', and ijson is installed.
+'''
+
+import json
+import os
+import sys
+
+INCREMENTAL_DECODE: bool = os.environ.get('INCREMENTAL_DECODE', '').lower() == 'true'
+
+_CONTAINER_START_EVENTS: frozenset[str] = frozenset({'start_map', 'start_array'})
+_CONTAINER_END_EVENTS: frozenset[str] = frozenset({'end_map', 'end_array'})
+
+
+def _build_value(events, event: str, value):
+    '''
+    Builds a complete JSON value from ijson basic_parse events, starting from its first event.
+    Keys are interned, so that the keys repeated in every feature are only stored once, as with the json module.
+    '''
+    if event == 'start_map':
+        obj = {}
+        for event, value in events:
+            if event == 'end_map':
+                return obj
+            obj[sys.intern(value)] = _build_value(events, *next(events))
+    elif event == 'start_array':
+        array = []
+        for event, value in events:
+            if event == 'end_array':
+                return array
+            array.append(_build_value(events, event, value))
+    return value
+
+
+def _skip_value(events, event: str) -> None:
+    '''Consumes the ijson basic_parse events of a JSON value without building it, starting from its first event.'''
+    if event not in _CONTAINER_START_EVENTS:
+        return
+    depth = 1
+    for event, _ in events:
+        if event in _CONTAINER_START_EVENTS:
+            depth += 1
+        elif event in _CONTAINER_END_EVENTS:
+            depth -= 1
+            if depth == 0:
+                return
+
+
+class Projection:
+    '''
+    The properties and geometry to keep for each feature.
+    Parameters:
+        properties (list of str, optional) - The properties to keep. If None, all properties are kept.
+        include_geometry (bool, default True) - If False, the geometry of each feature is replaced by null.
+        incremental (bool, default INCREMENTAL_DECODE) - If True, and ijson is installed, pages are decoded with the incremental decoder.
+    '''
+
+    __slots__ = ('properties', 'include_geometry', 'incremental')
+
+    def __init__(
+            self,
+            properties: list[str] = None,
+            include_geometry: bool = True,
+            incremental: bool = INCREMENTAL_DECODE
+        ) -> None:
+        self.properties = frozenset(properties) if properties is not None else None
+        self.include_geometry = include_geometry
+        self.incremental = incremental
+
+    @classmethod
+    def from_options(cls, properties: list[str] = None, include_geometry: bool = True) -> 'Projection | None':
+        '''Returns the projection for the properties and include_geometry options of the wrappers, or None if every field is kept.'''
+        if properties is None and include_geometry:
+            return None
+        return cls(properties=properties, include_geometry=include_geometry)
+
+    def project(self, features: list[dict]) -> list[dict]:
+        '''Projects a list of decoded GeoJSON features, in place.'''
+        keep = self.properties
+        for feature in features:
+            if keep is not None:
+                feature['properties'] = {
+                    k: v for k, v in (feature.get('properties') or {}).items() if k in keep
+                }
+            if not self.include_geometry:
+                feature['geometry'] = None
+        return features
+
+    def decode(self, content: bytes) -> dict:
+        '''
+        Decodes a page from the OS NGD API, projecting its features.
+        Raises json.JSONDecodeError if the page is not valid JSON, with either decoder.
+        '''
+        if self.incremental:
+            try:
+                import ijson
+            except ImportError:
+                pass
+            else:
+                try:
+                    return self._decode_incremental(ijson.basic_parse(content, use_float=True))
+                except ijson.JSONError as e:
+                    raise json.JSONDecodeError(str(e), content.decode(errors='replace'), 0) from e
+        page = json.loads(content)
+        if isinstance(page, dict) and isinstance(page.get('features'), list):
+            self.project(page['features'])
+        return page
+
+    def _decode_incremental(self, events) -> dict:
+        '''Builds a page from ijson basic_parse events, only building the parts of each feature which are kept.'''
+        event, value = next(events)
+        if event != 'start_map':
+            return _build_value(events, event, value)
+        page = {}
+        for event, key in events:
+            if event == 'end_map':
+                break
+            event, value = next(events)
+            if key == 'features' and event == 'start_array':
+                page['features'] = self._decode_features(events)
+            else:
+                page[key] = _build_value(events, event, value)
+        return page
+
+    def _decode_features(self, events) -> list[dict]:
+        '''Builds the projected features of a page from ijson events, from after the start of the features array.'''
+        keep = self.properties
+        features = []
+        for event, value in events:
+            if event == 'end_array':
+                return features
+            if event != 'start_map':
+                features.append(_build_value(events, event, value))
+                continue
+            feature = {}
+            for event, key in events:
+                if event == 'end_map':
+                    break
+                event, value = next(events)
+                if key == 'properties' and keep is not None and event == 'start_map':
+                    properties = feature['properties'] = {}
+                    for event, name in events:
+                        if event == 'end_map':
+                            break
+                        event, value = next(events)
+                        if name in keep:
+                            properties[sys.intern(name)] = _build_value(events, event, value)
+                        else:
+                            _skip_value(events, event)
+                elif key == 'geometry' and not self.include_geometry:
+                    _skip_value(events, event)
+                    feature['geometry'] = None
+                else:
+                    feature[sys.intern(key)] = _build_value(events, event, value)
+            features.append(feature)
+        return features
@@ -0,0 +1,127 @@
+'''
+Compiled query plans for the OS NGD API - Features wrappers.
+A single call to a composed wrapper (eg. items_limit_geom_col) fans out into one request per collection, search area and page.
+Rather than preparing the query afresh for every request, a QueryPlan is created once per call by the outermost wrapper and passed down to the others.
+It is compiled from the first request: the query parameters are normalised and CRS shorthands expanded once, the filter string for each search area is built
+(and its geometry serialised to WKT) once, and the url and latest version of each collection are resolved once. Each request then only varies 'limit' and 'offset'.
+Every request made through a plan is recorded, and explain() lists them.
+A plan can also be run dry, to list the requests a call would make without making them.
+'''
+
+from .utils import prepare_parameters, wkt_to_spatial_filter
+
+ITEMS_URL_TEMPLATE: str = 'https://api.os.uk/features/ngd/ofa/v1/collections/{collection}/items/'
+PAGING_PARAMETERS: tuple[str, ...] = ('limit', 'offset')
+
+
+class QueryPlan:
+    '''
+    A query compiled once per wrapper call, and shared by every request the call makes.
+    Parameters:
+        dry_run (bool, default False) - If True, no requests are made to the features endpoint. Each request is recorded and answered with an empty page which has a next page,
+            so that explain() lists the greatest number of requests the call could make under its limits and budgets.
+    A plan is compiled from the first request made through it, so should only be used for a single call.
+    Only 'limit' and 'offset' may vary between the requests of a call; other query parameters, filters and headers are taken from the first request.
+    '''
+
+    def __init__(self, dry_run: bool = False) -> None:
+        self.dry_run = dry_run
+        self.compiled = False
+        self.base_params = None
+        self.headers = None
+        self._area_params = {}
+        self._collections = {}
+        self._urls = {}
+        self._requests = []
+        self.validated_collections = set()
+
+    def compile(self, params: dict = None, filter_params: dict = None, headers: dict = None) -> None:
+        '''
+        Normalises the query parameters (excluding 'limit' and 'offset'), attribute filters and headers of the call, if not already compiled.
+        The host header is removed, as this is added by the requests library and can cause issues.
+        '''
+        if self.compiled:
+            return
+        query_params = {k: v for k, v in (params or {}).items() if k not in PAGING_PARAMETERS}
+        self.base_params = prepare_parameters(query_params=query_params, filter_params=filter_params)
+        self.headers = {k: v for k, v in (headers or {}).items() if k != 'host'}
+        self.compiled = True
+
+    def resolve_collection(self, collection: str, use_latest_collection: bool = False) -> str:
+        '''Returns the collection to request, resolving its latest version at most once per call.'''
+        if not use_latest_collection:
+            return collection
+        resolved = self._collections.get(collection)
+        if resolved is None:
+            from .ngd_api_wrappers import get_specific_latest_collections
+            resolved = get_specific_latest_collections([collection]).get(collection, collection)
+            self._collections[collection] = resolved
+        return resolved
+
+    def url(self, collection: str) -> str:
+        '''Returns the items url of a collection.'''
+        url = self._urls.get(collection)
+        if url is None:
+            url = self._urls[collection] = ITEMS_URL_TEMPLATE.format(collection=collection)
+        return url
+
+    def area_params(self, wkt=None) -> dict:
+        '''
+        Returns the compiled query parameters for a search area, with the spatial filter combined with any other filters.
+        Search areas are identified by the wkt string or Shapely geometry object passed down by the wrappers, which is the same object for every page.
+        '''
+        cached = self._area_params.get(id(wkt))
+        if cached is not None:
+            return cached[1]
+        params = self.base_params
+        if wkt:
+            spatial_filter = wkt_to_spatial_filter(wkt)
+            current_filters = params.get('filter')
+            params = params | {'filter': f'({current_filters})and{spatial_filter}' if current_filters else spatial_filter}
+        # The search area is held alongside its parameters, so that its id is not reused while the plan exists
+        self._area_params[id(wkt)] = (wkt, params)
+        return params
+
+    def request_params(self, params: dict = None, wkt=None, limit: int = None) -> dict:
+        '''
+        Returns the query parameters of a single request: the compiled parameters for the search area, with the paging parameters of the request.
+        If limit is supplied, it replaces the 'limit' parameter.
+        '''
+        paging = {k: str(params[k]) for k in PAGING_PARAMETERS if params and k in params}
+        if limit is not None:
+            paging['limit'] = str(limit)
+        area_params = self.area_params(wkt)
+        return area_params | paging if paging else area_params
+
+    def record(self, collection: str, url: str, params: dict) -> None:
+        '''Records a request made through the plan.'''
+        self._requests.append((collection, url, params))
+
+    def explain(self) -> list[dict]:
+        '''
+        Lists the requests made through the plan, in order, each with its collection, url and query parameters.
+        For a dry run, these are the requests the call would make, up to its limits and budgets.
+        '''
+        return [
+            {'method': 'GET', 'collection': collection, 'url': url, 'params': params}
+            for collection, url, params in self._requests
+        ]
+
+    def __repr__(self) -> str:
+        return f'QueryPlan(dry_run={self.dry_run}, requests={len(self._requests)})'
+
+
+def explain(func: callable, **kwargs) -> list[dict]:
+    '''
+    Lists the requests a call to a wrapper function would make, without making any requests to the features endpoint.
+    Parameters:
+        func (callable) - The wrapper function, eg. catalyst_ngd_wrappers.items_limit_geom_col.
+        **kwargs - The parameters of the call, as they would be passed to func.
+    Returns the planned requests, as for QueryPlan.explain. As no features are returned, this is the greatest number of requests the call could make.
+    The latest collection versions are still requested from the collections endpoint where use_latest_collection is set.
+    '''
+    plan = QueryPlan(dry_run=True)
+    response = func(query_plan=plan, **kwargs)
+    if response.get('code', 200) >= 400:
+        raise ValueError(response.get('description', response))
+    return plan.explain()
@@ -0,0 +1,206 @@
+'''
+A local index of the queryables of each OS NGD collection, for validating queries before any request is made.
+Mistyped filter_params keys, non-queryable attributes in the CQL filter, and unsupported CRS values are otherwise only discovered when the OS NGD API returns a 400 error,
+which in a multi-collection or multi-search-area call may be after other collections have already been fetched.
+The queryables of each collection are fetched from the /queryables endpoint, and the supported CRS from the collections catalogue, and are cached (optionally on disk) for QUERYABLES_TTL_SECONDS.
+Validation fails open: if the queryables of a collection cannot be fetched, its queries are passed to the API unvalidated.
+'''
+
+import json
+import os
+import re
+import threading
+import time
+
+from .retries import request_with_retries
+from .utils import construct_error_response, prepare_parameters
+
+COLLECTIONS_URL: str = 'https://api.os.uk/features/ngd/ofa/v1/collections/'
+QUERYABLES_URL_TEMPLATE: str = 'https://api.os.uk/features/ngd/ofa/v1/collections/{collection}/queryables'
+QUERYABLES_TTL_SECONDS: float = float(os.environ.get('QUERYABLES_TTL_SECONDS', 24 * 60 * 60))
+QUERYABLES_CACHE_PATH: str | None = os.environ.get('QUERYABLES_CACHE_PATH')
+QUERYABLES_TIMEOUT: int = 20
+
+CRS_PARAMETERS: tuple[str, ...] = ('crs', 'bbox-crs', 'filter-crs')
+# Attributes which may always be used in a filter, regardless of the queryables of the collection
+ALWAYS_QUERYABLE: frozenset[str] = frozenset({'geometry'})
+CQL_KEYWORDS: frozenset[str] = frozenset({
+    'AND', 'OR', 'NOT', 'LIKE', 'ILIKE', 'IN', 'BETWEEN', 'IS', 'NULL', 'TRUE', 'FALSE',
+    'EMPTY', 'EMPTY_GEOMETRY',
+    # Temporal literals, eg. DATE '2020-01-01', which are written without brackets
+    'DATE', 'TIMESTAMP', 'INTERVAL'
+})
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_IDENTIFIER = re.compile(r'"([^"]+)"|(?<![\w.])([A-Za-z_]\w*)\b(?!\s*\()')
+
+
+def filter_attributes(cql_filter: str) -> set[str]:
+    '''
+    Returns the names of the attributes used in a CQL2 text filter.
+    String literals, keywords, numbers, and function or geometry names (identifiers followed by an opening bracket) are excluded.
+    '''
+    cql_filter = _STRING_LITERAL.sub("''", cql_filter)
+    attributes = set()
+    for quoted, name in _IDENTIFIER.findall(cql_filter):
+        if quoted:
+            attributes.add(quoted)
+        elif name.upper() not in CQL_KEYWORDS:
+            attributes.add(name)
+    return attributes
+
+
+class QueryablesIndex:
+    '''
+    A thread-safe cache of the queryable attributes and supported CRS of each collection.
+    Parameters:
+        ttl_seconds (float, default QUERYABLES_TTL_SECONDS) - How long fetched queryables are reused before they are refreshed.
+        path (str, optional) - A JSON file to persist the index to, so that it is shared between processes and survives restarts. Defaults to the QUERYABLES_CACHE_PATH environment variable.
+    The collections catalogue is refreshed on the same schedule as the queryables, or sooner if a collection is not in it (eg. a newly released collection version).
+    '''
+
+    def __init__(self, ttl_seconds: float = QUERYABLES_TTL_SECONDS, path: str = QUERYABLES_CACHE_PATH) -> None:
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.catalogue = None
+        self.queryables = {}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self.load()
+
+    def load(self) -> None:
+        '''Loads the index from its JSON file.'''
+        with open(self.path, encoding='utf-8') as file:
+            data = json.load(file)
+        self.catalogue = data.get('catalogue')
+        self.queryables = data.get('queryables', {})
+
+    def save(self) -> None:
+        '''Saves the index to its JSON file, atomically.'''
+        temporary_path = self.path + '.part'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump({'catalogue': self.catalogue, 'queryables': self.queryables}, file)
+        os.replace(temporary_path, self.path)
+
+    def _expired(self, entry: dict | None) -> bool:
+        '''Returns True if a cache entry is missing or older than the time-to-live.'''
+        return entry is None or time.time() - entry['fetched'] >= self.ttl_seconds
+
+    def refresh_catalogue(self, **kwargs) -> dict:
+        '''
+        Fetches the collections catalogue, recording the CRS supported by each collection.
+        The request is made without holding the lock of the index, which is only taken to store the result.
+        '''
+        kwargs.setdefault('timeout', QUERYABLES_TIMEOUT)
+        response = request_with_retries('GET', COLLECTIONS_URL, **kwargs)
+        response.raise_for_status()
+        catalogue = {
+            'fetched': time.time(),
+            'crs': {c['id']: c.get('crs', []) for c in response.json().get('collections', [])}
+        }
+        with self._lock:
+            self.catalogue = catalogue
+        return catalogue
+
+    def refresh_queryables(self, collection: str, **kwargs) -> dict:
+        '''
+        Fetches the queryable attributes of a (versioned) collection.
+        The request is made without holding the lock of the index, which is only taken to store the result.
+        '''
+        kwargs.setdefault('timeout', QUERYABLES_TIMEOUT)
+        response = request_with_retries('GET', QUERYABLES_URL_TEMPLATE.format(collection=collection), **kwargs)
+        response.raise_for_status()
+        entry = {
+            'fetched': time.time(),
+            'attributes': sorted(response.json().get('properties', {}))
+        }
+        with self._lock:
+            self.queryables[collection] = entry
+        return entry
+
+    def get(self, collection: str, **kwargs) -> tuple[frozenset[str], frozenset[str]] | None:
+        '''
+        Returns the queryable attributes and supported CRS of a (versioned) collection, fetching them if they are not cached or have expired.
+        Returns None if they cannot be fetched, or the collection is not in the catalogue.
+        The lock of the index is only held to read and write the cache, not during requests, so that a slow fetch for one collection does not block lookups of the others.
+        Concurrent calls for the same uncached collection may therefore each fetch it, with the last result kept.
+        '''
+        from requests import RequestException
+
+        with self._lock:
+            catalogue = self.catalogue
+            entry = self.queryables.get(collection)
+        changed = False
+        try:
+            if self._expired(catalogue) or collection not in catalogue['crs']:
+                catalogue = self.refresh_catalogue(**kwargs)
+                changed = True
+            if collection not in catalogue['crs']:
+                return None
+            if self._expired(entry):
+                entry = self.refresh_queryables(collection, **kwargs)
+                changed = True
+        except (ConnectionError, RequestException, ValueError):
+            return None
+        if changed and self.path:
+            try:
+                with self._lock:
+                    self.save()
+            except OSError:
+                pass
+        return frozenset(entry['attributes']), frozenset(catalogue['crs'][collection])
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_queryables_index() -> QueryablesIndex:
+    '''Returns the index shared by all calls in the process, creating it if necessary.'''
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = QueryablesIndex()
+    return _default_index
+
+
+def validate_queryables(
+    collection: list[str],
+    params: dict = None,
+    filter_params: dict = None,
+    index: QueryablesIndex = None
+) -> dict | None:
+    '''
+    Validates the attribute filters, CQL filter and CRS parameters of a query against the queryables of each (versioned) collection, before any request is made.
+    Parameters:
+        collection (list of str) - The versioned collections the query will be made against.
+        params (dict, optional) - The query parameters, as supplied to the wrappers. CRS shorthands are expanded before validation.
+        filter_params (dict, optional) - The attribute filters, as supplied to the wrappers.
+        index (QueryablesIndex, optional) - The index to validate against. Defaults to the index shared by the process.
+    Returns an error response (in the same format as the other errors of the wrappers) for the first invalid collection, or None if the query is valid.
+    '''
+    index = index or get_queryables_index()
+    params = {k: v for k, v in (params or {}).items() if k == 'filter' or k in CRS_PARAMETERS}
+    crs_params = {k: v for k, v in prepare_parameters(query_params=dict(params)).items() if k in CRS_PARAMETERS}
+    attributes = set(filter_params or {})
+    if params.get('filter'):
+        attributes |= filter_attributes(str(params['filter']))
+
+    for col in collection:
+        indexed = index.get(col)
+        if indexed is None:
+            continue
+        queryables, supported_crs = indexed
+        invalid = sorted(attributes - queryables - ALWAYS_QUERYABLE) if queryables else []
+        if invalid:
+            return construct_error_response(
+                message = f"Not queryable attribute(s) for collection {col}: {', '.join(invalid)}. Queryable attributes are: {', '.join(sorted(queryables))}.",
+                help_text = QUERYABLES_URL_TEMPLATE.format(collection=col)
+            )
+        for param, crs in crs_params.items():
+            if supported_crs and crs not in supported_crs:
+                return construct_error_response(
+                    message = f"Unsupported {param} for collection {col}: {crs}. Supported values are: {', '.join(sorted(supported_crs))}.",
+                    help_text = COLLECTIONS_URL + col
+                )
+    return None
@@ -0,0 +1,219 @@
+'''
+Retry policy for outgoing requests to the OS APIs.
+It includes:
+    - Capped exponential backoff with full jitter between attempts,
+    - Idempotency-aware retries; only GET requests and OAuth2 token requests are retried,
+    - A circuit breaker per host, which fails fast during API outages rather than waiting for repeated timeouts,
+    - Optional rate limiting of requests shared between threads.
+'''
+
+import random
+import threading
+import time
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+if TYPE_CHECKING:
+    import requests as r
+
+RETRIES: int = 3
+BACKOFF_BASE_SECONDS: float = 0.5
+BACKOFF_CAP_SECONDS: float = 8.0
+RETRY_STATUS_CODES: frozenset[int] = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS: frozenset[str] = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+CIRCUIT_FAILURE_THRESHOLD: int = 5
+CIRCUIT_RESET_SECONDS: float = 30.0
+
+
+class CircuitOpenError(ConnectionError):
+    '''
+    Raised when a request is refused because the circuit breaker for the host is open.
+    Subclasses the builtin ConnectionError rather than requests.ConnectionError, so that requests is not imported until the first request is made.
+    '''
+
+
+class CircuitBreaker:
+    '''
+    A simple circuit breaker, shared by all requests to a single host.
+    After a number of consecutive failures the circuit opens, and requests fail immediately until the reset period has passed.
+    A single trial request is then let through (half-open); if it succeeds the circuit closes, otherwise it opens again.
+    '''
+
+    def __init__(
+            self,
+            failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+            reset_seconds: float = CIRCUIT_RESET_SECONDS
+        ) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_progress = False
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        '''The current state of the circuit: 'closed', 'open' or 'half-open'.'''
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def allow_request(self) -> bool:
+        '''Returns True if a request may be made, registering it as the trial request if the circuit is half-open.'''
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_in_progress:
+                self.trial_in_progress = True
+                self._trial_thread = threading.get_ident()
+                return True
+            return False
+
+    def release_trial(self) -> None:
+        '''
+        Releases the trial request of the calling thread if neither a success nor a failure was recorded for it, eg. because it was interrupted.
+        Otherwise, the circuit would stay half-open with a trial in progress, refusing every later request.
+        '''
+        with self._lock:
+            if self.trial_in_progress and self._trial_thread == threading.get_ident():
+                self.trial_in_progress = False
+
+    def record_success(self) -> None:
+        '''Closes the circuit after a successful request.'''
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_progress = False
+
+    def record_failure(self) -> None:
+        '''Records a failed request, opening the circuit if the failure threshold is reached or the trial request failed.'''
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_progress or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_progress = False
+
+
+class RateLimiter:
+    '''
+    A thread-safe token bucket rate limiter.
+    Parameters:
+        rate (float) - The sustained number of requests permitted per second.
+        burst (int, optional) - The maximum number of requests which may be made at once. Defaults to the rate, rounded up.
+    '''
+
+    def __init__(self, rate: float, burst: int = None) -> None:
+        self.rate = rate
+        self.burst = burst or max(1, int(-(-rate // 1)))
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        '''Blocks until a request is permitted.'''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_seconds = (1 - self.tokens) / self.rate
+            time.sleep(wait_seconds)
+
+
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(url: str) -> CircuitBreaker:
+    '''Returns the circuit breaker for the host of the given url, creating it if necessary.'''
+    host = urlsplit(url).netloc
+    with _circuit_breakers_lock:
+        breaker = _circuit_breakers.get(host)
+        if breaker is None:
+            breaker = _circuit_breakers[host] = CircuitBreaker()
+    return breaker
+
+
+def backoff_delay(attempt: int, retry_after: str = None) -> float:
+    '''
+    Returns the number of seconds to wait before the next attempt, using capped exponential backoff with full jitter.
+    If the server supplied a numeric Retry-After header, this is respected, up to the cap.
+    '''
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), BACKOFF_CAP_SECONDS)
+    ceiling = min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)
+    return random.uniform(0, ceiling)
+
+
+def request_with_retries(
+    method: str,
+    url: str,
+    idempotent: bool = None,
+    retries: int = RETRIES,
+    session: 'r.Session' = None,
+    rate_limiter: RateLimiter = None,
+    **kwargs
+) -> 'r.Response':
+    '''
+    Makes an HTTP request, retrying transient failures (connection errors, timeouts, connections reset mid-body, and 429/5xx responses).
+    Parameters:
+        method (str) - The HTTP method, eg. 'GET'.
+        url (str) - The url to request.
+        idempotent (bool, optional) - Whether the request is safe to repeat. Defaults to True for GET, HEAD and OPTIONS requests only.
+            OAuth2 token requests are POST requests which are safe to repeat, so are called with idempotent=True.
+        retries (int, default RETRIES) - The maximum number of attempts.
+        session (requests.Session, optional) - A session to make the request with, allowing connections to be reused.
+        rate_limiter (RateLimiter, optional) - A rate limiter to acquire a permit from before each attempt.
+        **kwargs - other parameters to be passed to the request.Session.request method eg. params, headers, timeout.
+    Returns the final response. Where every attempt fails with a retryable status code, the last response is returned.
+    Raises CircuitOpenError if the circuit breaker for the host is open, or the last exception if every attempt raises.
+    Any requests exception is recorded as a failure by the circuit breaker, but only transient ones are retried.
+    '''
+    import requests as r
+
+    transient_exceptions = (r.ConnectionError, r.Timeout, r.exceptions.ChunkedEncodingError)
+
+    if idempotent is None:
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+    attempts = retries if idempotent else 1
+    breaker = get_circuit_breaker(url)
+    requester = session.request if session is not None else r.request
+
+    for attempt in range(attempts):
+        if not breaker.allow_request():
+            raise CircuitOpenError(f'Requests to {urlsplit(url).netloc} are temporarily suspended following repeated failures.')
+        final_attempt = attempt == attempts - 1
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            response = requester(method, url, **kwargs)
+        except r.RequestException as e:
+            breaker.record_failure()
+            if final_attempt or not isinstance(e, transient_exceptions):
+                raise
+            time.sleep(backoff_delay(attempt))
+            continue
+        else:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+        finally:
+            # A trial interrupted by any other exception is released, rather than leaving the circuit refusing every request
+            breaker.release_trial()
+
+        if response.status_code not in RETRY_STATUS_CODES or final_attempt:
+            return response
+        retry_after = response.headers.get('Retry-After')
+        response.close()
+        time.sleep(backoff_delay(attempt, retry_after))
+
+    return response
@@ -0,0 +1,209 @@
+'''
+Client-side spatial post-processing for the geom extension of the OS NGD API - Features wrappers.
+The OS NGD API only supports the INTERSECTS spatial predicate, so returns whole features which merely touch a search area.
+A SpatialPostProcessor refines each page of features against its search area with vectorised Shapely 2 operations, rather than per-feature Python loops:
+    - Exact spatial predicates (eg. within, contains), dropping features which fail the predicate before results are merged,
+    - Clipping of feature geometries to the search area,
+    - The area and length of the intersection of each feature with the search area.
+Large pages can optionally be processed in a separate process, by supplying a concurrent.futures executor.
+'''
+
+import json
+from concurrent.futures import Executor
+
+SPATIAL_PREDICATES: tuple[str, ...] = (
+    'intersects', 'within', 'contains', 'covers', 'covered_by', 'overlaps', 'crosses', 'touches'
+)
+# OS NGD pages hold at most 100 features, so this must be below a full page for the executor to be used
+POST_PROCESS_EXECUTOR_MIN_FEATURES: int = 50
+
+
+# The number of levels of arrays of positions in the GeoJSON coordinates of each geometry type which can be created from ragged arrays
+RAGGED_GEOMETRY_LEVELS: dict[str, int] = {
+    'Point': 0,
+    'LineString': 1,
+    'MultiPoint': 1,
+    'Polygon': 2,
+    'MultiLineString': 2,
+    'MultiPolygon': 3
+}
+
+
+def _ragged_geometries(geometry_type: str, geometries: list[dict]):
+    '''
+    Creates Shapely geometries of a single type from their GeoJSON coordinates in one vectorised operation, using shapely.from_ragged_array.
+    This avoids creating each geometry through Python, which otherwise dominates the cost of post-processing a page.
+    Raises ValueError if the coordinates cannot be combined into a single array, eg. where dimensions are mixed.
+    '''
+    import numpy as np
+    import shapely
+
+    levels = RAGGED_GEOMETRY_LEVELS[geometry_type]
+    coords = []
+    # One list of offsets for each level, from the innermost (into the coordinates) outwards
+    offsets = [[0] for _ in range(levels)]
+
+    def add(array: list, level: int) -> None:
+        if level == 1:
+            coords.extend(array)
+            offsets[0].append(len(coords))
+            return
+        for child in array:
+            add(child, level - 1)
+        offsets[level - 1].append(len(offsets[level - 2]) - 1)
+
+    for geometry in geometries:
+        if levels == 0:
+            coords.append(geometry['coordinates'])
+        else:
+            add(geometry['coordinates'], levels)
+
+    return shapely.from_ragged_array(
+        shapely.GeometryType[geometry_type.upper()],
+        np.asarray(coords, dtype=float),
+        tuple(np.asarray(o, dtype=np.int64) for o in offsets) or None
+    )
+
+
+def geometries_from_geojson(geometries: list[dict | None]):
+    '''
+    Creates an array of Shapely geometries from a list of GeoJSON geometries, with None for missing geometries.
+    Geometries are created in one vectorised operation for each geometry type, falling back to creating them individually where this is not possible (eg. Geometry Collections).
+    '''
+    import numpy as np
+    from shapely.geometry import shape
+
+    shapes = np.full(len(geometries), None, dtype=object)
+    indexes_by_type = {}
+    for i, geometry in enumerate(geometries):
+        if geometry:
+            indexes_by_type.setdefault(geometry.get('type'), []).append(i)
+
+    for geometry_type, indexes in indexes_by_type.items():
+        group = [geometries[i] for i in indexes]
+        try:
+            if geometry_type not in RAGGED_GEOMETRY_LEVELS:
+                raise ValueError(f'{geometry_type} geometries cannot be created from ragged arrays.')
+            created = _ragged_geometries(geometry_type, group)
+        except ValueError:
+            created = np.empty(len(group), dtype=object)
+            created[:] = [shape(g) for g in group]
+        shapes[indexes] = created
+    return shapes
+
+
+def process_geometries(
+    geometries: list[dict | None],
+    search_area_wkb: bytes,
+    predicate: str = None,
+    clip: bool = False,
+    measure: bool = False
+) -> dict:
+    '''
+    Runs the spatial post-processing of a page of GeoJSON geometries against a search area, as vectorised Shapely 2 operations.
+    Takes and returns plain Python objects, so that it can be run in another process.
+    Returns a dictionary with:
+        keep (list of bool) - Whether each feature satisfies the predicate. Features without a geometry never do.
+        geometries (list of dict, optional) - The clipped GeoJSON geometries, where clip is True.
+        areas, lengths (list of float, optional) - The area and length of the intersection of each feature with the search area, where measure is True.
+    '''
+    import numpy as np
+    import shapely
+
+    search_area = shapely.from_wkb(search_area_wkb)
+    shapely.prepare(search_area)
+    shapes = geometries_from_geojson(geometries)
+
+    has_geometry = ~shapely.is_missing(shapes)
+    keep = has_geometry.copy()
+    if predicate:
+        keep &= getattr(shapely, predicate)(shapes, search_area)
+
+    result = {'keep': keep.tolist()}
+    if clip or measure:
+        intersections = np.full(len(shapes), None, dtype=object)
+        intersections[keep] = shapely.intersection(shapes[keep], search_area)
+        if clip:
+            result['geometries'] = [
+                json.loads(g) if g is not None else None
+                for g in shapely.to_geojson(intersections).tolist()
+            ]
+        if measure:
+            result['areas'] = shapely.area(intersections).tolist()
+            result['lengths'] = shapely.length(intersections).tolist()
+    return result
+
+
+class BoundSpatialPostProcessor:
+    '''A spatial post-processor bound to a single search area, applied to each page of features found in it.'''
+
+    def __init__(self, processor: 'SpatialPostProcessor', search_area) -> None:
+        self.processor = processor
+        self.search_area_wkb = search_area.wkb
+
+    def process(self, features: list[dict]) -> list[dict]:
+        '''
+        Post-processes a page of GeoJSON features, returning those which satisfy the predicate.
+        Where clipping, geometries are replaced by their intersection with the search area.
+        Where measuring, 'intersectionArea' and 'intersectionLength' are added to the properties of each feature.
+        '''
+        if not features:
+            return features
+        processor = self.processor
+        args = (
+            [feature.get('geometry') for feature in features],
+            self.search_area_wkb,
+            processor.predicate,
+            processor.clip,
+            processor.measure
+        )
+        if processor.executor is not None and len(features) >= processor.executor_min_features:
+            result = processor.executor.submit(process_geometries, *args).result()
+        else:
+            result = process_geometries(*args)
+
+        processed = []
+        for i, feature in enumerate(features):
+            if not result['keep'][i]:
+                continue
+            if processor.clip:
+                feature['geometry'] = result['geometries'][i]
+            if processor.measure:
+                feature['properties']['intersectionArea'] = result['areas'][i]
+                feature['properties']['intersectionLength'] = result['lengths'][i]
+            processed.append(feature)
+        return processed
+
+
+class SpatialPostProcessor:
+    '''
+    Refines the features returned for each search area of the geom extension, with vectorised Shapely 2 operations.
+    Parameters:
+        predicate (str, optional) - An exact spatial predicate which features must satisfy against the search area, eg. 'within' (the feature lies within the search area) or 'contains' (the feature contains the search area).
+            Supported predicates are those in SPATIAL_PREDICATES. Features which fail it are dropped.
+        clip (bool, default False) - If True, feature geometries are clipped to the search area.
+        measure (bool, default False) - If True, the area and length of the intersection of each feature with the search area are added to its properties, as 'intersectionArea' and 'intersectionLength'.
+        executor (concurrent.futures.Executor, optional) - An executor (eg. a ProcessPoolExecutor) to process large pages in.
+        executor_min_features (int, default POST_PROCESS_EXECUTOR_MIN_FEATURES) - The smallest page which is passed to the executor.
+    Feature geometries and the search area must be in the same CRS, so 'crs' should match 'filter-crs'. Areas and lengths are in the units of that CRS.
+    '''
+
+    def __init__(
+            self,
+            predicate: str = None,
+            clip: bool = False,
+            measure: bool = False,
+            executor: Executor = None,
+            executor_min_features: int = POST_PROCESS_EXECUTOR_MIN_FEATURES
+        ) -> None:
+        if predicate is not None and predicate not in SPATIAL_PREDICATES:
+            raise ValueError(f"Unsupported spatial predicate '{predicate}'. Supported predicates are: {', '.join(SPATIAL_PREDICATES)}.")
+        self.predicate = predicate
+        self.clip = clip
+        self.measure = measure
+        self.executor = executor
+        self.executor_min_features = executor_min_features
+
+    def bind(self, search_area) -> BoundSpatialPostProcessor:
+        '''Returns the post-processor bound to a search area, given as a Shapely geometry object.'''
+        return BoundSpatialPostProcessor(self, search_area)
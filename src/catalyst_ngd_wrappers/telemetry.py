@@ -22,7 +22,7 @@ def prepare_telemetry_custom_dimensions(
     '''
 
     compiled_features = [feature['geometry']['coordinates']
-        for feature in json_response['features']]
+        for feature in json_response['features'] if feature['geometry']]
     flattened_coords = flatten_coords(compiled_features)
     xcoords, ycoords = [], []
     for pair in flattened_coords:
@@ -0,0 +1,223 @@
+'''
+Per-credential connection pools, access tokens and rate limits, for deployments which serve several OS Data Hub projects from one process.
+By default, the wrappers authenticate with a single CLIENT_ID and CLIENT_SECRET from the environment, and store the access token back in the ACCESS_TOKEN environment variable.
+When several projects' credentials share a process, this causes token thrashing and interference between tenants.
+A TenantRegistry instead holds a Tenant for each set of credentials, with its own pooled session, cached access token and rate limiter, without touching environment variables.
+Tenants are keyed by a hash of their credentials, and the least recently used tenants are evicted once the registry is full.
+Tenants which have only been used once are evicted first, so that a stream of unknown keys (eg. from untrusted callers) cannot evict the warm tenants of real projects.
+
+The process-wide registry used by deployments is configured with the TENANT_MAX_TENANTS, TENANT_REQUESTS_PER_SECOND and TENANT_POOL_SIZE environment variables,
+or replaced in code with set_tenant_registry.
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from hashlib import sha256
+
+from .retries import RateLimiter
+
+DEFAULT_MAX_TENANTS: int = 64
+DEFAULT_POOL_SIZE: int = 8
+TENANT_MAX_TENANTS: int = int(os.environ.get('TENANT_MAX_TENANTS', DEFAULT_MAX_TENANTS))
+TENANT_REQUESTS_PER_SECOND: float | None = float(os.environ['TENANT_REQUESTS_PER_SECOND']) if os.environ.get('TENANT_REQUESTS_PER_SECOND') else None
+TENANT_POOL_SIZE: int = int(os.environ.get('TENANT_POOL_SIZE', DEFAULT_POOL_SIZE))
+TOKEN_LIFETIME_SECONDS: float = 300.0
+TOKEN_EXPIRY_MARGIN_SECONDS: float = 30.0
+
+
+def credential_key(client_id: str = None, client_secret: str = None, api_key: str = None) -> str:
+    '''Returns a key identifying a set of credentials, without holding the credentials themselves.'''
+    return sha256('\x00'.join((client_id or '', client_secret or '', api_key or '')).encode()).hexdigest()
+
+
+class TokenManager:
+    '''
+    Caches the OAuth2 access token of a single set of client credentials, refreshing it shortly before it expires.
+    Refreshes are serialised, so that concurrent requests which find the token expired only request one new token between them.
+    '''
+
+    def __init__(self, client_id: str, client_secret: str, session=None) -> None:
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.session = session
+        self.token = None
+        self.expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def cached_token(self) -> str | None:
+        '''Returns the cached access token, or None if there is none or it is about to expire.'''
+        if self.token and time.monotonic() < self.expires_at:
+            return self.token
+        return None
+
+    def refresh_token(self, stale_token: str = None) -> str:
+        '''
+        Requests a new access token, unless another thread has already replaced stale_token with a valid one.
+        Raises PermissionError if the credentials are rejected, as for get_access_token.
+        '''
+        from .ngd_api_wrappers import get_access_token
+
+        with self._lock:
+            current = self.cached_token()
+            if current and current != stale_token:
+                return current
+            self.token = get_access_token(
+                client_id=self.client_id,
+                client_secret=self.client_secret,
+                session=self.session
+            )
+            self.expires_at = time.monotonic() + TOKEN_LIFETIME_SECONDS - TOKEN_EXPIRY_MARGIN_SECONDS
+            return self.token
+
+
+class Tenant:
+    '''
+    The connection pool, access token and rate limit of a single set of credentials.
+    Parameters:
+        client_id, client_secret (str, optional) - OAuth2 client credentials (the project API key and secret), for authentication with 5-minute access tokens.
+        api_key (str, optional) - A project API key, sent with each request in the 'key' header, for authentication without access tokens.
+        requests_per_second (float, optional) - If supplied, requests made for this tenant are rate limited to this rate.
+        pool_size (int, default 8) - The maximum number of connections to keep open for this tenant.
+    Pass the tenant to any of the wrapper functions with the 'tenant' parameter.
+    '''
+
+    def __init__(
+            self,
+            client_id: str = None,
+            client_secret: str = None,
+            api_key: str = None,
+            requests_per_second: float = None,
+            pool_size: int = DEFAULT_POOL_SIZE
+        ) -> None:
+        from .batch import create_session
+
+        if not (api_key or client_id):
+            raise ValueError('A tenant requires either an api_key, or a client_id and client_secret.')
+        self.key = credential_key(client_id, client_secret, api_key)
+        self.api_key = api_key
+        self.session = create_session(pool_size)
+        self.token_manager = TokenManager(client_id, client_secret, session=self.session) if client_id else None
+        self.rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+
+    def request_kwargs(self) -> dict:
+        '''Returns the keyword arguments which route a request through this tenant's session and rate limiter.'''
+        kwargs = {'session': self.session}
+        if self.rate_limiter is not None:
+            kwargs['rate_limiter'] = self.rate_limiter
+        return kwargs
+
+    def close(self) -> None:
+        '''Closes the tenant's pooled connections.'''
+        self.session.close()
+
+    def __repr__(self) -> str:
+        return f'Tenant(key={self.key[:12]}...)'
+
+
+class TenantRegistry:
+    '''
+    A thread-safe, least-recently-used registry of tenants, keyed by their credentials.
+    Parameters:
+        max_tenants (int, default 64) - The maximum number of tenants held. When exceeded, the least recently used tenant is evicted and its connections closed.
+            Tenants which have only been used once are evicted before tenants which have been reused.
+        requests_per_second (float, optional) - The default rate limit of each tenant.
+        pool_size (int, default 8) - The default number of pooled connections of each tenant.
+    '''
+
+    def __init__(
+            self,
+            max_tenants: int = DEFAULT_MAX_TENANTS,
+            requests_per_second: float = None,
+            pool_size: int = DEFAULT_POOL_SIZE
+        ) -> None:
+        self.max_tenants = max_tenants
+        self.requests_per_second = requests_per_second
+        self.pool_size = pool_size
+        self._tenants = OrderedDict()
+        self._uses = {}
+        self._lock = threading.Lock()
+
+    def get(
+            self,
+            client_id: str = None,
+            client_secret: str = None,
+            api_key: str = None,
+            requests_per_second: float = None
+        ) -> Tenant:
+        '''
+        Returns the tenant for a set of credentials, creating it if necessary.
+        requests_per_second overrides the default rate limit of the registry when the tenant is created.
+        '''
+        key = credential_key(client_id, client_secret, api_key)
+        with self._lock:
+            tenant = self._tenants.get(key)
+            if tenant is not None:
+                self._tenants.move_to_end(key)
+                self._uses[key] += 1
+                return tenant
+            tenant = self._tenants[key] = Tenant(
+                client_id=client_id,
+                client_secret=client_secret,
+                api_key=api_key,
+                requests_per_second=requests_per_second or self.requests_per_second,
+                pool_size=self.pool_size
+            )
+            self._uses[key] = 1
+            while len(self._tenants) > self.max_tenants:
+                self._evict(key)
+            return tenant
+
+    def _evict(self, new_key: str) -> None:
+        '''Evicts the least recently used tenant which has only been used once (other than the one just added), or otherwise the least recently used tenant.'''
+        victim = next(
+            (key for key in self._tenants if key != new_key and self._uses[key] == 1),
+            next(iter(self._tenants))
+        )
+        evicted = self._tenants.pop(victim)
+        del self._uses[victim]
+        evicted.close()
+
+    def close(self) -> None:
+        '''Closes and removes every tenant.'''
+        with self._lock:
+            for tenant in self._tenants.values():
+                tenant.close()
+            self._tenants.clear()
+            self._uses.clear()
+
+    def __len__(self) -> int:
+        return len(self._tenants)
+
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+def get_tenant_registry() -> TenantRegistry:
+    '''
+    Returns the registry shared by all calls in the process, creating it if necessary.
+    It is created with the TENANT_MAX_TENANTS, TENANT_REQUESTS_PER_SECOND and TENANT_POOL_SIZE environment variables, unless replaced with set_tenant_registry.
+    '''
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = TenantRegistry(
+                max_tenants=TENANT_MAX_TENANTS,
+                requests_per_second=TENANT_REQUESTS_PER_SECOND,
+                pool_size=TENANT_POOL_SIZE
+            )
+    return _default_registry
+
+
+def set_tenant_registry(registry: TenantRegistry | None) -> None:
+    '''
+    Replaces the registry shared by all calls in the process, eg. with one configured in code. The previous registry, if any, is closed.
+    If None, the registry is recreated from the environment variables on next use.
+    '''
+    global _default_registry
+    with _default_registry_lock:
+        previous, _default_registry = _default_registry, registry
+    if previous is not None and previous is not registry:
+        previous.close()
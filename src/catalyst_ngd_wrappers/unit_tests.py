@@ -1,8 +1,32 @@
+import asyncio
+import importlib.util
+import json
 import os
-from unittest import TestCase
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, mock, skipUnless
 import requests as r
 
-from .ngd_api_wrappers import items
+from . import ngd_api_wrappers
+from .ngd_api_wrappers import items, items_limit, items_limit_geom, items_limit_geom_col
+from .hedging import HedgingPolicy, hedged_request
+from .export import FeatureSink, SeenFeatureIds, export_features
+from . import bulk, delta_sync
+from .batch import batch_items, iter_batch_items
+from .deployment_schemas import LimitSchema
+from .deployment_utils import BaseSerialisedRequest, stream_features_response_async
+from . import queryables, retries, tenants
+from .tenants import TenantRegistry, TokenManager
+from .retries import CircuitBreaker, CircuitOpenError, backoff_delay, request_with_retries
+from .delta_sync import SyncStore, sync_area
+from .queryables import QueryablesIndex, filter_attributes
+from . import query_plan
+from .query_plan import QueryPlan, explain
+from .features import FeatureChain, materialise_features
+from .projection import Projection
+from .counts import items_count, items_exists
 
 WKT = """
 GEOMETRYCOLLECTION(
@@ -18,22 +42,962 @@ KEY = os.environ.get('CLIENT_ID')
 
 class TestNGDWrapper(TestCase):
 
-    items(
-        collection = 'bld-fts-building-4',
-        params = {
-            'filter': "constructionmaterial IN ('Mixed (Masonry And Metal)','Brick Or Block Or Stone')",
-            'crs': '3857',
-            'datetime': '2025-03-13T00:00:00Z/..'
-        },
-        filter_params = {
-            'description':'Gas Distribution Or Storage Facility',
-            'buildinguse':'Utility Or Environmental Protection',
-            'constructionmaterial':'Brick Or Block Or Stone'
-        },
-        hierarchical_output = True,
-        use_latest_collection = True,
-            headers = {
-            'erroneous-header': 'should-be-ignored',
-            'key': KEY
+    def test_items_request(self):
+        '''Runs a live request against the OS NGD API, which requires network access and the CLIENT_ID environment variable.'''
+        items(
+            collection = 'bld-fts-building-4',
+            params = {
+                'filter': "constructionmaterial IN ('Mixed (Masonry And Metal)','Brick Or Block Or Stone')",
+                'crs': '3857',
+                'datetime': '2025-03-13T00:00:00Z/..'
+            },
+            filter_params = {
+                'description':'Gas Distribution Or Storage Facility',
+                'buildinguse':'Utility Or Environmental Protection',
+                'constructionmaterial':'Brick Or Block Or Stone'
+            },
+            hierarchical_output = True,
+            use_latest_collection = True,
+                headers = {
+                'erroneous-header': 'should-be-ignored',
+                'key': KEY
+            },
+        )
+
+class FakeResponse:
+    '''A stand-in for a requests.Response, holding a JSON body.'''
+
+    def __init__(self, body: dict, status_code: int = 200) -> None:
+        self.status_code = status_code
+        self.content = json.dumps(body).encode()
+        self.headers = {}
+
+    def json(self) -> dict:
+        return json.loads(self.content)
+
+    def close(self) -> None:
+        pass
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise r.HTTPError(f'{self.status_code} Error', response=self)
+
+
+class FakeNGDAPI:
+    '''
+    A stand-in for the OS NGD API - Features items endpoint, patched over request_with_retries.
+    Each collection holds a list of features, which are paged with 'limit' and 'offset' regardless of the other query parameters, so every search area returns the same features.
+    If report_number_matched is True, each page reports the number of features of its collection as numberMatched.
+    '''
+
+    def __init__(self, features_by_collection: dict[str, list[dict]], report_number_matched: bool = False) -> None:
+        self.features_by_collection = features_by_collection
+        self.report_number_matched = report_number_matched
+        self.requests = []
+        self.number_fetched = 0
+
+    def __call__(self, method: str, url: str = None, params: dict = None, **kwargs) -> FakeResponse:
+        params = dict(params or {})
+        self.requests.append((url, params))
+        collection = url.rstrip('/').split('/')[-2]
+        features = self.features_by_collection[collection]
+        offset, limit = int(params.get('offset', 0)), int(params.get('limit', 100))
+        page = [json.loads(json.dumps(feature)) for feature in features[offset:offset + limit]]
+        self.number_fetched += len(page)
+        links = [{'rel': 'self', 'href': url}]
+        if offset + limit < len(features):
+            links.append({'rel': 'next', 'href': url})
+        body = {'type': 'FeatureCollection', 'numberReturned': len(page), 'features': page, 'links': links}
+        if self.report_number_matched:
+            body['numberMatched'] = len(features)
+        return FakeResponse(body)
+
+    def patch(self):
+        '''Returns a patch of request_with_retries with the fake API.'''
+        return mock.patch.object(ngd_api_wrappers, 'request_with_retries', self)
+
+
+def make_features(number_of_features: int, prefix: str = 'osid', **properties) -> list[dict]:
+    '''Creates point features with sequential OSIDs.'''
+    return [
+        {
+            'type': 'Feature',
+            'id': f'{prefix}-{i}',
+            'geometry': {'type': 'Point', 'coordinates': [i, 0]},
+            'properties': {'osid': f'{prefix}-{i}'} | properties
+        }
+        for i in range(number_of_features)
+    ]
+
+
+class TestCallLevelBudget(TestCase):
+
+    def test_max_features_charges_features_fetched(self):
+        '''Features dropped as duplicates between search areas are still charged to max_features.'''
+        api = FakeNGDAPI({
+            'bld-fts-building-4': make_features(250, 'building'),
+            'trn-ntwk-road-1': make_features(250, 'road')
+        })
+        with api.patch():
+            response = items_limit_geom_col(
+                collection=['bld-fts-building-4', 'trn-ntwk-road-1'],
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                max_features=150,
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertLessEqual(api.number_fetched, 150)
+        self.assertEqual(response['numberFetched'], api.number_fetched)
+        self.assertTrue(response['budgetExhausted'])
+
+
+class TestStreamingExport(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'features.ndjson')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_max_features_applies_to_features_written_to_sink(self):
+        '''Features written to a sink rather than returned are still charged to max_features.'''
+        api = FakeNGDAPI({
+            'bld-fts-building-4': make_features(250),
+            'trn-ntwk-road-1': make_features(250)
+        })
+        with api.patch():
+            summary = export_features(
+                self.path,
+                collection=['bld-fts-building-4', 'trn-ntwk-road-1'],
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                max_features=150,
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertLessEqual(api.number_fetched, 150)
+        self.assertEqual(summary['numberFetched'], api.number_fetched)
+
+    def test_features_deduplicated_per_collection(self):
+        '''Features of different collections which share an id are all exported, as in the flat output of the wrappers.'''
+        api = FakeNGDAPI({
+            'bld-fts-building-4': make_features(120),
+            'trn-ntwk-road-1': make_features(80)
+        })
+        kwargs = dict(
+            collection=['bld-fts-building-4', 'trn-ntwk-road-1'],
+            wkt='MULTIPOINT ((0 0), (1 1))',
+            authenticate=False,
+            log_request_details=False
+        )
+        with api.patch():
+            response = items_limit_geom_col(**kwargs)
+            summary = export_features(self.path, **kwargs)
+        self.assertEqual(response['numberReturned'], 200)
+        self.assertEqual(summary['numberReturned'], response['numberReturned'])
+        with open(self.path, encoding='utf-8') as file:
+            self.assertEqual(len(file.readlines()), 200)
+
+    def test_deduplication_spills_to_disk(self):
+        '''Feature ids beyond the memory limit are moved to disk, and features are still de-duplicated between search areas.'''
+        seen = SeenFeatureIds(memory_limit=10)
+        self.assertTrue(all(seen.add('bld-fts-building-4', f'osid-{i}') for i in range(30)))
+        self.assertIsNotNone(seen.connection)
+        self.assertEqual(seen.ids, set())
+        self.assertEqual(len(seen), 30)
+        self.assertFalse(seen.add('bld-fts-building-4', 'osid-3'))
+        self.assertTrue(seen.add('trn-ntwk-road-1', 'osid-3'))
+        seen.close()
+
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(150)})
+        sink = FeatureSink(self.path, deduplication_memory_limit=50)
+        with api.patch():
+            items_limit_geom_col(
+                collection=['bld-fts-building-4'],
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                feature_sink=sink,
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertIsNotNone(sink.search_area_ids.connection)
+        self.assertEqual(sink.close()['numberReturned'], 150)
+
+    def test_single_search_area_keeps_no_ids(self):
+        '''Feature ids are not kept where there is only one search area, as there is nothing to de-duplicate.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(150)})
+        sink = FeatureSink(self.path)
+        with api.patch():
+            items_limit_geom_col(
+                collection=['bld-fts-building-4'],
+                wkt='POINT (0 0)',
+                feature_sink=sink,
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertEqual(len(sink.search_area_ids), 0)
+        self.assertEqual(sink.close()['numberReturned'], 150)
+
+
+class TestDeltaSync(TestCase):
+
+    def setUp(self):
+        self.store = SyncStore(':memory:')
+        self.patch = mock.patch.object(delta_sync, 'get_latest_collection_versions', return_value={})
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        self.store.close()
+
+    def sync(self, api: FakeNGDAPI, **kwargs) -> dict:
+        with api.patch():
+            return sync_area(
+                collection=['bld-fts-building-4'],
+                wkt='POINT (0 0)',
+                database=self.store,
+                recent_update_days=0,
+                authenticate=False,
+                log_request_details=False,
+                **kwargs
+            )
+
+    def test_new_version_only_removes_features_of_synced_area(self):
+        '''When a collection moves to a new version, a sync only removes the old-version features no other search area still needs.'''
+        versions = {'bld-fts-building': 'bld-fts-building-3'}
+        api = FakeNGDAPI({
+            'bld-fts-building-3': make_features(5, 'old'),
+            'bld-fts-building-4': make_features(5, 'new')
+        })
+
+        def sync(wkt: str) -> dict:
+            summary = sync_area(['bld-fts-building'], wkt, database=self.store, recent_update_days=0, authenticate=False, log_request_details=False)
+            return summary['collections']['bld-fts-building']
+
+        with api.patch(), mock.patch.object(delta_sync, 'get_latest_collection_versions', return_value=versions):
+            sync('POINT (0 0)')
+            sync('POINT (1 1)')
+            versions['bld-fts-building'] = 'bld-fts-building-4'
+            first_area = sync('POINT (0 0)')
+            self.assertEqual(first_area['syncType'], 'full')
+            self.assertEqual(first_area['numberDeleted'], 0)
+            self.assertEqual(self.store.to_geojson('bld-fts-building-3')['numberReturned'], 5)
+
+            second_area = sync('POINT (1 1)')
+            self.assertEqual(second_area['numberDeleted'], 5)
+        self.assertEqual(self.store.to_geojson('bld-fts-building-3')['numberReturned'], 0)
+        self.assertEqual(self.store.to_geojson('bld-fts-building-4')['numberReturned'], 5)
+
+    def test_latest_version_decides_outcome(self):
+        '''A retired version of a feature does not delete its current version, whichever order they are returned in.'''
+        retired = {'versionavailablefromdate': '2023-01-01T00:00:00Z', 'versionavailabletodate': '2024-01-01T00:00:00Z'}
+        current = {'versionavailablefromdate': '2024-01-01T00:00:00Z', 'versionavailabletodate': None}
+        features = (
+            make_features(1, 'updated', **retired) + make_features(1, 'updated', **current)
+            + make_features(1, 'demolished', **current | {'versionavailabletodate': '2024-06-01T00:00:00Z'})
+        )
+        summary = self.sync(FakeNGDAPI({'bld-fts-building-4': features}))
+        stored = self.store.to_geojson()
+        self.assertEqual([feature['id'] for feature in stored['features']], ['updated-0'])
+        self.assertIsNone(stored['features'][0]['properties']['versionavailabletodate'])
+        self.assertEqual(summary['collections']['bld-fts-building-4']['numberUpserted'], 1)
+
+    def test_incremental_sync_filters_changed_versions(self):
+        '''Incremental syncs only request versions created or retired since the last sync, combined with any existing filter.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(10)})
+        params = {'filter': "description = 'Church'"}
+        self.sync(api, params=params)
+        summary = self.sync(api, params=params)
+        last_sync = summary['collections']['bld-fts-building-4']['since']
+        self.assertEqual(summary['collections']['bld-fts-building-4']['syncType'], 'incremental')
+        request_params = api.requests[-1][1]
+        self.assertEqual(request_params['datetime'], f'{last_sync}/..')
+        self.assertIn("description = 'Church'", request_params['filter'])
+        self.assertIn(f"versionavailablefromdate > TIMESTAMP('{last_sync}')", request_params['filter'])
+        self.assertIn(f"versionavailabletodate > TIMESTAMP('{last_sync}')", request_params['filter'])
+
+    def test_truncated_pull_does_not_advance_state(self):
+        '''A pull stopped by request_limit merges its features, but is not recorded as a completed sync.'''
+        summary = self.sync(FakeNGDAPI({'bld-fts-building-4': make_features(250)}), request_limit=1)
+        self.assertTrue(summary['collections']['bld-fts-building-4']['truncated'])
+        self.assertEqual(self.store.to_geojson()['numberReturned'], 100)
+        self.assertIsNone(self.store.get_state(
+            'bld-fts-building-4', delta_sync.search_area_key('POINT (0 0)'), delta_sync.filter_key()
+        ))
+
+        summary = self.sync(FakeNGDAPI({'bld-fts-building-4': make_features(250)}))
+        self.assertFalse(summary['collections']['bld-fts-building-4']['truncated'])
+        self.assertEqual(summary['collections']['bld-fts-building-4']['syncType'], 'full')
+        self.assertEqual(self.store.to_geojson()['numberReturned'], 250)
+
+
+class TestBulkExtract(TestCase):
+
+    def test_pages_requested_while_decoding(self):
+        '''A collection keeps requesting pages while its earlier pages are decoded, rather than waiting on each decode.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(250)})
+        all_requested = threading.Event()
+        requests_before_decode = []
+        original_decode_page = bulk.decode_page
+
+        def fetch(*args, **kwargs):
+            response = api(*args, **kwargs)
+            if len(api.requests) == 3:
+                all_requested.set()
+            return response
+
+        def decode_page(*args):
+            all_requested.wait(timeout=5)
+            requests_before_decode.append(len(api.requests))
+            return original_decode_page(*args)
+
+        with (
+            mock.patch.object(ngd_api_wrappers, 'request_with_retries', fetch),
+            mock.patch.object(bulk, 'decode_page', decode_page),
+            ThreadPoolExecutor(2) as executor
+        ):
+            response = bulk.bulk_extract(
+                collection='bld-fts-building-4',
+                executor=executor,
+                max_workers=2,
+                authenticate=False
+            )
+        self.assertEqual(response['numberReturned'], 250)
+        self.assertEqual(response['numberOfRequests'], 3)
+        self.assertEqual(requests_before_decode, [3, 3, 3])
+
+
+class TestBatchItems(TestCase):
+
+    @staticmethod
+    def echo(**kwargs) -> dict:
+        return {'collection': kwargs['collection']}
+
+    def test_latest_collection_failure_is_per_item(self):
+        '''A failed request for the latest collection versions only fails the queries which need them.'''
+        specs = [
+            {'collection': 'bld-fts-building', 'use_latest_collection': True},
+            {'collection': 'bld-fts-building-4'},
+            {'collection': ''},
+            {'collection': '', 'use_latest_collection': True}
+        ]
+        failure = r.exceptions.ConnectionError('Failed to connect')
+        with mock.patch.object(ngd_api_wrappers, 'get_latest_collection_versions', side_effect=failure):
+            results = batch_items(specs, func=self.echo)
+        self.assertEqual(results[0]['code'], 500)
+        self.assertEqual(results[1], {'collection': 'bld-fts-building-4'})
+        self.assertEqual(results[2], {'collection': ''})
+        self.assertEqual(results[3]['code'], 500)
+
+    def test_latest_collection_of_collection_lists(self):
+        '''Each collection of a spec with a list of collections is resolved to its latest version.'''
+        specs = [{'collection': ['bld-fts-building', 'trn-ntwk-road-1']}]
+        latest = {'bld-fts-building': 'bld-fts-building-4', 'trn-ntwk-road': 'trn-ntwk-road-2'}
+        with mock.patch.object(ngd_api_wrappers, 'get_latest_collection_versions', return_value=latest):
+            results = batch_items(specs, func=self.echo, use_latest_collection=True)
+        self.assertEqual(results, [{'collection': ['bld-fts-building-4', 'trn-ntwk-road-1']}])
+
+    def test_closing_early_cancels_queued_queries(self):
+        '''Closing the iterator early does not wait for the queries which have not started.'''
+        started = []
+
+        def query(**kwargs) -> dict:
+            started.append(kwargs['collection'])
+            time.sleep(0.05)
+            return {}
+
+        results = iter_batch_items([{'collection': f'col-{i}'} for i in range(10)], func=query, max_workers=1)
+        next(results)
+        results.close()
+        self.assertLess(len(started), 10)
+
+
+class TestStreamingFeaturesResponse(TestCase):
+
+    def test_async_response_does_not_block_event_loop(self):
+        '''Awaiting the first page of an async streaming response leaves the event loop free to run other tasks.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(150)})
+        gate = threading.Event()
+        gate_opened = []
+
+        def fetch(*args, **kwargs):
+            gate_opened.append(gate.wait(timeout=5))
+            return api(*args, **kwargs)
+
+        async def open_gate() -> None:
+            gate.set()
+
+        async def stream() -> tuple[int, bytes]:
+            data = BaseSerialisedRequest(
+                'GET',
+                '/features/bld-fts-building-4',
+                {'limit': '150', 'authenticate': 'false', 'log-request-details': 'false'},
+                {'collection': 'bld-fts-building-4'},
+                {}
+            )
+            task = asyncio.create_task(open_gate())
+            response = await stream_features_response_async(data, LimitSchema)
+            await task
+            return response.status_code, b''.join([chunk async for chunk in response])
+
+        with mock.patch.object(ngd_api_wrappers, 'request_with_retries', fetch):
+            status_code, body = asyncio.run(stream())
+        self.assertEqual(status_code, 200)
+        self.assertTrue(all(gate_opened))
+        self.assertEqual(json.loads(body)['numberReturned'], 150)
+
+
+class FakeSession:
+    '''A stand-in for a requests.Session, returning (or raising) a sequence of outcomes in turn.'''
+
+    def __init__(self, *outcomes) -> None:
+        self.outcomes = list(outcomes)
+        self.number_of_requests = 0
+
+    def request(self, method: str, url: str, **kwargs) -> FakeResponse:
+        self.number_of_requests += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+class TestRetries(TestCase):
+
+    def setUp(self):
+        # Each test uses its own host, so has its own circuit breaker
+        self.url = f'https://{self.id().rsplit(".", 1)[-1]}.example/'
+        self.sleep = mock.patch.object(retries.time, 'sleep')
+        self.sleep.start()
+
+    def tearDown(self):
+        self.sleep.stop()
+
+    def test_backoff_delay(self):
+        '''Delays are jittered below a capped exponential ceiling, and a numeric Retry-After is respected up to the cap.'''
+        for attempt in range(10):
+            delay = backoff_delay(attempt)
+            self.assertGreaterEqual(delay, 0)
+            self.assertLessEqual(delay, min(retries.BACKOFF_CAP_SECONDS, retries.BACKOFF_BASE_SECONDS * 2 ** attempt))
+        self.assertEqual(backoff_delay(0, retry_after='3'), 3)
+        self.assertEqual(backoff_delay(0, retry_after='600'), retries.BACKOFF_CAP_SECONDS)
+
+    def test_transient_failures_retried(self):
+        '''Connection errors, connections reset mid-body and 5xx responses are retried; the final response is returned.'''
+        session = FakeSession(
+            r.ConnectionError(),
+            r.exceptions.ChunkedEncodingError(),
+            FakeResponse({}, status_code=200)
+        )
+        response = request_with_retries('GET', self.url, session=session)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(session.number_of_requests, 3)
+
+        session = FakeSession(r.exceptions.InvalidURL(), FakeResponse({}))
+        with self.assertRaises(r.exceptions.InvalidURL):
+            request_with_retries('GET', self.url, session=session)
+        self.assertEqual(session.number_of_requests, 1)
+
+    def test_circuit_breaker_states(self):
+        '''The circuit opens after repeated failures, lets a single trial through once reset, and closes or reopens on its outcome.'''
+        breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow_request())
+
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.state, 'half-open')
+        self.assertTrue(breaker.allow_request())
+        self.assertFalse(breaker.allow_request())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+
+        breaker.opened_at -= 60
+        self.assertTrue(breaker.allow_request())
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow_request())
+
+    def test_half_open_recovery_after_non_transient_failure(self):
+        '''A trial request which raises any requests exception reopens the circuit, rather than leaving it refusing every request.'''
+        breaker = retries.get_circuit_breaker(self.url)
+        breaker.opened_at = time.monotonic() - breaker.reset_seconds
+        with self.assertRaises(r.exceptions.ChunkedEncodingError):
+            request_with_retries('GET', self.url, retries=1, session=FakeSession(r.exceptions.ChunkedEncodingError()))
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            request_with_retries('GET', self.url, session=FakeSession())
+
+        breaker.opened_at -= breaker.reset_seconds
+        with self.assertRaises(KeyboardInterrupt):
+            request_with_retries('GET', self.url, session=FakeSession(KeyboardInterrupt()))
+        self.assertFalse(breaker.trial_in_progress)
+        response = request_with_retries('GET', self.url, session=FakeSession(FakeResponse({})))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_request_exception_returns_error_response(self):
+        '''A request which fails with any requests exception returns an error response, rather than raising.'''
+        def fail(*args, **kwargs):
+            raise r.exceptions.ChunkedEncodingError('Connection broken')
+
+        with mock.patch.object(ngd_api_wrappers, 'request_with_retries', fail):
+            response = ngd_api_wrappers.base_request(url=self.url)
+        self.assertEqual(response['code'], 502)
+        self.assertEqual(response['errorSource'], 'OS NGD API')
+
+
+class SpyExecutor(ThreadPoolExecutor):
+    '''A thread pool which counts the tasks submitted to it.'''
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.number_submitted = 0
+
+    def submit(self, *args, **kwargs):
+        self.number_submitted += 1
+        return super().submit(*args, **kwargs)
+
+
+class TestSpatialPostProcessing(TestCase):
+
+    def test_executor_matches_in_process(self):
+        '''Full pages are post-processed on the executor, with the same result as in-process post-processing.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(250)})
+        kwargs = dict(
+            collection='bld-fts-building-4',
+            wkt='POLYGON ((-1 -1, 119.5 -1, 119.5 1, -1 1, -1 -1))',
+            spatial_predicate='within',
+            measure=True,
+            authenticate=False,
+            log_request_details=False
+        )
+        with api.patch(), SpyExecutor(2) as executor:
+            in_process = items_limit_geom(**kwargs)
+            on_executor = items_limit_geom(post_process_executor=executor, **kwargs)
+        self.assertEqual(executor.number_submitted, 3)
+        self.assertEqual(in_process['numberReturned'], 120)
+        self.assertEqual(on_executor['features'], in_process['features'])
+
+
+class TestBulkExtractCollections(TestCase):
+
+    def test_latest_collection_tags_features(self):
+        '''With use_latest_collection, features are tagged and counted by the latest version of the collection, as with the wrappers.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(150)})
+        latest = {'bld-fts-building': 'bld-fts-building-4'}
+        with api.patch(), mock.patch.object(ngd_api_wrappers, 'get_latest_collection_versions', return_value=latest), ThreadPoolExecutor(2) as executor:
+            response = bulk.bulk_extract(
+                collection='bld-fts-building',
+                use_latest_collection=True,
+                executor=executor,
+                authenticate=False
+            )
+        self.assertEqual(response['numberReturnedByCollection'], {'bld-fts-building-4': 150})
+        self.assertEqual({feature['collection'] for feature in response['features']}, {'bld-fts-building-4'})
+
+
+class TestHedging(TestCase):
+
+    def test_threshold(self):
+        '''The initial threshold is used until enough latencies are observed, then the configured quantile of them.'''
+        policy = HedgingPolicy(quantile=0.5, min_samples=4, initial_threshold=2.0)
+        for seconds in (0.4, 0.1, 0.3):
+            policy.record_latency(seconds)
+        self.assertEqual(policy.threshold(), 2.0)
+        policy.record_latency(0.2)
+        self.assertEqual(policy.threshold(), 0.3)
+
+    def test_cap_on_extra_requests(self):
+        '''Hedged requests are capped as a fraction of the requests made.'''
+        policy = HedgingPolicy(max_extra_fraction=0.1)
+        for _ in range(9):
+            policy.register_request()
+        self.assertFalse(policy.acquire_hedge())
+        policy.register_request()
+        self.assertTrue(policy.acquire_hedge())
+        self.assertFalse(policy.acquire_hedge())
+        self.assertEqual(policy.number_of_hedged_requests, 1)
+
+    def test_slow_request_hedged(self):
+        '''A request slower than the threshold is duplicated, where the cap allows.'''
+        def send() -> FakeResponse:
+            time.sleep(0.05)
+            return FakeResponse({})
+
+        response, hedged = hedged_request(HedgingPolicy(max_extra_fraction=1.0, initial_threshold=0), send)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(hedged)
+        _, hedged = hedged_request(HedgingPolicy(max_extra_fraction=0.0, initial_threshold=0), send)
+        self.assertFalse(hedged)
+
+    def test_hedged_requests_charged_to_max_requests(self):
+        '''Hedged requests count towards max_requests, so hedging never takes a call over its request budget.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(1000)})
+
+        def fetch(*args, **kwargs):
+            time.sleep(0.05)
+            return api(*args, **kwargs)
+
+        with mock.patch.object(ngd_api_wrappers, 'request_with_retries', fetch):
+            response = items_limit(
+                collection='bld-fts-building-4',
+                max_requests=5,
+                hedge_requests=HedgingPolicy(max_extra_fraction=1.0, initial_threshold=0),
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertGreater(response['numberOfHedgedRequests'], 0)
+        self.assertEqual(response['numberOfRequests'] + response['numberOfHedgedRequests'], 5)
+        self.assertEqual(len(api.requests), 5)
+        self.assertTrue(response['budgetExhausted'])
+
+
+class TestTenants(TestCase):
+
+    def test_lru_eviction(self):
+        '''The least recently used tenant is evicted and closed, with tenants used only once evicted before reused tenants.'''
+        registry = TenantRegistry(max_tenants=2)
+        warm = registry.get(api_key='warm')
+        self.assertIs(registry.get(api_key='warm'), warm)
+        with mock.patch.object(tenants.Tenant, 'close') as close:
+            for i in range(5):
+                registry.get(api_key=f'unknown-{i}')
+            self.assertEqual(close.call_count, 4)
+        self.assertEqual(len(registry), 2)
+        self.assertIs(registry.get(api_key='warm'), warm)
+
+        registry = TenantRegistry(max_tenants=2)
+        first = registry.get(api_key='first')
+        registry.get(api_key='first')
+        registry.get(api_key='second')
+        registry.get(api_key='second')
+        registry.get(api_key='third')
+        self.assertIsNot(registry.get(api_key='first'), first)
+        registry.close()
+
+    def test_registry_configured(self):
+        '''The process-wide registry is created from the environment variables, or replaced with set_tenant_registry.'''
+        self.addCleanup(tenants.set_tenant_registry, None)
+        tenants.set_tenant_registry(None)
+        with mock.patch.object(tenants, 'TENANT_REQUESTS_PER_SECOND', 5.0), mock.patch.object(tenants, 'TENANT_MAX_TENANTS', 3):
+            registry = tenants.get_tenant_registry()
+        self.assertEqual(registry.max_tenants, 3)
+        self.assertEqual(registry.get(api_key='key').rate_limiter.rate, 5.0)
+
+        replacement = TenantRegistry(requests_per_second=2.0)
+        tenants.set_tenant_registry(replacement)
+        self.assertIs(tenants.get_tenant_registry(), replacement)
+        self.assertEqual(len(registry), 0)
+
+    def test_token_refresh(self):
+        '''Tokens are cached until shortly before expiry, and concurrent refreshes of the same stale token only request one new token.'''
+        new_tokens = iter(['token-1', 'token-2'])
+        manager = TokenManager('client-id', 'client-secret')
+        with mock.patch.object(ngd_api_wrappers, 'get_access_token', side_effect=lambda **kwargs: next(new_tokens)) as get_access_token:
+            self.assertIsNone(manager.cached_token())
+            self.assertEqual(manager.refresh_token(), 'token-1')
+            self.assertEqual(manager.cached_token(), 'token-1')
+            # Another thread has already refreshed the stale token, so it is reused
+            self.assertEqual(manager.refresh_token(stale_token='token-0'), 'token-1')
+            self.assertEqual(get_access_token.call_count, 1)
+
+            self.assertEqual(manager.refresh_token(stale_token='token-1'), 'token-2')
+            manager.expires_at = time.monotonic() - 1
+            self.assertIsNone(manager.cached_token())
+        self.assertEqual(get_access_token.call_count, 2)
+
+
+class TestQueryables(TestCase):
+
+    def test_filter_attributes(self):
+        '''Attributes are found in CQL filters, excluding literals, keywords, and function and geometry names.'''
+        self.assertEqual(filter_attributes("description = 'Road' AND width > 5"), {'description', 'width'})
+        self.assertEqual(filter_attributes("name LIKE 'AND x = ''y'''"), {'name'})
+        self.assertEqual(filter_attributes('"first name" IS NOT NULL'), {'first name'})
+        self.assertEqual(
+            filter_attributes("S_INTERSECTS(geometry, POINT(558288 104518)) AND status IN ('a', 'b')"),
+            {'geometry', 'status'}
+        )
+        self.assertEqual(filter_attributes("updatedate > DATE '2020-01-01'"), {'updatedate'})
+        self.assertEqual(
+            filter_attributes("versionavailablefromdate >= timestamp '2020-01-01T00:00:00Z' OR T_DURING(period, INTERVAL('2020-01-01', '..'))"),
+            {'versionavailablefromdate', 'period'}
+        )
+        self.assertEqual(filter_attributes('width BETWEEN 1.5 AND 3 OR flag = TRUE'), {'width', 'flag'})
+
+    def test_fetch_outside_lock(self):
+        '''Queryables are fetched without holding the lock of the index, and cached until they expire.'''
+        index = QueryablesIndex(ttl_seconds=60, path=None)
+        urls = []
+
+        def fake_request(method, url, **kwargs):
+            self.assertFalse(index._lock.locked())
+            urls.append(url)
+            if url == queryables.COLLECTIONS_URL:
+                return FakeResponse({'collections': [{'id': 'bld-fts-building-4', 'crs': ['crs84']}]})
+            return FakeResponse({'properties': {'description': {}, 'height': {}}})
+
+        with mock.patch.object(queryables, 'request_with_retries', side_effect=fake_request):
+            expected = (frozenset({'description', 'height'}), frozenset({'crs84'}))
+            self.assertEqual(index.get('bld-fts-building-4'), expected)
+            self.assertEqual(index.get('bld-fts-building-4'), expected)
+            self.assertEqual(len(urls), 2)
+            self.assertIsNone(index.get('not-a-collection'))
+            self.assertEqual(len(urls), 3)
+
+
+class TestQueryPlan(TestCase):
+
+    def test_compiled_once(self):
+        '''The query is compiled from the first request only, with the paging parameters and host header excluded.'''
+        plan = QueryPlan()
+        plan.compile(
+            params={'filter': "description='Road'", 'limit': 10, 'offset': 20, 'crs': 27700},
+            filter_params={'width': 5},
+            headers={'host': 'localhost', 'key': 'value'}
+        )
+        plan.compile(params={'filter': "description='Rail'"}, headers={})
+        self.assertEqual(plan.base_params['filter'], "(description='Road')and(width=5)")
+        self.assertEqual(plan.base_params['crs'], 'http://www.opengis.net/def/crs/EPSG/0/27700')
+        self.assertNotIn('limit', plan.base_params)
+        self.assertNotIn('offset', plan.base_params)
+        self.assertEqual(plan.headers, {'key': 'value'})
+
+        self.assertEqual(plan.request_params({'offset': 100}, limit=50), plan.base_params | {'offset': '100', 'limit': '50'})
+        self.assertIs(plan.request_params(), plan.base_params)
+
+    def test_shared_by_requests(self):
+        '''Each search area filter and latest collection version is prepared once per call, and every request is recorded.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(250)})
+        plan = QueryPlan()
+        with api.patch(), \
+            mock.patch.object(query_plan, 'wkt_to_spatial_filter', wraps=query_plan.wkt_to_spatial_filter) as to_filter, \
+            mock.patch.object(ngd_api_wrappers, 'get_specific_latest_collections', return_value={'bld-fts-building': 'bld-fts-building-4'}) as latest:
+            response = items_limit_geom_col(
+                collection=['bld-fts-building'],
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                use_latest_collection=True,
+                limit=250,
+                query_plan=plan,
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertEqual(response['numberOfRequests'], 6)
+        self.assertEqual(latest.call_count, 1)
+        self.assertEqual(to_filter.call_count, 2)
+        planned = plan.explain()
+        self.assertEqual(len(planned), 6)
+        self.assertEqual([request['params'] for request in planned], [params for _, params in api.requests])
+        self.assertEqual({request['collection'] for request in planned}, {'bld-fts-building-4'})
+
+    def test_dry_run(self):
+        '''A dry run lists the greatest number of requests a call could make under its limits, without making any.'''
+        api = FakeNGDAPI({})
+        with api.patch():
+            planned = explain(
+                items_limit_geom_col,
+                collection=['bld-fts-building-4', 'trn-ntwk-road-1'],
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                limit=250,
+                filter_params={'height': 2},
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertEqual(api.requests, [])
+        self.assertEqual(len(planned), 12)
+        self.assertEqual([request['params']['offset'] for request in planned[:3]], ['0', '100', '200'])
+        self.assertEqual(planned[2]['params']['limit'], '50')
+        self.assertEqual(planned[0]['url'], 'https://api.os.uk/features/ngd/ofa/v1/collections/bld-fts-building-4/items/')
+        self.assertEqual(planned[0]['params']['filter'], '((height=2))and(INTERSECTS(geometry,POINT (0 0)))')
+        self.assertEqual(planned[3]['params']['filter'], '((height=2))and(INTERSECTS(geometry,POINT (1 1)))')
+
+        with self.assertRaises(ValueError):
+            explain(items_limit, collection='bld-fts-building-4', params={'limit': 10}, authenticate=False)
+
+
+class TestFeatureChain(TestCase):
+
+    def test_sequence(self):
+        '''Indexing, slicing, iteration and len match those of the equivalent list.'''
+        sources = [[0, 1, 2], [], [3], [4, 5, 6, 7]]
+        features = FeatureChain(sources)
+        expected = [0, 1, 2, 3, 4, 5, 6, 7]
+        self.assertEqual(len(features), 8)
+        self.assertEqual(list(features), expected)
+        self.assertEqual(features.to_list(), expected)
+        for i in range(-8, 8):
+            self.assertEqual(features[i], expected[i])
+        for index in (8, -9):
+            with self.assertRaises(IndexError):
+                features[index]
+        for index in (slice(2, 5), slice(None, None, 3), slice(-3, None), slice(6, 2), slice(None, None, -2), slice(1, 100)):
+            self.assertEqual(features[index], expected[index])
+        self.assertEqual(len(FeatureChain()), 0)
+        self.assertEqual(FeatureChain()[:], [])
+
+    def test_nested_chains_flattened(self):
+        '''Chains added to a chain are flattened into references to their source lists, which are not copied.'''
+        page = [{'id': 'a'}, {'id': 'b'}]
+        inner = FeatureChain([page, [{'id': 'c'}]])
+        outer = FeatureChain()
+        outer += inner
+        outer += [{'id': 'd'}]
+        self.assertEqual([feature['id'] for feature in outer], ['a', 'b', 'c', 'd'])
+        self.assertEqual(len(outer._sources), 3)
+        self.assertIs(outer._sources[0], page)
+        self.assertIs(outer[0], page[0])
+
+    def test_lazy_output(self):
+        '''With lazy_output, the flat output of a composite call is a FeatureChain holding the same features as the list output.'''
+        api = FakeNGDAPI({
+            'bld-fts-building-4': make_features(150, 'building'),
+            'trn-ntwk-road-1': make_features(50, 'road')
+        })
+        kwargs = dict(
+            collection=['bld-fts-building-4', 'trn-ntwk-road-1'],
+            wkt='MULTIPOINT ((0 0), (1 1))',
+            limit=500,
+            authenticate=False,
+            log_request_details=False
+        )
+        with api.patch():
+            eager = items_limit_geom_col(**kwargs)
+            lazy = items_limit_geom_col(lazy_output=True, **kwargs)
+        self.assertIsInstance(lazy['features'], FeatureChain)
+        self.assertEqual(lazy['numberReturned'], eager['numberReturned'])
+        self.assertEqual([feature['id'] for feature in lazy['features']], [feature['id'] for feature in eager['features']])
+        materialise_features(lazy)
+        self.assertIsInstance(lazy['features'], list)
+        self.assertEqual(lazy['features'], eager['features'])
+
+
+PAGE = {
+    'type': 'FeatureCollection',
+    'numberReturned': 2,
+    'features': [
+        {
+            'type': 'Feature',
+            'id': 'osid-0',
+            'geometry': {'type': 'Polygon', 'coordinates': [[[0.5, 0], [1, 1.25], [0, 1], [0.5, 0]]]},
+            'properties': {
+                'osid': 'osid-0', 'description': 'Building', 'height': 12.5, 'storeys': 3,
+                'name': 'Tyô – "quoted"', 'uprns': [{'uprn': 1, 'flags': [True, None]}], 'empty': {}
+            }
         },
-    )
\ No newline at end of file
+        {
+            'type': 'Feature',
+            'id': 'osid-1',
+            'geometry': None,
+            'properties': {'osid': 'osid-1', 'description': None, 'height': -1e-3, 'storeys': 0}
+        }
+    ],
+    'links': [{'rel': 'self', 'href': 'https://api.os.uk/'}, {'rel': 'next', 'href': 'https://api.os.uk/?offset=100'}],
+    'timeStamp': '2024-01-01T00:00:00Z'
+}
+
+
+class TestProjection(TestCase):
+
+    @skipUnless(importlib.util.find_spec('ijson'), 'ijson is not installed')
+    def test_incremental_decoder_matches_standard_decoder(self):
+        '''The incremental decoder returns the same page as the standard decoder, for every projection.'''
+        content = json.dumps(PAGE).encode()
+        for properties in (None, [], ['osid'], ['description', 'uprns', 'missing']):
+            for include_geometry in (True, False):
+                standard = Projection(properties, include_geometry, incremental=False).decode(content)
+                incremental = Projection(properties, include_geometry, incremental=True).decode(content)
+                self.assertEqual(incremental, standard)
+        self.assertEqual(Projection(incremental=True).decode(content), PAGE)
+        self.assertEqual(Projection(incremental=True).decode(b'[1, {"a": 2}]'), [1, {'a': 2}])
+
+    @skipUnless(importlib.util.find_spec('ijson'), 'ijson is not installed')
+    def test_invalid_page(self):
+        '''Both decoders raise json.JSONDecodeError for invalid JSON.'''
+        for incremental in (False, True):
+            with self.assertRaises(json.JSONDecodeError):
+                Projection(['osid'], incremental=incremental).decode(b'{"features": [{"id": ')
+
+    def test_wrapper_projection(self):
+        '''Only the requested properties and geometry are kept in the output of the wrappers, alongside the properties they add.'''
+        api = FakeNGDAPI({'bld-fts-building-4': make_features(3, description='Building', height=10)})
+        with api.patch():
+            response = items_limit_geom(
+                collection='bld-fts-building-4',
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                properties=['height'],
+                include_geometry=False,
+                authenticate=False,
+                log_request_details=False
+            )
+        self.assertEqual(response['numberReturned'], 3)
+        for feature in response['features']:
+            self.assertIsNone(feature['geometry'])
+            self.assertEqual(feature['properties'], {'height': 10, 'collection': 'bld-fts-building-4', 'searchAreaNumber': 0})
+
+
+class TestCounts(TestCase):
+
+    def setUp(self):
+        self.features = {
+            'bld-fts-building-4': make_features(5, 'building'),
+            'trn-ntwk-road-1': make_features(1, 'road'),
+            'wtr-fts-water-3': []
+        }
+
+    def test_count(self):
+        '''Each collection and search area is counted with a single limit=1 request, with numberMatched None where only a lower bound is known.'''
+        api = FakeNGDAPI(self.features)
+        with api.patch():
+            summary = items_count(
+                collection=list(self.features),
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                authenticate=False
+            )
+        self.assertEqual(summary['numberOfRequests'], 6)
+        self.assertEqual(len(api.requests), 6)
+        self.assertTrue(all(params['limit'] == '1' for _, params in api.requests))
+        self.assertEqual(api.number_fetched, 4)
+        self.assertTrue(summary['exists'])
+        self.assertIsNone(summary['numberMatched'])
+        building, road, water = (summary['collections'][col] for col in self.features)
+        self.assertEqual((building['exists'], building['numberMatched']), (True, None))
+        self.assertEqual((road['exists'], road['numberMatched']), (True, 2))
+        self.assertEqual((water['exists'], water['numberMatched']), (False, 0))
+        self.assertEqual([area['searchAreaNumber'] for area in road['searchAreas']], [0, 1])
+
+    def test_count_number_matched(self):
+        '''Counts are exact where the API reports numberMatched, and search areas are only listed for a wkt.'''
+        api = FakeNGDAPI(self.features, report_number_matched=True)
+        with api.patch():
+            summary = items_count(collection=list(self.features), authenticate=False)
+        self.assertEqual(summary['numberMatched'], 6)
+        self.assertEqual(summary['collections']['bld-fts-building-4'], {'exists': True, 'numberMatched': 5})
+        self.assertEqual(summary['collections']['wtr-fts-water-3'], {'exists': False, 'numberMatched': 0})
+
+    def test_exists_stops_at_first_match(self):
+        '''No further requests are made once a match is found, across search areas and collections.'''
+        api = FakeNGDAPI(self.features)
+        with api.patch():
+            summary = items_exists(
+                collection=['wtr-fts-water-3', 'trn-ntwk-road-1', 'bld-fts-building-4'],
+                wkt='MULTIPOINT ((0 0), (1 1))',
+                authenticate=False
+            )
+        self.assertTrue(summary['exists'])
+        self.assertEqual(summary['numberOfRequests'], 3)
+        self.assertEqual(len(api.requests), 3)
+        self.assertEqual(list(summary['collections']), ['wtr-fts-water-3', 'trn-ntwk-road-1'])
+        self.assertEqual(len(summary['collections']['trn-ntwk-road-1']['searchAreas']), 1)
+
+        api = FakeNGDAPI(self.features)
+        with api.patch():
+            summary = items_exists(collection='wtr-fts-water-3', wkt='MULTIPOINT ((0 0), (1 1))', authenticate=False)
+        self.assertFalse(summary['exists'])
+        self.assertEqual(len(api.requests), 2)
+
+    def test_paging_parameters_rejected(self):
+        '''limit and offset cannot be supplied.'''
+        response = items_count(collection='bld-fts-building-4', params={'limit': 10})
+        self.assertEqual(response['code'], 400)
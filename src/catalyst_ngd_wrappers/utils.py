@@ -1,9 +1,12 @@
 '''Miscellaneous utility functions for the OS NGD API - Features wrappers.'''
 
 from json import JSONDecodeError
+from datetime import datetime
+from typing import TYPE_CHECKING
 
-from shapely.geometry import Point, LineString, Polygon
-from shapely.geometry.base import BaseGeometry
+if TYPE_CHECKING:
+    from shapely.geometry import Point, LineString, Polygon
+    from shapely.geometry.base import BaseGeometry
 
 def flatten_coords(list_of_lists: list) -> list:
     '''Flattens the coordinates of geojson features into a flattened list of coordinate pairs.'''
@@ -72,11 +75,12 @@ def prepare_parameters(
     return query_params
 
 
-def multilevel_explode(shape: BaseGeometry) -> list[Polygon | LineString | Point]:
+def multilevel_explode(shape: 'BaseGeometry') -> list['Polygon | LineString | Point']:
     '''
     Explode a geometry into its constituent parts.
     Where multigeometries contain other multigeometries, the layers are flattened into a single list, such that the results lists contains only single geomtries.
     '''
+    from shapely.geometry import Point, LineString, Polygon
 
     if isinstance(shape, (Point, LineString, Polygon)):
         return [shape]
@@ -118,3 +122,55 @@ def handle_decode_error(error: JSONDecodeError, status_code: int = 500) -> dict:
         status_code = status_code,
         error_source = 'OS NGD API'
     )
+
+def allocate_budget(remaining: int | None, parts_remaining: int) -> int | None:
+    '''
+    Allocates a fair share of a remaining call-level budget to the next of a number of remaining parts (search areas or collections).
+    The remaining budget is divided evenly, rounding up, so that any budget left unused by earlier parts is redistributed to later ones.
+    Returns None when no budget applies.
+    '''
+    if remaining is None:
+        return None
+    remaining = max(remaining, 0)
+    return -(-remaining // max(parts_remaining, 1))
+
+def budget_usage(response: dict) -> tuple[int, int]:
+    '''
+    Returns the number of requests made and features fetched for a response, for deduction from a call-level budget.
+    Hedged requests ('numberOfHedgedRequests') are paid for, so are counted as requests made.
+    Features are counted as fetched from the API ('numberFetched'), including any later dropped by spatial post-processing or de-duplication between search areas,
+    or written to a feature sink rather than returned.
+    Handles both flat GeoJSON responses and hierarchical search area responses.
+    '''
+    if 'searchAreas' in response:
+        usage = [budget_usage(area) for area in response['searchAreas']]
+        return sum(u[0] for u in usage), sum(u[1] for u in usage)
+    number_fetched = response.get('numberFetched', response.get('numberReturned', len(response.get('features', []))))
+    return response.get('numberOfRequests', 0) + response.get('numberOfHedgedRequests', 0), number_fetched
+
+def construct_budget_exhausted_response(collection: str = None) -> dict:
+    '''Constructs an empty GeoJSON response for a search which was skipped because the call-level budget has been exhausted.'''
+    return {
+        'type': 'FeatureCollection',
+        'numberOfRequests': 0,
+        'numberFetched': 0,
+        'numberReturned': 0,
+        'timeStamp': datetime.now().isoformat(),
+        'collection': collection,
+        'features': [],
+        'budgetExhausted': True
+    }
+
+def construct_dry_run_response(url: str) -> dict:
+    '''
+    Constructs the response to a request planned in a dry run: an empty page with a next page, so that the wrappers plan the greatest number of requests.
+    '''
+    return {
+        'type': 'FeatureCollection',
+        'numberReturned': 0,
+        'features': [],
+        'links': [{'rel': 'next', 'href': url}],
+        'code': 200,
+        'numberOfRequests': 1,
+        'numberFetched': 0
+    }